@@ -0,0 +1,253 @@
+# -*- coding: utf-8 -*-
+"""
+Per-action phase timings recorded into preallocated arrays and flushed in the background
+
+    python action_metrics.py log/*.metrics.jsonl    # 汇总多次运行的各动作耗时
+"""
+
+import csv
+import json
+import os
+import sys
+import threading
+import time
+from queue import Queue
+
+import numpy as np
+
+# 动作内部的各个阶段: 规避运动、拍照、模板匹配、机械臂移动、抬笔落笔、等待机械臂停止、等待指令队列空位
+PHASES = ('detour', 'capture', 'match', 'move', 'pen', 'wait', 'queue')
+# 每条动作记录的字段
+METRICS_FIELDS = ('action', 'start', 'total') + PHASES
+METRICS_FORMATS = ('JSONL', 'CSV')
+
+
+class MetricsBuffer(object):
+    """预先分配的动作记录缓冲区
+
+    Attributes:
+        action_codes: 动作类型编号
+        start_times: 动作开始时间(time.time)
+        times: 每行依次为动作总耗时和各阶段耗时(秒)
+        count: 已记录的动作数
+    """
+
+    def __init__(self, capacity):
+        self.action_codes = np.zeros(capacity, dtype=np.int32)
+        self.start_times = np.zeros(capacity)
+        self.times = np.zeros((capacity, len(PHASES) + 1))
+        self.count = 0
+
+    def is_full(self):
+        return self.count == len(self.action_codes)
+
+
+class ActionMetrics(object):
+    """记录每个动作的总耗时和各阶段耗时
+
+    动作记录写入预先分配的缓冲区，缓冲区写满或关闭时交给后台线程以JSON Lines或CSV格式追加到文件中，
+    记录过程中不进行格式化和文件写入。各阶段耗时使用单调时钟测量，同一阶段多次发生时累加
+
+    Attributes:
+        metrics_path: 记录文件路径，为None时不写入文件
+        metrics_format: 'JSONL' 或 'CSV'
+        action_types: 动作类型列表，下标为动作类型编号
+        history: 已写满的缓冲区中的动作类型编号和耗时，用于统计
+    """
+
+    def __init__(self, metrics_path=None, metrics_format='JSONL', capacity=256):
+        self.metrics_path = metrics_path
+        self.metrics_format = metrics_format
+        self.capacity = capacity
+        self.action_types = []
+        self.action_codes = {}
+        self.history = []
+        self.buffer = MetricsBuffer(capacity)
+        self.current = None  # 当前动作在缓冲区中的行号
+        self.current_start = 0  # 当前动作开始的单调时钟时间
+        self.lock = threading.Lock()
+
+        self.free_buffers = Queue()
+        self.flush_queue = Queue()
+        self.flush_thread = threading.Thread(target=self.__flush_loop, daemon=True)
+        self.flush_thread.start()
+        self.is_closed = False
+
+    def begin(self, action_type):
+        """记录动作开始"""
+        with self.lock:
+            if self.is_closed:
+                return
+            if self.buffer.is_full():
+                self.__flush()
+            code = self.action_codes.get(action_type)
+            if code is None:
+                code = self.action_codes[action_type] = len(self.action_types)
+                self.action_types.append(action_type)
+            row = self.buffer.count
+            self.buffer.count += 1
+            self.buffer.action_codes[row] = code
+            self.buffer.start_times[row] = time.time()
+            self.buffer.times[row] = 0
+            self.current = row
+            self.current_start = time.perf_counter()
+
+    def add(self, phase, seconds):
+        """累加当前动作某一阶段的耗时，不在动作中时忽略"""
+        with self.lock:
+            if self.current is not None:
+                self.buffer.times[self.current, PHASES.index(phase) + 1] += seconds
+
+    def end(self):
+        """记录动作结束"""
+        with self.lock:
+            if self.current is not None:
+                self.buffer.times[self.current, 0] = time.perf_counter() - self.current_start
+                self.current = None
+
+    def __flush(self):
+        """将当前缓冲区交给后台线程写入，换用空闲的缓冲区"""
+        buffer = self.buffer
+        if buffer.count == 0:
+            return
+        self.history.append((buffer.action_codes[:buffer.count].copy(),
+                             buffer.times[:buffer.count].copy()))
+        self.flush_queue.put((buffer, list(self.action_types)))
+        if self.free_buffers.empty():
+            self.buffer = MetricsBuffer(self.capacity)
+        else:
+            self.buffer = self.free_buffers.get()
+            self.buffer.count = 0
+
+    def __flush_loop(self):
+        """后台线程: 格式化并追加写入记录"""
+        while True:
+            item = self.flush_queue.get()
+            if item is None:
+                return
+            buffer, action_types = item
+            if self.metrics_path is not None:
+                try:
+                    write_records(self.metrics_path, self.metrics_format,
+                                  buffer_to_records(buffer, action_types))
+                except OSError as e:
+                    print("Cannot write action metrics: {}".format(e))
+            self.free_buffers.put(buffer)
+
+    def get_records(self):
+        """获取已记录的全部动作(包括未写入文件的动作)"""
+        with self.lock:
+            history = list(self.history)
+            codes = self.buffer.action_codes[:self.buffer.count].copy()
+            times = self.buffer.times[:self.buffer.count].copy()
+            action_types = list(self.action_types)
+        history.append((codes, times))
+        records = []
+        for codes, times in history:
+            for code, row in zip(codes, times):
+                record = {'action': action_types[code], 'total': row[0]}
+                record.update(zip(PHASES, row[1:]))
+                records.append(record)
+        return records
+
+    def summary(self):
+        """按动作类型统计总耗时及各阶段耗时的p50/p95，参见summarize"""
+        return summarize(self.get_records())
+
+    def close(self):
+        """写入剩余的记录并结束后台线程"""
+        with self.lock:
+            if self.is_closed:
+                return
+            self.is_closed = True
+            self.current = None
+            self.__flush()
+            self.flush_queue.put(None)
+        self.flush_thread.join()
+
+
+def buffer_to_records(buffer, action_types):
+    """将缓冲区转换为记录列表"""
+    records = []
+    for i in range(buffer.count):
+        record = {'action': action_types[buffer.action_codes[i]],
+                  'start': round(float(buffer.start_times[i]), 3)}
+        record.update(zip(('total',) + PHASES,
+                          (round(float(t), 4) for t in buffer.times[i])))
+        records.append(record)
+    return records
+
+
+def write_records(metrics_path, metrics_format, records):
+    """以JSON Lines或CSV格式追加写入记录，CSV文件为新文件时先写表头"""
+    if metrics_format == 'CSV':
+        write_header = not os.path.exists(metrics_path)
+        with open(metrics_path, 'a', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=METRICS_FIELDS)
+            if write_header:
+                writer.writeheader()
+            writer.writerows(records)
+    else:
+        with open(metrics_path, 'a') as f:
+            for record in records:
+                f.write(json.dumps(record))
+                f.write('\n')
+
+
+def read_records(metrics_path):
+    """读取JSON Lines或CSV格式的记录文件"""
+    with open(metrics_path, newline='') as f:
+        if metrics_path.lower().endswith('.csv'):
+            records = list(csv.DictReader(f))
+            for record in records:
+                for field in METRICS_FIELDS[1:]:
+                    # 之前版本的记录文件中没有的阶段记为0
+                    record[field] = float(record.get(field) or 0)
+            return records
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def summarize(records):
+    """按动作类型统计总耗时及各阶段耗时的p50/p95
+
+    Args:
+        records: 动作记录列表，每条记录包含'action', 'total'和各阶段的耗时
+    Returns:
+        dict, 动作类型 -> {'count': 动作数, 'total': {'p50': 秒, 'p95': 秒}, 各阶段: {'p50': 秒, 'p95': 秒}}
+    """
+    grouped = {}
+    for record in records:
+        grouped.setdefault(record['action'], []).append(
+            [record['total']] + [record.get(phase, 0) for phase in PHASES])
+
+    summary = {}
+    for action_type, rows in grouped.items():
+        times = np.array(rows)
+        p50, p95 = np.percentile(times, [50, 95], axis=0)
+        summary[action_type] = {'count': len(rows)}
+        for i, field in enumerate(('total',) + PHASES):
+            summary[action_type][field] = {'p50': float(p50[i]), 'p95': float(p95[i])}
+    return summary
+
+
+def format_summary(summary):
+    """将统计结果格式化为文本行，每个动作类型一行"""
+    lines = []
+    for action_type, stats in sorted(summary.items(), key=lambda item: -item[1]['count']):
+        phases = ', '.join('{}: {:.2f}/{:.2f}s'.format(phase, stats[phase]['p50'], stats[phase]['p95'])
+                           for phase in PHASES if stats[phase]['p95'] > 0)
+        lines.append('{}, times: {}, total p50/p95: {:.2f}/{:.2f}s{}'
+                     .format(action_type, stats['count'], stats['total']['p50'],
+                             stats['total']['p95'], ', ' + phases if phases else ''))
+    return lines
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print("Usage: action_metrics.py <metrics files>...")
+        sys.exit(1)
+    all_records = []
+    for path in sys.argv[1:]:
+        all_records += read_records(path)
+    for line in format_summary(summarize(all_records)):
+        print(line)
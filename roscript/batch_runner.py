@@ -0,0 +1,215 @@
+# -*- coding: utf-8 -*-
+"""
+Run many recorded test scripts in virtual debug mode in parallel worker processes
+
+    python batch_runner.py <scripts dir> [-vdf_root <records dir>] [-j 4] [-o report.json]
+
+每个脚本在单独的进程中运行，进程的工作目录为脚本所在目录，配置、日志等模块状态互不影响
+"""
+
+import argparse
+import atexit
+import contextlib
+import io
+import json
+import multiprocessing
+import multiprocessing.connection
+import os
+import re
+import runpy
+import sys
+import time
+
+CODE_BASE = os.path.dirname(os.path.abspath(__file__))
+# 虚拟调试中表示动作失败的输出
+FAILED_PATTERN = re.compile(r"^\[Virtual Debug\] .*(Failed|: No on screen)")
+
+
+def find_scripts(scripts_dir):
+    """查找目录中的测试脚本，即创建了Rcs对象的python文件"""
+    scripts = []
+    for root, dirs, files in os.walk(scripts_dir):
+        dirs[:] = sorted(d for d in dirs if not d.startswith(('.', '__')))
+        for file_name in sorted(files):
+            if not file_name.endswith('.py'):
+                continue
+            script_path = os.path.join(root, file_name)
+            with open(script_path, encoding='utf-8', errors='replace') as f:
+                if 'Rcs(' in f.read():
+                    scripts.append(os.path.abspath(script_path))
+    return scripts
+
+
+def get_record_folder(script_path, records_dir):
+    """获取脚本的执行记录目录(包含config和temp)，没有时使用脚本目录下的temp"""
+    if records_dir is None:
+        return None
+    script_name = os.path.splitext(os.path.basename(script_path))[0]
+    record_folder = os.path.join(records_dir, script_name)
+    return record_folder if os.path.isdir(record_folder) else None
+
+
+def run_script(script_path, record_folder=None):
+    """在当前进程中以虚拟调试模式运行一个脚本，只能在新的子进程中调用
+
+    Returns:
+        dict, 脚本路径、是否通过、运行时间(秒)、失败的动作和异常信息
+    """
+    script_dir = os.path.dirname(script_path)
+    os.chdir(script_dir)
+    sys.path[:0] = [script_dir, CODE_BASE]
+    sys.argv = [script_path, '-vd']
+    if record_folder is not None:
+        sys.argv += ['-vdf', record_folder]
+
+    output = io.StringIO()
+    error = None
+    start_time = time.perf_counter()
+    with contextlib.redirect_stdout(output):
+        try:
+            runpy.run_path(script_path, run_name='__main__')
+        except SystemExit as e:
+            if e.code not in (None, 0):
+                error = 'SystemExit({})'.format(e.code)
+        except Exception as e:
+            error = '{}: {}'.format(type(e).__name__, e)
+        finally:
+            # 脚本注册的退出处理，例如写入动作记录和日志
+            atexit._run_exitfuncs()
+    duration = time.perf_counter() - start_time
+
+    failures = [line for line in output.getvalue().splitlines() if FAILED_PATTERN.match(line)]
+    return {
+        'script': script_path,
+        'passed': error is None and not failures,
+        'time': round(duration, 3),
+        'failures': failures,
+        'error': error,
+    }
+
+
+def run_worker(script_path, record_folder, connection):
+    """子进程入口，运行一个脚本并通过管道返回结果"""
+    try:
+        result = run_script(script_path, record_folder)
+    except Exception as e:
+        result = {'script': script_path, 'passed': False, 'time': 0,
+                  'failures': [], 'error': '{}: {}'.format(type(e).__name__, e)}
+    connection.send(result)
+    connection.close()
+
+
+def print_result(result):
+    print('{} {:7.2f}s {}'.format('PASS' if result['passed'] else 'FAIL',
+                                   result['time'], result['script']), flush=True)
+    for message in result['failures'] + ([result['error']] if result['error'] else []):
+        print('    ' + message)
+
+
+def run_batch(scripts, records_dir=None, processes=None, timeout=None):
+    """同时在多个进程中运行脚本，每个脚本使用单独的进程
+
+    Args:
+        scripts: 脚本路径列表
+        records_dir: 执行记录根目录，其中以脚本名命名的子目录作为该脚本的虚拟调试目录
+        processes: 同时运行的进程数，默认为CPU核数
+        timeout: 单个脚本从开始运行起的最长运行时间(秒)，超时的脚本进程被结束并记为失败
+    Returns:
+        各脚本的运行结果列表，顺序与scripts相同
+    """
+    # 使用spawn保证子进程重新导入各模块，不继承父进程的模块状态
+    context = multiprocessing.get_context('spawn')
+    processes = processes or os.cpu_count() or 1
+    pending = list(enumerate(scripts))
+    running = {}  # 结果管道 -> (脚本编号, 脚本路径, 进程, 截止时间)
+    results = [None] * len(scripts)
+    try:
+        while pending or running:
+            while pending and len(running) < processes:
+                index, script = pending.pop(0)
+                reader, writer = context.Pipe(duplex=False)
+                process = context.Process(target=run_worker, daemon=True,
+                                          args=(script, get_record_folder(script, records_dir), writer))
+                process.start()
+                writer.close()
+                deadline = None if timeout is None else time.monotonic() + timeout
+                running[reader] = (index, script, process, deadline)
+
+            # 等待任一脚本结束或最早的截止时间
+            deadlines = [deadline for _, _, _, deadline in running.values() if deadline is not None]
+            wait_time = max(0, min(deadlines) - time.monotonic()) if deadlines else None
+            ready = multiprocessing.connection.wait(list(running), wait_time)
+            now = time.monotonic()
+            for reader in list(running):
+                index, script, process, deadline = running[reader]
+                if reader in ready:
+                    try:
+                        result = reader.recv()
+                    except EOFError:
+                        process.join()
+                        result = {'script': script, 'passed': False, 'time': 0, 'failures': [],
+                                  'error': 'Worker exited with code {}'.format(process.exitcode)}
+                elif deadline is not None and now >= deadline:
+                    process.terminate()
+                    result = {'script': script, 'passed': False, 'time': timeout,
+                              'failures': [], 'error': 'Timeout'}
+                else:
+                    continue
+                process.join()
+                reader.close()
+                del running[reader]
+                print_result(result)
+                results[index] = result
+    finally:
+        for reader, (index, script, process, deadline) in running.items():
+            process.terminate()
+            process.join()
+            reader.close()
+    return results
+
+
+def summarize_results(results, wall_time):
+    """汇总通过数、失败数和运行时间分布"""
+    times = sorted(result['time'] for result in results)
+
+    def percentile(rate):
+        return times[min(len(times) - 1, int(rate * len(times)))] if times else 0
+
+    return {
+        'scripts': len(results),
+        'passed': sum(1 for result in results if result['passed']),
+        'failed': sum(1 for result in results if not result['passed']),
+        'wall_time': round(wall_time, 3),
+        'script_time': round(sum(times), 3),
+        'p50': percentile(0.5),
+        'p95': percentile(0.95),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run recorded test scripts in virtual debug mode.")
+    parser.add_argument("scripts_dir", help="directory searched recursively for test scripts")
+    parser.add_argument("-vdf_root", action="store", dest="records_dir", default=None,
+                        help="directory of exec record folders, one per script name")
+    parser.add_argument("-j", action="store", dest="processes", type=int, default=None,
+                        help="number of worker processes, default to the CPU count")
+    parser.add_argument("-t", action="store", dest="timeout", type=float, default=None,
+                        help="timeout of a single script in seconds")
+    parser.add_argument("-o", action="store", dest="report", default=None,
+                        help="write a JSON report to this file")
+    options = parser.parse_args()
+
+    scripts = find_scripts(options.scripts_dir)
+    start_time = time.perf_counter()
+    results = run_batch(scripts, options.records_dir, options.processes, options.timeout)
+    summary = summarize_results(results, time.perf_counter() - start_time)
+    print("scripts: {scripts}, passed: {passed}, failed: {failed}, wall time: {wall_time:.2f}s, "
+          "script time: {script_time:.2f}s, p50: {p50:.2f}s, p95: {p95:.2f}s".format(**summary))
+    if options.report is not None:
+        with open(options.report, 'w') as f:
+            json.dump({'summary': summary, 'results': results}, f, indent=4)
+    sys.exit(0 if summary['failed'] == 0 else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark of a full calibration write cycle: separate writes vs one config transaction
+
+在临时目录中复制配置文件后运行，不修改正在使用的配置文件
+    python benchmark_config_update.py [-n 20]
+"""
+
+import argparse
+import json
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+
+import config
+from config import Config
+
+
+def calibration_write_cycle(round_idx):
+    """依次执行一次完整标定流程中的各项配置修改"""
+    Config.update_focal_length(70 + round_idx % 5)
+    Config.update_calibration_result({'rms': 0.1,
+                                      'intrinsic_matrix': np.eye(3).tolist(),
+                                      'distortion_coefficients': [0.0] * 5,
+                                      'pixel_to_physical': 52.0 + round_idx % 3})
+    Config.update_model_contour()
+    Config.update_circle_to_pen([-1200 - round_idx, 1800])
+    Config.update_robot_layout(np.array([[0, 1], [1, 0]]))
+    Config.update_tip_height(5200 + round_idx)
+    Config.update_tip_fall_center(320 + round_idx, 240)
+    Config.update_ports(['COM3', 'COM4'])
+
+
+def prepare_config_dir(work_dir):
+    """复制配置文件到临时目录，并将配置路径指向临时目录"""
+    config_dir = os.path.join(work_dir, 'config')
+    os.makedirs(config_dir)
+    output_dir = os.path.join(work_dir, 'output')
+    os.makedirs(output_dir)
+    shutil.copy(config.g_config_path, os.path.join(config_dir, 'config.yaml'))
+    shutil.copy(config.g_sut_path, os.path.join(config_dir, 'sut.yaml'))
+    with open(os.path.join(config_dir, 'frontend_options.yaml'), 'w') as f:
+        f.write('ports: []\n')
+
+    Config.load_config(os.path.join(config_dir, 'config.yaml'))
+    Config.load_sut_config(os.path.join(config_dir, 'sut.yaml'))
+    config.g_camera_data_path = os.path.join(config_dir, 'camera.json')
+    config.g_frontend_options_path = os.path.join(config_dir, 'frontend_options.yaml')
+    config.g_tool_home = work_dir
+    with open(os.path.join(output_dir, 'temporary.json'), 'w') as f:
+        json.dump({'x': 100, 'y': 80, 'width': 900, 'height': 1800}, f)
+
+
+def run(rounds, use_transaction):
+    """运行若干次标定写入流程，返回每次的耗时(毫秒)和文件写入次数"""
+    write_count = [0]
+    write_file_atomic = config.write_file_atomic
+
+    def counting_write(file_path, write):
+        write_count[0] += 1
+        write_file_atomic(file_path, write)
+
+    config.write_file_atomic = counting_write
+    durations = []
+    try:
+        for i in range(rounds):
+            start = time.perf_counter()
+            if use_transaction:
+                with Config.transaction():
+                    calibration_write_cycle(i)
+            else:
+                calibration_write_cycle(i)
+            durations.append((time.perf_counter() - start) * 1000)
+    finally:
+        config.write_file_atomic = write_file_atomic
+    return durations, write_count[0] / rounds
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark of calibration config writes.")
+    parser.add_argument("-n", action="store", dest="rounds", type=int, default=20,
+                        help="number of calibration write cycles")
+    options = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix='roscript_config_')
+    try:
+        prepare_config_dir(work_dir)
+        for name, use_transaction in (('separate writes', False), ('transaction', True)):
+            durations, writes = run(options.rounds, use_transaction)
+            print('{:<16} cycle p50 {:7.2f} ms  p95 {:7.2f} ms  file writes/cycle {:.0f}'
+                  .format(name, np.percentile(durations, 50), np.percentile(durations, 95), writes))
+    finally:
+        shutil.rmtree(work_dir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,201 @@
+# -*- coding: utf-8 -*-
+"""
+End-to-end benchmark of the action latency with a simulated robot and camera
+
+    python benchmark_rcs_actions.py [corpus dir] [-script send_sms.py] [-swipe up down] [-r 3] [-o report.json]
+
+语料目录与演示用例的结构相同: 测试脚本、images/*.png为控件图像，temp/*.png为录制的屏幕图像。
+默认使用demo/Iphone5S/iOS-Sys。机器人和摄像头由simulation模块模拟，电机运动按指令的运行时间实际等待，
+拍照时返回与拍照编号对应的录制图像，因此脚本中的点击、输入等动作与录制时匹配到相同的控件。
+脚本运行结束后，使用脚本创建的Rcs对象依次执行-swipe指定的滑动动作。
+
+每次运行在新的进程中进行，工作目录为语料目录的临时副本，不修改语料目录。
+报告各动作类型的总耗时和各阶段耗时的p50/p95: wait为等待机械臂停止的时间，queue为指令队列已满时等待加入指令的时间，
+move和pen为加入指令队列的指令的预计运行时间，与其他阶段并行；other为总耗时中除规避、拍照、匹配、wait和queue之外的时间
+"""
+
+import argparse
+import atexit
+import contextlib
+import io
+import json
+import multiprocessing
+import os
+import platform
+import runpy
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+CODE_BASE = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_CORPUS = os.path.join(CODE_BASE, 'demo', 'Iphone5S', 'iOS-Sys')
+DEFAULT_SWIPES = ['up', 'down']
+# 语料目录中不复制到工作目录的运行结果
+RUN_OUTPUTS = ('temp', 'log', 'test', 'video', '__pycache__')
+
+
+def find_script(corpus_dir, script_name=None):
+    """查找语料目录中的测试脚本，未指定时使用第一个创建了Rcs对象的脚本"""
+    if script_name is not None:
+        return os.path.join(corpus_dir, script_name)
+    sys.path.insert(0, CODE_BASE)
+    from batch_runner import find_scripts
+    scripts = [script for script in find_scripts(corpus_dir)
+               if os.path.dirname(script) == corpus_dir]
+    if not scripts:
+        raise Exception('No test script in {}'.format(corpus_dir))
+    return scripts[0]
+
+
+def run_simulated(corpus_dir, script_path, swipes, frame_interval, firmware_version):
+    """在当前进程中以模拟的机器人和摄像头运行一次脚本，只能在新的子进程中调用
+
+    Returns:
+        dict, 运行时间(秒)、各动作的耗时记录、指令队列和拍照的统计，出错时包含异常信息
+    """
+    work_dir = tempfile.mkdtemp(prefix='roscript_sim_')
+    try:
+        shutil.copytree(corpus_dir, work_dir, dirs_exist_ok=True,
+                        ignore=lambda folder, names: [name for name in names
+                                                      if folder == corpus_dir and name in RUN_OUTPUTS])
+        os.chdir(work_dir)
+        sys.path[:0] = [work_dir, CODE_BASE]
+        script_name = os.path.basename(script_path)
+        sys.argv = [os.path.join(work_dir, script_name)]
+
+        import simulation
+        from rcs import Rcs
+        simulation.install(os.path.join(corpus_dir, 'temp'),
+                           [os.path.splitext(script_name)[0], os.path.basename(corpus_dir)],
+                           frame_interval, firmware_version)
+
+        output = io.StringIO()
+        error = None
+        rcs = None
+        start_time = time.perf_counter()
+        with contextlib.redirect_stdout(output):
+            try:
+                script_globals = runpy.run_path(sys.argv[0], run_name='__main__')
+                rcs = next((value for value in script_globals.values() if isinstance(value, Rcs)), None)
+                for direction in swipes if rcs is not None else []:
+                    rcs.swipe(direction)
+            except SystemExit as e:
+                if e.code not in (None, 0):
+                    error = 'SystemExit({})'.format(e.code)
+            except Exception as e:
+                error = '{}: {}'.format(type(e).__name__, e)
+            finally:
+                # 复位机械臂、等待指令队列结束并写入日志
+                atexit._run_exitfuncs()
+        duration = time.perf_counter() - start_time
+
+        if rcs is None:
+            return {'time': duration, 'records': [], 'error': error or 'No Rcs object in the script'}
+        batch_count, command_count, skipped_count = rcs.robot_dev.cq.get_batch_stats()
+        return {
+            'time': duration,
+            'records': rcs.log.metrics.get_records(),
+            'serial_writes': batch_count,
+            'commands': command_count,
+            'skipped_commands': skipped_count,
+            'photos': simulation.SIMULATED_CAMERA.photo_count,
+            'error': error,
+        }
+    finally:
+        os.chdir(tempfile.gettempdir())
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def run_task(task):
+    """子进程入口"""
+    try:
+        return run_simulated(*task)
+    except Exception as e:
+        return {'time': 0, 'records': [], 'error': '{}: {}'.format(type(e).__name__, e)}
+
+
+def summarize_runs(runs):
+    """合并各次运行的动作记录，按动作类型统计各阶段耗时的p50/p95"""
+    sys.path.insert(0, CODE_BASE)
+    from action_metrics import PHASES, summarize
+
+    records = []
+    for run in runs:
+        for record in run['records']:
+            record = dict(record)
+            record['other'] = max(0.0, record['total'] - sum(record[phase] for phase in
+                                                             ('detour', 'capture', 'match', 'wait', 'queue')))
+            records.append(record)
+    summary = summarize(records)
+    for action_type, stats in summary.items():
+        others = [record['other'] for record in records if record['action'] == action_type]
+        p50, p95 = np.percentile(others, [50, 95])
+        stats['other'] = {'p50': float(p50), 'p95': float(p95)}
+    return summary, ('total',) + PHASES + ('other',)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark of the action latency with a simulated robot.")
+    parser.add_argument("corpus", nargs='?', default=DEFAULT_CORPUS,
+                        help="corpus directory with a test script, images/*.png and temp/*.png")
+    parser.add_argument("-script", action="store", dest="script", default=None,
+                        help="test script in the corpus directory, default to the first one found")
+    parser.add_argument("-swipe", nargs='*', dest="swipes", default=DEFAULT_SWIPES,
+                        help="swipe directions performed after the script")
+    parser.add_argument("-r", action="store", dest="repeats", type=int, default=3,
+                        help="number of runs")
+    parser.add_argument("-fps", action="store", dest="fps", type=float, default=None,
+                        help="simulated camera frame rate, default to the SUT monitor frame rate")
+    parser.add_argument("-fw", action="store", dest="firmware", default=None,
+                        help="simulated EBB firmware version, e.g. 2.7.0 supports HM")
+    parser.add_argument("-o", action="store", dest="report", default=None,
+                        help="write the JSON report to this file")
+    options = parser.parse_args()
+
+    corpus_dir = os.path.abspath(options.corpus)
+    script_path = find_script(corpus_dir, options.script)
+    frame_interval = None if options.fps is None else 1.0 / options.fps
+    task = (corpus_dir, script_path, options.swipes, frame_interval, options.firmware)
+    print("{}: {} run(s), swipes: {}".format(script_path, options.repeats, ' '.join(options.swipes) or '-'),
+          flush=True)
+
+    # 每次运行在新的进程中进行，模块状态互不影响
+    pool = multiprocessing.get_context('spawn').Pool(1, maxtasksperchild=1)
+    runs = []
+    try:
+        for i, run in enumerate(pool.imap(run_task, [task] * options.repeats)):
+            print("run {}: {:.2f}s, {} actions, {} photos, {} serial writes{}".format(
+                i + 1, run['time'], len(run['records']), run.get('photos', 0), run.get('serial_writes', 0),
+                ', error: ' + run['error'] if run['error'] else ''), flush=True)
+            runs.append(run)
+    finally:
+        pool.terminate()
+        pool.join()
+
+    summary, fields = summarize_runs(runs)
+    print("{:<16}{:>6}".format('action', 'count') + ''.join('{:>16}'.format(field) for field in fields))
+    for action_type, stats in sorted(summary.items(), key=lambda item: -item[1]['count']):
+        print("{:<16}{:>6}".format(action_type, stats['count']) +
+              ''.join('{:>16}'.format('{:.3f}/{:.3f}'.format(stats[field]['p50'], stats[field]['p95']))
+                      for field in fields))
+    print("p50/p95 in seconds")
+
+    if options.report is not None:
+        report = {
+            'environment': {'python': platform.python_version(), 'numpy': np.__version__,
+                            'platform': platform.platform(), 'cpu_count': os.cpu_count()},
+            'settings': {'corpus': corpus_dir, 'script': script_path, 'swipes': options.swipes,
+                         'repeats': options.repeats, 'fps': options.fps, 'firmware': options.firmware},
+            'summary': summary,
+            'runs': runs,
+        }
+        with open(options.report, 'w') as f:
+            json.dump(report, f, indent=4)
+    sys.exit(0 if all(run['error'] is None for run in runs) else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,272 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark of the template matchers over recorded frames and widgets
+
+    python benchmark_template_match.py [corpus dir ...] [-m tcfn sift] [-s 1 0.75 0.5] [-r 5] [-o report.json]
+
+语料目录与演示用例的结构相同: temp/*.png为拍摄的屏幕图像，images/*.png为控件图像，
+config/sut.yaml中的ContourPosition为设备轮廓(可选)。默认使用demo/Iphone5S/iOS-Sys。
+
+标注框从语料目录中的ground_truth.json读取，格式为
+    {"boxes": [{"frame": "send_sms_1.png", "widget": "message.png", "bounds": [x1, y1, x2, y2]}, ...]}
+坐标为屏幕图像中的像素坐标。没有标注文件时，以原始分辨率下tcfn相似度不低于0.95的匹配位置作为标注，
+可以用-save_gt保存后人工检查。
+
+每个匹配算法和分辨率在单独的进程中依次运行，报告匹配耗时分布、内存峰值和定位准确率
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import sys
+import time
+import tracemalloc
+
+import cv2
+import numpy as np
+from ruamel import yaml
+
+CODE_BASE = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_CORPUS = os.path.join(CODE_BASE, 'demo', 'Iphone5S', 'iOS-Sys')
+DEFAULT_SCALES = [1.0, 0.75, 0.5]
+GROUND_TRUTH_MATCHER = 'tcfn'
+GROUND_TRUTH_SIMILARITY = 0.95
+IOU_THRESHOLD = 0.5  # 匹配框与标注框的交并比不低于该值时定位正确
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+def read_corpus(corpus_dir):
+    """读取语料目录中的屏幕图像、控件图像和设备轮廓
+
+    Returns:
+        dict, 'frames': {文件名: 图像}, 'widgets': {文件名: 图像}, 'contour': [x1, y1, x2, y2]
+    """
+    def read_images(folder):
+        folder = os.path.join(corpus_dir, folder)
+        if not os.path.isdir(folder):
+            return {}
+        return {name: cv2.imread(os.path.join(folder, name))
+                for name in sorted(os.listdir(folder)) if name.lower().endswith('.png')}
+
+    frames = read_images('temp')
+    widgets = read_images('images')
+    sut_path = os.path.join(corpus_dir, 'config', 'sut.yaml')
+    if os.path.isfile(sut_path):
+        with open(sut_path) as f:
+            position = yaml.load(f, Loader=yaml.Loader)['Model']['ContourPosition']
+        contour = [position['x'], position['y'],
+                   position['x'] + position['width'], position['y'] + position['height']]
+    else:
+        h, w = next(iter(frames.values())).shape[:2]
+        contour = [0, 0, w, h]
+    return {'frames': frames, 'widgets': widgets, 'contour': contour}
+
+
+def get_ground_truth(corpus_dir, corpus):
+    """读取标注框，没有标注文件时用原始分辨率下的高相似度匹配结果生成"""
+    ground_truth_path = os.path.join(corpus_dir, 'ground_truth.json')
+    if os.path.isfile(ground_truth_path):
+        with open(ground_truth_path) as f:
+            return json.load(f)['boxes'], ground_truth_path
+
+    import template_match
+    x1, y1, x2, y2 = corpus['contour']
+    boxes = []
+    for frame_name, frame in corpus['frames'].items():
+        device_image = frame[y1:y2, x1:x2]
+        for widget_name, widget in corpus['widgets'].items():
+            result = template_match.TEMPLATE_MATCHERS[GROUND_TRUTH_MATCHER](device_image, widget)
+            if result.get_similarity() >= GROUND_TRUTH_SIMILARITY:
+                h, w = widget.shape[:2]
+                boxes.append({'frame': frame_name, 'widget': widget_name,
+                              'bounds': [x1 + result.x, y1 + result.y, x1 + result.x + w, y1 + result.y + h]})
+    return boxes, None
+
+
+def get_iou(box1, box2):
+    """计算两个框[x1, y1, x2, y2]的交并比"""
+    w = min(box1[2], box2[2]) - max(box1[0], box2[0])
+    h = min(box1[3], box2[3]) - max(box1[1], box2[1])
+    if w <= 0 or h <= 0:
+        return 0.0
+    intersection = w * h
+    area1 = (box1[2] - box1[0]) * (box1[3] - box1[1])
+    area2 = (box2[2] - box2[0]) * (box2[3] - box2[1])
+    return intersection / (area1 + area2 - intersection)
+
+
+def get_peak_rss():
+    """进程的常驻内存峰值(KB)，不支持时返回None"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak // 1024 if sys.platform == 'darwin' else peak
+
+
+def get_distribution(values):
+    values = np.array(values)
+    return {'mean': float(values.mean()), 'min': float(values.min()),
+            'p50': float(np.percentile(values, 50)), 'p95': float(np.percentile(values, 95)),
+            'max': float(values.max())}
+
+
+def run_matcher(corpus_dir, boxes, matcher, scale, repeats):
+    """在当前进程中以指定分辨率运行一个匹配算法，只能在新的子进程中调用
+
+    屏幕图像和控件图像按相同比例缩放，模拟以较低分辨率拍摄；在设备轮廓区域内匹配，
+    匹配位置换算回原始分辨率后与标注框比较
+    """
+    sys.path.insert(0, CODE_BASE)
+    import template_match
+
+    corpus = read_corpus(corpus_dir)
+    x1, y1, x2, y2 = [int(round(v * scale)) for v in corpus['contour']]
+    frames = {name: cv2.resize(frame, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+              if scale != 1 else frame for name, frame in corpus['frames'].items()}
+    gray = matcher in template_match.GRAY_TEMPLATE_MATCHERS
+    widgets = {}
+    for name, widget in corpus['widgets'].items():
+        if scale != 1:
+            widget = cv2.resize(widget, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+        widgets[name] = cv2.cvtColor(widget, cv2.COLOR_BGR2GRAY) if gray else widget
+    # 与运行时相同，控件特征点预先计算
+    features = {}
+    if matcher in template_match.FEATURE_TEMPLATE_MATCHERS:
+        features = {name: template_match.compute_widget_features(matcher, widget)
+                    for name, widget in widgets.items()}
+    match = template_match.TEMPLATE_MATCHERS[matcher]
+
+    rss_start = get_peak_rss()
+    tracemalloc.start()
+    latencies, ious, center_errors, similarities = [], [], [], []
+    for box in boxes:
+        device_image = frames[box['frame']][y1:y2, x1:x2]
+        widget = widgets[box['widget']]
+        args = (device_image, widget, features[box['widget']]) if features else (device_image, widget)
+        for i in range(repeats):
+            start_time = time.perf_counter()
+            result = match(*args)
+            latencies.append((time.perf_counter() - start_time) * 1000)
+        h, w = result.get_image_size()
+        if not w or not h:
+            h, w = widget.shape[:2]
+        found = [(x1 + result.x) / scale, (y1 + result.y) / scale,
+                 (x1 + result.x + w) / scale, (y1 + result.y + h) / scale]
+        expected = box['bounds']
+        ious.append(get_iou(found, expected))
+        center_errors.append(float(np.hypot((found[0] + found[2] - expected[0] - expected[2]) / 2,
+                                            (found[1] + found[3] - expected[1] - expected[3]) / 2)))
+        similarities.append(float(result.get_similarity()))
+    traced_peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    rss_end = get_peak_rss()
+
+    return {
+        'matcher': matcher,
+        'scale': scale,
+        'capture_size': [int(round(v * scale)) for v in next(iter(corpus['frames'].values())).shape[1::-1]],
+        'pairs': len(boxes),
+        'latency_ms': get_distribution(latencies),
+        'peak_memory_kb': {
+            'traced': traced_peak // 1024,
+            'rss_increase': None if rss_start is None else rss_end - rss_start,
+        },
+        'accuracy': {
+            'hit_rate': float(np.mean([iou >= IOU_THRESHOLD for iou in ious])),
+            'mean_iou': float(np.mean(ious)),
+            'center_error_px': get_distribution(center_errors),
+            'mean_similarity': float(np.mean(similarities)),
+        },
+    }
+
+
+def run_task(task):
+    """子进程入口，匹配算法出错时记录错误信息"""
+    corpus_dir, boxes, matcher, scale, repeats = task
+    try:
+        return run_matcher(corpus_dir, boxes, matcher, scale, repeats)
+    except Exception as e:
+        return {'matcher': matcher, 'scale': scale, 'error': str(e).strip()}
+
+
+def main():
+    sys.path.insert(0, CODE_BASE)
+    import template_match
+
+    parser = argparse.ArgumentParser(description="Benchmark of the template matchers.")
+    parser.add_argument("corpus", nargs='*', default=[DEFAULT_CORPUS],
+                        help="corpus directories with temp/*.png and images/*.png")
+    parser.add_argument("-m", nargs='+', dest="matchers", default=None,
+                        help="matchers to run, default to all except 'bbs' on non-Windows systems")
+    parser.add_argument("-s", nargs='+', dest="scales", type=float, default=DEFAULT_SCALES,
+                        help="capture resolution scales")
+    parser.add_argument("-r", action="store", dest="repeats", type=int, default=3,
+                        help="timed runs of every frame/widget pair")
+    parser.add_argument("-o", action="store", dest="report", default=None,
+                        help="write the JSON report to this file")
+    parser.add_argument("-save_gt", action="store_true", dest="save_gt", default=False,
+                        help="save the generated ground truth boxes to ground_truth.json")
+    options = parser.parse_args()
+
+    matchers = options.matchers
+    if matchers is None:
+        matchers = [m for m in template_match.TEMPLATE_MATCHERS if m != 'bbs' or os.name == 'nt']
+
+    report = {
+        'environment': {'python': platform.python_version(), 'opencv': cv2.__version__,
+                        'numpy': np.__version__, 'platform': platform.platform(),
+                        'cpu_count': os.cpu_count()},
+        'settings': {'matchers': matchers, 'scales': options.scales, 'repeats': options.repeats,
+                     'iou_threshold': IOU_THRESHOLD},
+        'corpora': [],
+    }
+    # 每个任务在新的进程中运行，内存峰值互不影响，任务依次运行，耗时互不干扰
+    pool = multiprocessing.get_context('spawn').Pool(1, maxtasksperchild=1)
+    try:
+        for corpus_dir in options.corpus:
+            corpus_dir = os.path.abspath(corpus_dir)
+            corpus = read_corpus(corpus_dir)
+            boxes, ground_truth_path = get_ground_truth(corpus_dir, corpus)
+            if ground_truth_path is None and options.save_gt:
+                ground_truth_path = os.path.join(corpus_dir, 'ground_truth.json')
+                with open(ground_truth_path, 'w') as f:
+                    json.dump({'boxes': boxes}, f, indent=4)
+            print("{}: {} frames, {} widgets, {} ground truth boxes".format(
+                corpus_dir, len(corpus['frames']), len(corpus['widgets']), len(boxes)), flush=True)
+
+            tasks = [(corpus_dir, boxes, matcher, scale, options.repeats)
+                     for matcher in matchers for scale in options.scales]
+            results = []
+            for result in pool.imap(run_task, tasks):
+                if 'error' in result:
+                    print("{:<9} x{:<5} error: {}".format(result['matcher'], result['scale'], result['error']))
+                else:
+                    # tracemalloc不统计OpenCV等C扩展直接分配的内存，这部分内存只体现在常驻内存峰值的增量中
+                    peak_memory = result['peak_memory_kb']
+                    rss_increase = peak_memory['rss_increase']
+                    print("{:<9} x{:<5} p50 {:8.2f} ms  p95 {:8.2f} ms  hit {:6.1%}  "
+                          "center error p95 {:7.1f} px  tracemalloc peak {:7d} KB  RSS peak increase {} KB".format(
+                              result['matcher'], result['scale'], result['latency_ms']['p50'],
+                              result['latency_ms']['p95'], result['accuracy']['hit_rate'],
+                              result['accuracy']['center_error_px']['p95'], peak_memory['traced'],
+                              'n/a' if rss_increase is None else '{:7d}'.format(rss_increase)), flush=True)
+                results.append(result)
+            report['corpora'].append({'corpus': corpus_dir, 'ground_truth': ground_truth_path or 'generated',
+                                      'boxes': boxes, 'results': results})
+    finally:
+        pool.terminate()
+        pool.join()
+
+    if options.report is not None:
+        with open(options.report, 'w') as f:
+            json.dump(report, f, indent=4)
+
+
+if __name__ == '__main__':
+    main()
@@ -257,4 +257,6 @@ calibration_switcher = {
 
 if __name__ == "__main__":
     #    calibration_switcher["1"]()# 跳转到不同的函数
-    calibration_switcher[sys.argv[1]]()  # 跳转到不同的函数
+    # 标定步骤中的配置修改在步骤成功结束后一次写入
+    with Config.transaction():
+        calibration_switcher[sys.argv[1]]()  # 跳转到不同的函数
@@ -5,8 +5,9 @@ A singleton command queue
 """
 import threading
 import time
-from queue import Queue
-import re
+from collections import deque
+from concurrent.futures import Future
+from queue import Empty, Queue
 
 from robot_communicate import RobotCommunicate
 
@@ -23,6 +24,21 @@ cmd_push_event = threading.Event()  # 指令上传阻塞
 cmd_exec_end_event = threading.Event()  # 指令队列执行完毕阻塞
 script_end_event = threading.Event()  # 脚本执行结束事件阻塞
 
+POLL_INTERVAL_MIN = 0.005  # 超过预计时间后查询机器状态的最短间隔(秒)
+POLL_INTERVAL_MAX = 0.05  # 查询机器状态的最长间隔(秒)
+SERVO_SETTINGS = ('SC,4', 'SC,5')  # 抬笔、落笔高度设置
+
+
+def estimate_exec_time(command_text):
+    """根据指令参数估计指令运行时间(毫秒)，非运动指令为0"""
+    if 'XM' in command_text:
+        return int(command_text.split(',')[1])
+    if 'SP' in command_text:
+        if len(command_text.split(',')) == 3:
+            return int(command_text.split(',')[2])
+        return 0.1
+    return 0
+
 
 class RobotCommand(object):
     #指令参数
@@ -30,8 +46,9 @@ class RobotCommand(object):
     # text: 指令信息
     # id: 指令编号
     # push_time: 推到机器上的时间
-    # estimate_start_time: 指令预计执行时间
+    # estimate_start_time: 指令预计执行时间，指令发送到机器时更新
     # exec_time: 指令理论运行时间
+    # future: 指令执行结束时完成的Future
     
     def __init__(self, command_text, command_id, estimate_start_time):
         self.text = command_text
@@ -39,20 +56,24 @@ class RobotCommand(object):
         self.push_time = time.time()
         self.estimate_start_time = estimate_start_time
         self.exec_time = 0
+        self.future = Future()
         self.__extract_exec_time()
         #预估运行时间
     
+    # 运动指令进入机器缓冲区，设置指令(SC等)解析后立即生效
+    def is_motion(self):
+        return self.text.startswith(('XM', 'SP', 'HM'))
+    
+    # 舵机高度设置指令返回('SC,4', 高度)，其余指令返回None
+    def get_servo_setting(self):
+        fields = self.text.strip().split(',')
+        if len(fields) == 3 and ','.join(fields[:2]) in SERVO_SETTINGS:
+            return ','.join(fields[:2]), fields[2]
+        return None
+    
     # 分析指令执行时间
     def __extract_exec_time(self):
-        if 'XM' in self.text:
-            self.exec_time = int(self.text.split(',')[1])
-        elif 'SP' in self.text:
-            if len(self.text.split(',')) == 3:
-                self.exec_time = int(self.text.split(',')[2])
-            else:
-                self.exec_time = 0.1
-        else:
-            self.exec_time = 0
+        self.exec_time = estimate_exec_time(self.text)
          
 #    # 记录推送时间
 #    def record_cmd_push_time(self, push_time):
@@ -67,7 +88,11 @@ class RobotCommand(object):
         
     #执行脚本指令
     def run(self, rc):
-        rc.run('{}\r'.format(self.text))
+        rc.run(self.get_serial_text())
+    
+    # 发送到串口的指令字符串
+    def get_serial_text(self):
+        return '{}\r'.format(self.text)
     
 #    # 记录指令开始时间
 #    def record_command_start_time(self, start_time):
@@ -77,14 +102,40 @@ class RobotCommand(object):
     def get_exec_time(self):
 #        command_end_time = self.start_time + self.duration_time
         return float(self.exec_time / 1000)
+    
+    # 获取指令预计结束时间
+    def get_estimate_end_time(self):
+        return self.estimate_start_time + self.get_exec_time()
 
 
 class CommandQueue(object):
+    """机器指令队列
+    
+    根据指令的理论运行时间预测机器缓冲区(FIFO)的占用情况，在预计缓冲区空闲或指令执行结束时才查询机器状态，
+    超过预计时间后以逐渐增大的间隔查询，指令执行结束后尽快唤醒等待的动作
+    
+    Attributes:
+        command_index: 指令编号
+        estimated_queue_end_time: 指令队列预计结束时间
+        running_commands: 已发送到机器、尚未确认执行结束的指令
+        robot_busy_until: 已发送指令预计全部执行结束的时间
+        poll_interval: 当前查询机器状态的间隔
+        servo_settings: 最后发送到机器的抬笔、落笔高度，用于去掉重复的设置
+        batch_count: 串口写入次数
+        skipped_count: 去掉的重复设置指令数
+    """
     #设置指令编号、指令队列最终执行时间
     def __init__(self):
         self.command_index = 0
         self.estimated_queue_end_time = 0
         self.is_closed = False
+        self.running_commands = deque()
+        self.robot_busy_until = 0
+        self.poll_interval = POLL_INTERVAL_MIN
+        self.state_lock = threading.Lock()
+        self.servo_settings = {}
+        self.batch_count = 0
+        self.skipped_count = 0
         self.rc = RobotCommunicate()
         self.__start()
         
@@ -97,11 +148,19 @@ class CommandQueue(object):
     
     # 将指令加入队列中
     def put(self, action_commands):
+        """将动作的指令加入队列
+        
+        Args:
+            action_commands: 机器指令字符串列表
+        Returns:
+            Future, 动作的最后一条指令执行结束时完成; 没有指令时为None
+        """
         # 记录指令执行时间
         # 若之前等待过指令队列执行结束，则更新当前时间为指令队列执行结束时间
         if self.estimated_queue_end_time < time.time():
             self.estimated_queue_end_time = time.time()
         
+        future = None
         # 获取指令集中的各条指令
         for atom_command in action_commands:
             if not atom_command == '':
@@ -115,8 +174,13 @@ class CommandQueue(object):
                 # 将指令加入到等待队列中
                 command_wait_queue.put(command)
                 # 设置入队事件，用于队列为空时的等待响应
-                cmd_push_event.set()
+                # 同时清除执行完毕事件，避免之后的等待在新指令执行之前返回
+                with self.state_lock:
+                    cmd_push_event.set()
+                    cmd_exec_end_event.clear()
                 self.is_closed = False
+                future = command.future
+        return future
                 
     # 线程中按队列执行指令
     def run(self):
@@ -125,9 +189,11 @@ class CommandQueue(object):
             if command_wait_queue.empty():
                 # 机器指令队列为空则等待指令上传
                 if self.__check_robot_cmds_finish():
+                    self.__complete_commands(len(self.running_commands))
                     # 用于所有机器指令结束等待（用于拍摄等需要机器指令执行完毕的时候）
-                    if not cmd_push_event.is_set():
-                        cmd_exec_end_event.set()
+                    with self.state_lock:
+                        if not cmd_push_event.is_set():
+                            cmd_exec_end_event.set()
                     # 机器指令队列为空，
                     # 若脚本执行结束，则跳出循环，不进入下面的入队事件等待
                     # （否则会因没有新的指令入队，陷入无限等待）
@@ -137,30 +203,125 @@ class CommandQueue(object):
                     # 等待新的指令入队，wait结束后clear掉
                     cmd_push_event.wait()
                     cmd_push_event.clear()
-                    cmd_exec_end_event.clear()
                 else:
-                    # 固定时间查询
-                    # 等待最后指令的时间，
-                    # 时间密度
-                    time.sleep(0.1)
+                    # 等待到预计的执行结束时间，期间有新指令入队则立即处理
+                    self.__wait_for_robot(self.robot_busy_until, wake_on_push=True)
                     
-            elif not self.__query_robot_cmd_que():
-                # 如果队列指令没有阻塞
-                # 即机器缓冲区能够接收新的指令，
-                command = command_wait_queue.get()
-                # 将进入缓冲区的指令记录到历史指令队列中
-                command_history_queue.put(command)
-                command.run(self.rc)
-#                time.sleep(max(0.01, command.get_exec_time()-0.05))
-                # 清除机器指令队列为空的事件
+            elif self.__robot_fifo_has_room():
+                # 机器缓冲区能够接收新的指令，
+                self.__run_batch(self.__take_batch())
                 
             else:
-                # 固定周期去等待
-                time.sleep(0.1)
+                # 等待到缓冲区预计空闲的时间
+                self.__wait_for_robot(self.running_commands[-1].estimate_start_time)
             
         print('Close the Command Queue')
         script_end_event.set()
 
+    def __take_batch(self):
+        """取出可以一次写入串口的指令
+        EBB的缓冲区只能存放一条运动指令，设置指令解析后立即生效，
+        因此一批指令包含一条运动指令及其之前的设置指令；机器空闲时第一条运动指令立即开始执行，可以再多取一条
+        """
+        batch = []
+        motion_slots = 1 if self.running_commands else 2
+        while motion_slots > 0:
+            try:
+                command = command_wait_queue.get_nowait()
+            except Empty:
+                break
+            batch.append(command)
+            if command.is_motion():
+                motion_slots -= 1
+        return batch
+
+    def __run_batch(self, batch):
+        """合并重复的抬笔、落笔高度设置，并将一批指令一次写入串口"""
+        serial_text = []
+        for i, command in enumerate(batch):
+            # 将进入缓冲区的指令记录到历史指令队列中
+            command_history_queue.put(command)
+            setting = command.get_servo_setting()
+            if setting is not None:
+                key, value = setting
+                if (self.servo_settings.get(key) == value
+                        or self.__is_overridden(batch, i, key)):
+                    self.skipped_count += 1
+                    continue
+                self.servo_settings[key] = value
+            serial_text.append(command.get_serial_text())
+        if serial_text:
+            self.rc.run(''.join(serial_text))
+            self.batch_count += 1
+        for command in batch:
+            self.__record_dispatch(command)
+
+    @staticmethod
+    def __is_overridden(batch, index, key):
+        """设置在下一条运动指令之前又被同一设置覆盖"""
+        for command in batch[index + 1:]:
+            if command.is_motion():
+                return False
+            setting = command.get_servo_setting()
+            if setting is not None and setting[0] == key:
+                return True
+        return False
+
+    def get_batch_stats(self):
+        """获取串口写入次数、已发送指令数和去掉的重复设置指令数"""
+        return self.batch_count, command_history_queue.qsize(), self.skipped_count
+
+    def __record_dispatch(self, command):
+        """记录发送到机器的指令，预计其在之前的指令执行结束后开始执行"""
+        command.estimate_start_time = max(time.time(), self.robot_busy_until)
+        self.robot_busy_until = command.get_estimate_end_time()
+        self.running_commands.append(command)
+        self.poll_interval = POLL_INTERVAL_MIN
+
+    def __complete_commands(self, count):
+        """最早发送的count条指令已执行结束"""
+        for i in range(count):
+            command = self.running_commands.popleft()
+            command.future.set_result(command)
+        if count:
+            self.poll_interval = POLL_INTERVAL_MIN
+
+    def __robot_fifo_has_room(self):
+        """判断机器缓冲区能否接收新的指令
+        没有未结束的指令时不需要查询；否则在预计缓冲区空闲后查询机器状态确认
+        """
+        if not self.running_commands:
+            return True
+        # EBB的缓冲区只能存放一条指令，最后发送的指令预计还未开始执行时缓冲区已满
+        if time.time() < self.running_commands[-1].estimate_start_time:
+            return False
+        if self.__query_robot_cmd_que():
+            return False
+        # 缓冲区为空，最后发送的指令已开始执行，之前的指令都已执行结束
+        self.__complete_commands(len(self.running_commands) - 1)
+        return True
+
+    def __wait_for_robot(self, estimate_time, wake_on_push=False):
+        """等待机器状态变化
+        在预计时间之前直接等待到预计时间，超过预计时间后以逐渐增大的间隔查询
+        
+        Args:
+            estimate_time: 预计机器状态变化的时间
+            wake_on_push: 有新指令入队时是否立即返回
+        """
+        delay = estimate_time - time.time()
+        if delay > POLL_INTERVAL_MIN:
+            self.poll_interval = POLL_INTERVAL_MIN
+        else:
+            delay = self.poll_interval
+            self.poll_interval = min(self.poll_interval * 2, POLL_INTERVAL_MAX)
+        if wake_on_push:
+            cmd_push_event.clear()
+            if command_wait_queue.empty():
+                cmd_push_event.wait(delay)
+        else:
+            time.sleep(delay)
+
     def is_empty(self):
         """判断队列中是否有还在执行的指令，
         首先判断指定队列是否为空
@@ -174,60 +335,31 @@ class CommandQueue(object):
     
     def get_ebb_version(self):
         """
-        查询固件版本号
+        查询固件版本号，版本号在连接机器人时查询一次
         Return: version, EBB固件版本号
         """
-        query_answer = str(self.rc.query_motor_version())
-        version = query_answer[query_answer.find('Version')+8: 
-                                query_answer.rfind('\\r\\n')]
-        return str(version)
+        return self.rc.capabilities.version
+    
+    def get_ebb_capabilities(self):
+        """获取EBB固件版本及其支持的功能"""
+        return self.rc.capabilities
     
     # 判断机器指令缓冲区是否为空
-    # 查询电机是否在运动，返回值: QM,CommandStatus,Motor1Status,Motor2Status,FIFOStatus
-    #   CommandStatus 若当前在执行任何运动命令，则为非0
-    #   Motor1Status 若当前电机1在执行运动，则为非0
-    #   Motor2Status 若当前电机2在执行运动，则为非0
-    #   FIFOStatus 如果FIFO不为空，则FIFOStatus为非0(FIFO缓冲区)(仅在2.4.4以上版本中存在)
-    #              即当最后一位为1时，缓冲区存在指令，不能继续插入机器指令
+    # 查询电机是否在运动，返回值的含义见EbbCapabilities
+    #   即当FIFOStatus为1时，缓冲区存在指令，不能继续插入机器指令
     # 此指令查询的是缓冲区状态，不需要进入机器指令的队列中
     def __query_robot_cmd_que(self):
-        # 版本号不同导致的查询函数和结果不同
-        version = self.get_ebb_version()
-        if version >= '2.4.4':
-            # 2.4.4以上版本
-            motor_block = re.compile(r"QM,([0-1]),([0-1]),([0-1]),1")
-        elif version >= '2.2.6':
-            # 2.2.6以上版本
-            motor_block = re.compile(r"QM,1,([0-1]),([0-1])")
-        else:
+        capabilities = self.rc.capabilities
+        if not capabilities.supports_motor_query:
             # 再老的版本不支持此指令
             return True
-        
         motor_state = str(self.rc.query_motor_state())
-        # 若motor_search_result为None， 则代表FIFO缓冲区不为空，否则为空
-        motor_search_result = motor_block.search(motor_state)
-        if motor_state == '':
-            return True
-        # 若motor_search_result为None，则代表FIFO缓冲区为0，可以入队，否则，阻塞
-        return motor_search_result is not None
+        return capabilities.is_fifo_blocked(motor_state)
     
     # 判断机器指令是否执行结束
     def __check_robot_cmds_finish(self):
-        version = self.get_ebb_version()
-        if version >= '2.4.4':
-            # 2.4.4以上版本
-            motor_block = re.compile(r"QM,0,0,0,0")
-        else:
-            # 其他版本
-            motor_block = re.compile(r"QM,0,0,0")
         motor_state = str(self.rc.query_motor_state())
-#        motor_block = re.compile(r"QM,0,0,0")
-        motor_search_result = motor_block.search(motor_state)
-        # 若motor_search_result为None， 则代表FIFO缓冲区不为空，否则为空
-        if motor_state == '':
-            return True
-#        print('version:', rc.query_motor_version())
-        return motor_search_result is not None
+        return self.rc.capabilities.is_robot_idle(motor_state)
     
     # 等待队列阻塞
     # 有部分脚本动作需要机器停止后才能继续进行
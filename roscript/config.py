@@ -2,9 +2,14 @@
 import sys
 
 from ruamel import yaml
+import contextlib
 import json
 import os
+import shutil
+import tempfile
+import threading
 from os import path
+from typing import NamedTuple, Tuple
 
 # Specify whether use the directory containing python code as the tool home
 # USE_PYTHON_PROJECT_AS_HOME = True
@@ -64,22 +69,165 @@ def read_config_file(config_file_path):
     return file_content
 
 
-# config文件参数
-g_config_content = read_config_file(g_config_path)
-# data文件参数
-g_sut_content = read_config_file(g_sut_path)
+# config文件参数，第一次使用时读取
+g_config_content = None
+# data文件参数，第一次使用时读取
+g_sut_content = None
+# 配置快照，配置修改后重新生成
+g_config_snapshot = None
+g_config_lock = threading.RLock()
 # 虚拟调试目录
 g_virtual_debug_folder = None
+# 配置事务的嵌套层数，事务中的修改只保存在内存中
+g_transaction_depth = 0
+# 事务中待写入的文件: 文件路径 -> 写入函数
+g_pending_files = {}
+
+
+def write_file_atomic(file_path, write, mode='w'):
+    """先写入同目录下的临时文件再替换原文件，写入中断时原文件保持不变
+
+    Args:
+        file_path: 文件路径
+        write: 写入函数，参数为打开的文件
+        mode: 打开临时文件的方式，'w'为文本文件，'wb'为二进制文件
+    """
+    fd, temp_path = tempfile.mkstemp(suffix='.tmp',
+                                     dir=os.path.dirname(os.path.abspath(file_path)))
+    try:
+        with os.fdopen(fd, mode) as f:
+            write(f)
+        if os.path.exists(file_path):
+            shutil.copymode(file_path, temp_path)
+        os.replace(temp_path, file_path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+def yaml_writer(content):
+    """返回以ruamel round-trip格式写入yaml文件的写入函数"""
+    return lambda f: yaml.dump(content, f, Dumper=yaml.RoundTripDumper)
+
+
+def json_writer(content):
+    """返回写入json文件的写入函数"""
+    return lambda f: f.write(json.dumps(content, indent=4))
+
+
+def save_config_file(file_path, write):
+    """保存配置文件，在配置事务中时推迟到事务结束时写入"""
+    with g_config_lock:
+        if g_transaction_depth > 0:
+            g_pending_files[file_path] = write
+        else:
+            write_file_atomic(file_path, write)
+    Config.invalidate()
+
+
+def config_content():
+    """获取config文件参数，第一次使用时读取"""
+    global g_config_content
+    if g_config_content is None:
+        with g_config_lock:
+            if g_config_content is None:
+                g_config_content = read_config_file(g_config_path)
+    return g_config_content
+
+
+def sut_content():
+    """获取sut文件参数，第一次使用时读取"""
+    global g_sut_content
+    if g_sut_content is None:
+        with g_config_lock:
+            if g_sut_content is None:
+                g_sut_content = read_config_file(g_sut_path)
+    return g_sut_content
+
+
+class ConfigSnapshot(NamedTuple):
+    """配置快照，预先计算运行过程中频繁使用的配置及其派生值，只读
+
+    Attributes:
+        scale_rate: 像素与物理世界的距离比例
+        equipment_contour: 设备轮廓在图像中的区域(x1, y1, x2, y2)
+        screenshot_size: 拍摄图像的分辨率(宽, 高)
+        robot_layout: 机械臂布局矩阵
+        one_cm_steps: 步进电机运动1cm需要的步进距离
+        motor_speed: 电机旋转速度
+        tip_height: 笔的高度
+        tip_initial_height: 笔的初始落笔高度
+        pen_high_dead: 机械臂XY两轴的笔高度落差
+        robot_arm_range: 机械臂移动范围
+    """
+    scale_rate: float
+    equipment_contour: Tuple[int, int, int, int]
+    screenshot_size: Tuple[int, int]
+    robot_layout: Tuple[Tuple[int, ...], ...]
+    one_cm_steps: int
+    motor_speed: int
+    tip_height: int
+    tip_initial_height: int
+    pen_high_dead: Tuple[float, float]
+    robot_arm_range: Tuple[float, float]
+
+
+def read_scale_rate(sut):
+    """计算像素与物理世界的距离比例，保留两位小数"""
+    calibration_camera_file_path = g_camera_data_path
+    if os.path.isfile(calibration_camera_file_path):
+        # 如果存在camera.json文件，则读取文件中的配置
+        with open(calibration_camera_file_path,
+                  'r', encoding='utf-8') as rf:
+            data = json.load(rf)
+        proportion = data['pixel_to_physical']
+    else:
+        # 如果不存在camera文件，则使用被测设备实际尺寸和像素分辨率进行计算
+        device_width = sut['Model']['FullSize']['width']
+        device_height = sut['Model']['FullSize']['height']
+        contour_width = sut['Model']['ContourPosition']['width']
+        contour_height = sut['Model']['ContourPosition']['height']
+        device_area = device_width * device_height
+        contour_area = contour_width * contour_height
+        proportion = (contour_area/device_area) ** 0.5
+    return round(proportion, 2)
+
+
+def build_config_snapshot():
+    """根据当前配置生成配置快照"""
+    config = config_content()
+    sut = sut_content()
+    robot = config['Robot']['ROBOT_MANUFACTOR']
+    contour = sut['Model']['ContourPosition']
+    x, y = contour['x'], contour['y']
+    return ConfigSnapshot(
+        scale_rate=read_scale_rate(sut),
+        equipment_contour=(x, y, x + contour['width'], y + contour['height']),
+        screenshot_size=tuple(map(int, sut['Camera']['Size'].split('*'))),
+        robot_layout=tuple(tuple(row) for row in eval(robot['Layout'])),
+        one_cm_steps=robot['ONE_CM_STEPS'],
+        motor_speed=robot['MOTOR_SPEED'],
+        tip_height=sut['Robot']['TipHeight'],
+        tip_initial_height=robot['TipHeight'],
+        pen_high_dead=(robot['ROBOT_ARM_HEIGHT_ERROR']['X'],
+                       robot['ROBOT_ARM_HEIGHT_ERROR']['Y']),
+        robot_arm_range=(robot['LENGTH']['X'], robot['LENGTH']['Y']))
 
 
 # 读取并分析配置文件
 class Config(object):
-    """配置文件读写以及路径获取"""
+    """配置文件读写以及路径获取
+    
+    配置文件在第一次使用时读取，频繁使用的配置及其派生值保存在只读的配置快照中，
+    读取或更新配置文件后快照失效，下次使用时重新生成
+    """
     @staticmethod
     def load_config(config_path):
         global g_config_path, g_config_content
         g_config_path = config_path
         g_config_content = read_config_file(config_path)
+        Config.invalidate()
         return g_config_content
 
     @staticmethod
@@ -87,8 +235,90 @@ class Config(object):
         global g_sut_path, g_sut_content
         g_sut_path = sut_config_path
         g_sut_content = read_config_file(sut_config_path)
+        Config.invalidate()
         return g_sut_content
-    
+
+    @staticmethod
+    def get_snapshot():
+        """获取配置快照，第一次使用或配置更新后重新生成
+        Returns:
+            ConfigSnapshot
+        """
+        global g_config_snapshot
+        snapshot = g_config_snapshot
+        if snapshot is None:
+            with g_config_lock:
+                if g_config_snapshot is None:
+                    g_config_snapshot = build_config_snapshot()
+                snapshot = g_config_snapshot
+        return snapshot
+
+    @staticmethod
+    def invalidate():
+        """配置更新后使配置快照失效"""
+        global g_config_snapshot
+        with g_config_lock:
+            g_config_snapshot = None
+
+    @staticmethod
+    def reload():
+        """重新读取配置文件"""
+        global g_config_content, g_sut_content
+        with g_config_lock:
+            g_config_content = None
+            g_sut_content = None
+        Config.invalidate()
+
+    @staticmethod
+    @contextlib.contextmanager
+    def transaction():
+        """配置事务，事务中的update_*修改只保存在内存中，事务结束时每个文件只写入一次
+
+        事务可以嵌套，最外层事务结束时写入；事务中出现异常时丢弃修改，被修改的配置文件重新读取
+
+        Example:
+            with Config.transaction():
+                Config.update_tip_height(tip_height)
+                Config.update_tip_fall_center(x, y)
+        """
+        global g_transaction_depth
+        with g_config_lock:
+            g_transaction_depth += 1
+        try:
+            yield
+        except BaseException:
+            with g_config_lock:
+                g_transaction_depth -= 1
+                if g_transaction_depth == 0:
+                    Config.rollback()
+            raise
+        with g_config_lock:
+            g_transaction_depth -= 1
+            if g_transaction_depth == 0:
+                Config.commit()
+
+    @staticmethod
+    def rollback():
+        """丢弃事务中的修改，被修改的配置文件在下次使用时重新读取"""
+        global g_config_content, g_sut_content
+        with g_config_lock:
+            if g_config_path in g_pending_files:
+                g_config_content = None
+            if g_sut_path in g_pending_files:
+                g_sut_content = None
+            g_pending_files.clear()
+        Config.invalidate()
+
+    @staticmethod
+    def commit():
+        """写入事务中修改的配置文件"""
+        with g_config_lock:
+            pending_files = list(g_pending_files.items())
+            g_pending_files.clear()
+            for file_path, write in pending_files:
+                write_file_atomic(file_path, write)
+        Config.invalidate()
+
     @staticmethod     
     # 获取bbs算法路径
     def get_bbs_lib_path():
@@ -157,34 +387,34 @@ class Config(object):
     # 获取机器人型号参数
     def get_robot_manufactor():
         # 机器人型号参数
-        robot_manufactor = g_config_content['Robot']['ROBOT_MANUFACTOR']['ID']
+        robot_manufactor = config_content()['Robot']['ROBOT_MANUFACTOR']['ID']
         return robot_manufactor
     
     @staticmethod  
     # 获取相机编号
     def get_capture_id():
         # 摄像机编号
-        capture_id = g_config_content['Robot']['CAPTURE']['ID']
+        capture_id = config_content()['Robot']['CAPTURE']['ID']
         return capture_id
     
     @staticmethod
     def get_capture2_id():
         # 获取辅助摄像头id
-        capture2_id = g_config_content['Robot']['CAPTURE']['ID2']
+        capture2_id = config_content()['Robot']['CAPTURE']['ID2']
         return capture2_id
     
     @staticmethod  
     # 获取摄像机焦距
     def get_camera_focus():
         # 焦距
-        focus = g_sut_content['Camera']['Focus']
+        focus = sut_content()['Camera']['Focus']
         return focus
     
     @staticmethod  
     # 获取相片旋转角度
     def get_rotation_angle():
         # 图片旋转角度
-        angle = g_sut_content['Camera']['RotationAngle']
+        angle = sut_content()['Camera']['RotationAngle']
         if angle % 90 == 0:
             return angle
         return 0
@@ -193,20 +423,18 @@ class Config(object):
     # 获取笔的高度
     def get_tip_height():
         # 笔的高度
-        pen_altitude = g_sut_content['Robot']['TipHeight']  # 计算落笔高度
-        return pen_altitude
+        return Config.get_snapshot().tip_height
     
     @staticmethod  
     # 获取笔的初始落笔高度
     def get_tip_initial_height():
         # 笔的高度
-        pen_initial_height = g_config_content['Robot']['ROBOT_MANUFACTOR']['TipHeight']
-        return pen_initial_height
+        return Config.get_snapshot().tip_initial_height
     
     @staticmethod
     def get_tip_contour():
         """获取落笔识别区域"""
-        tip_contour = g_sut_content['Camera']['TipContour']
+        tip_contour = sut_content()['Camera']['TipContour']
         w, h = [int(size) for size in tip_contour.split("*")][:2]
         return w, h
     
@@ -214,35 +442,30 @@ class Config(object):
     # 获取被测设备厚度
     def get_model_thickness():
         # 被测设备厚度
-        model_thickness = g_sut_content['Model']['FullSize']['thickness']
+        model_thickness = sut_content()['Model']['FullSize']['thickness']
         return model_thickness
     
     @staticmethod  
     # 获取笔高度落差
     def get_pen_high_dead():
         # 笔高度的落差
-        hight_error = [g_config_content['Robot']['ROBOT_MANUFACTOR']['ROBOT_ARM_HEIGHT_ERROR']['X'],
-                       g_config_content['Robot']['ROBOT_MANUFACTOR']['ROBOT_ARM_HEIGHT_ERROR']['Y']]
-        return hight_error
+        return list(Config.get_snapshot().pen_high_dead)
     
     @staticmethod
     def get_one_cm_steps():
         # 获取1cm步进电机的运动步数、
-        one_cm_steps = g_config_content['Robot']['ROBOT_MANUFACTOR']['ONE_CM_STEPS']
-        return one_cm_steps
+        return Config.get_snapshot().one_cm_steps
     
     @staticmethod
     # 获取标志物到笔尖的实际相对距离
     def get_circle_to_pen_distance():
-        return g_config_content['Robot']['ROBOT_MANUFACTOR']['CIRCLE_TO_PEN']
+        return config_content()['Robot']['ROBOT_MANUFACTOR']['CIRCLE_TO_PEN']
     
     @staticmethod  
     # 获取机械臂移动范围
     def get_robot_arm_range():
         #机械臂移动范围
-        robot_arm_range = [g_config_content['Robot']['ROBOT_MANUFACTOR']['LENGTH']['X'], 
-                        g_config_content['Robot']['ROBOT_MANUFACTOR']['LENGTH']['Y']]
-        return robot_arm_range
+        return list(Config.get_snapshot().robot_arm_range)
             
     
     @staticmethod  
@@ -252,92 +475,148 @@ class Config(object):
         Returns:
             pixel_to_physical: 像素与物理世界的距离比例关系，保留两位小数
         '''
-        calibration_camera_file_path = Config.get_calibration_camera_file_path()
-        if os.path.isfile(calibration_camera_file_path):
-            # 如果存在camera.json文件，则读取文件中的配置
-            with open(calibration_camera_file_path, 
-                    'r', encoding='utf-8') as rf:
-                data = json.load(rf)
-            proportion = data['pixel_to_physical']
-        else:
-            # 如果不存在camera文件，则使用被测设备实际尺寸和像素分辨率进行计算
-            device_width = g_sut_content['Model']['FullSize']['width']
-            device_height = g_sut_content['Model']['FullSize']['height']
-            contour_width = g_sut_content['Model']['ContourPosition']['width']
-            contour_height = g_sut_content['Model']['ContourPosition']['height']
-            device_area = device_width * device_height
-            contour_area = contour_width * contour_height
-            proportion = (contour_area/device_area) ** 0.5
-        return round(proportion, 2)
+        return Config.get_snapshot().scale_rate
     
     @staticmethod     
     # 获取机器人串口通信串口号
     # 当无法自动检测到机器人串口信息时，则使用本函数获取配置文件的串口配置
     def get_robot_port():
-        robot_port = g_config_content['Robot']['ROBOT_MANUFACTOR']['Port']
+        robot_port = config_content()['Robot']['ROBOT_MANUFACTOR']['Port']
         return robot_port
     
     @staticmethod     
     # 获取机器人相对位置，即机器人位置布局,
     def get_robot_layout():
-        robot_layout = eval(g_config_content['Robot']['ROBOT_MANUFACTOR']['Layout'])
-        return robot_layout
+        return [list(row) for row in Config.get_snapshot().robot_layout]
     
     @staticmethod  
     # 获取图像匹配算法和相应的阈值
     def get_template_match_algorithm():
         # 算法
-        template_match_algorithm = g_sut_content['TemplateMatch']['Algorithm']
+        template_match_algorithm = sut_content()['TemplateMatch']['Algorithm']
         return template_match_algorithm
     
     @staticmethod     
     #返回图像匹配算法关系运算
     def get_template_match_relation():
-        relationOperator = g_sut_content['TemplateMatch']['Relation']
+        relationOperator = sut_content()['TemplateMatch']['Relation']
         return relationOperator
     
     @staticmethod     
     #返回图像匹配算法阈值
     def get_template_match_threshold():
-        threshold = g_sut_content['TemplateMatch']['Value']
+        threshold = sut_content()['TemplateMatch']['Value']
         return threshold
 
+    @staticmethod
+    def get_template_match_pyramid_depth():
+        """获取金字塔模板匹配的最大金字塔层数"""
+        return config_content().get('TemplateMatchPyramidDepth', 2)
+
     @staticmethod
     def set_template_match_threshold(threshold):
-        g_sut_content['TemplateMatch']['Value'] = float(threshold)
+        sut_content()['TemplateMatch']['Value'] = float(threshold)
 
     @staticmethod    
     # 获取相机拍摄的图片分辨率大小
     def get_screenshot_size():# 获取图片分辨率
-        camera_size = g_sut_content['Camera']['Size']
-        return list(map(int, camera_size.split('*')))
+        return list(Config.get_snapshot().screenshot_size)
     
     @staticmethod  
     # 获取起点规避距离
     def get_origin_detour_length():
         origin_detour_length = [0,0]
-        origin_detour_length[0] = g_sut_content['Robot']['ORIGIN_DETOUR']['x']
-        origin_detour_length[1] = g_sut_content['Robot']['ORIGIN_DETOUR']['y']
+        origin_detour_length[0] = sut_content()['Robot']['ORIGIN_DETOUR']['x']
+        origin_detour_length[1] = sut_content()['Robot']['ORIGIN_DETOUR']['y']
         return origin_detour_length
     
     @staticmethod  
     def get_detour_step_threshold():
         """获取分步规避动作的界限"""
-        detour_step = g_sut_content['Robot']['DETOUR_STEP_THRESHOLD']
+        detour_step = sut_content()['Robot']['DETOUR_STEP_THRESHOLD']
         return detour_step
     
     @staticmethod  
     def get_detour_step_distance():
         """获取分步规避动作单次的移动距离"""
-        detour_step = g_sut_content['Robot']['DETOUR_STEP_DISTANCE']
+        detour_step = sut_content()['Robot']['DETOUR_STEP_DISTANCE']
         return detour_step
     
     @staticmethod  
     def is_log_enabled():
         """获取log记录许可"""
-        log_license = g_config_content['Log']
+        log_license = config_content()['Log']
         return log_license
 
+    @staticmethod
+    def is_artifact_enabled():
+        """获取调试产物许可，开启后将拍摄图像和匹配结果图像存储到磁盘"""
+        artifact = config_content().get('Artifact', 'OFF')
+        return artifact == 'ON'
+
+    @staticmethod
+    def get_widget_cache_size():
+        """获取控件模板缓存的最大数量"""
+        return config_content().get('WidgetCacheSize', 64)
+
+    @staticmethod
+    def get_frame_buffer_size():
+        """获取视频监控保存的最近视频帧数量，至少为2，最旧的一帧可能正在被覆盖"""
+        frame_buffer_size = config_content().get('FrameBufferSize', 8)
+        if frame_buffer_size < 2:
+            raise Exception('FrameBufferSize must be at least 2!')
+        return frame_buffer_size
+
+    @staticmethod
+    def get_video_codec():
+        """获取视频录制的编码, 'I420', 'MJPG' 或 'H264'"""
+        return config_content().get('VideoCodec', 'MJPG')
+
+    @staticmethod
+    def get_video_queue_size():
+        """获取等待写入视频的最大视频帧数量，超过时丢弃视频帧"""
+        return config_content().get('VideoQueueSize', 64)
+
+    @staticmethod
+    def get_metrics_format():
+        """获取动作耗时记录的文件格式, 'JSONL', 'CSV' 或 'OFF'(不写入文件)"""
+        return config_content().get('Metrics', 'JSONL')
+
+    @staticmethod
+    def get_metrics_buffer_size():
+        """获取动作耗时记录缓冲区的动作数量，写满后在后台写入文件"""
+        return config_content().get('MetricsBufferSize', 256)
+
+    @staticmethod
+    def is_roi_tracking_enabled():
+        """获取ROI跟踪许可，开启后先在控件上次出现的位置附近查找控件"""
+        roi_tracking = config_content().get('RoiTracking', 'OFF')
+        return roi_tracking == 'ON'
+
+    @staticmethod
+    def is_screen_change_enabled():
+        """获取屏幕变化检测许可，开启后wait只在屏幕发生变化时立即重新匹配控件"""
+        screen_change = config_content().get('ScreenChange', 'ON')
+        return screen_change == 'ON'
+
+    @staticmethod
+    def get_screen_change_threshold():
+        """获取屏幕变化检测的缩略图灰度差阈值"""
+        return config_content().get('ScreenChangeThreshold', 8)
+
+    @staticmethod
+    def get_roi_margin():
+        """获取ROI在控件四周扩展的距离与控件宽高的比例"""
+        return config_content().get('RoiMargin', 1.0)
+
+    @staticmethod
+    def get_match_workers():
+        """获取多控件并行匹配的线程数，未配置或为0时使用CPU核数"""
+        workers = config_content().get('MatchWorkers', 0)
+        if workers <= 0:
+            workers = os.cpu_count() or 1
+        return workers
+
     @staticmethod
     def set_virtual_debug(exec_record_folder):
         global g_sut_path, g_config_path, g_camera_data_path, g_config_content, g_sut_content, g_virtual_debug_folder
@@ -356,13 +635,14 @@ class Config(object):
             g_config_content = read_config_file(g_config_path)
             g_sut_content = read_config_file(g_sut_path)
             g_virtual_debug_folder = os.path.join(exec_record_folder, "temp")
+            Config.invalidate()
 
-        g_config_content['VirtualDebug'] = True
+        config_content()['VirtualDebug'] = True
 
     @staticmethod  
     #虚拟调试功能
     def get_virtual_debug_model():
-        virtual_debug = g_config_content['VirtualDebug']
+        virtual_debug = config_content()['VirtualDebug']
         return virtual_debug
 
     @staticmethod
@@ -383,79 +663,67 @@ class Config(object):
     @staticmethod  
     def get_sut_monitor_setting():
         """开启视频录制监控"""
-        sut_monitor = g_config_content['SutMonitor']
+        sut_monitor = config_content()['SutMonitor']
         return sut_monitor
     
     @staticmethod  
     def get_motor_speed():
         """获取电机旋转速度"""
-        motor_speed = g_config_content['Robot']['ROBOT_MANUFACTOR']['MOTOR_SPEED']
-        return motor_speed
+        return Config.get_snapshot().motor_speed
     
     @staticmethod  
     def get_press_time():
         """获取长按持续时间"""
-        press_time = g_sut_content['Robot']['PressTime']
+        press_time = sut_content()['Robot']['PressTime']
         return press_time
     
     @staticmethod  
     def get_double_click_time():
         """获取双击间隔时间"""
-        press_time = g_sut_content['Robot']['DoubleClickTime']
+        press_time = sut_content()['Robot']['DoubleClickTime']
         return press_time
     
     @staticmethod  
     def get_wait_time():
         """获取等待间隔时间"""
-        wait_time = g_sut_content['Robot']['WaitTime']
+        wait_time = sut_content()['Robot']['WaitTime']
         return wait_time
     
     @staticmethod
     def get_tip_fall_center():
         """获取落笔点击识别区域中心坐标"""
-        x = g_sut_content['TipFall']['X']
-        y = g_sut_content['TipFall']['Y']
+        x = sut_content()['TipFall']['X']
+        y = sut_content()['TipFall']['Y']
         return [x, y]
     
     @staticmethod  
     # 记录标定板标定后的结果信息
     def update_calibration_result(calibration_result):
-        json_str = json.dumps(calibration_result, indent=4)
-        with open(Config.get_calibration_camera_file_path(), 'w') as json_file:
-            json_file.write(json_str)
+        save_config_file(Config.get_calibration_camera_file_path(),
+                         json_writer(calibration_result))
     
     @staticmethod  
     #更新相机焦距，默认为73
     def update_focal_length(focus=73):# 更新相机焦距
-        file = open(g_sut_path, 'w')
-        g_sut_content['Camera']['Focus'] = int(focus)
-        yaml.dump(g_sut_content, file, Dumper=yaml.RoundTripDumper)
-        file.close()
+        sut_content()['Camera']['Focus'] = int(focus)
+        save_config_file(g_sut_path, yaml_writer(sut_content()))
     
     @staticmethod
     # 更新落笔高度
     def update_tip_height(tip_height):
-        file = open(g_sut_path, 'w')
-        g_sut_content['Robot']['TipHeight'] = int(tip_height)
-        yaml.dump(g_sut_content, file, Dumper=yaml.RoundTripDumper)
-        file.close()
+        sut_content()['Robot']['TipHeight'] = int(tip_height)
+        save_config_file(g_sut_path, yaml_writer(sut_content()))
         
     @staticmethod 
     def get_equipment_contour():
     #返回轮廓区域
-        x = g_sut_content['Model']['ContourPosition']['x']
-        y = g_sut_content['Model']['ContourPosition']['y']
-        w = g_sut_content['Model']['ContourPosition']['width']
-        h = g_sut_content['Model']['ContourPosition']['height']
-        return [x, y, x+w ,y+h]
+        return list(Config.get_snapshot().equipment_contour)
     
     @staticmethod
     def update_circle_to_pen(circle_to_pen_distance):
         """更新笔尖到标志圆心的距离"""
-        file = open(g_config_path, 'w')
-        g_config_content['Robot']['ROBOT_MANUFACTOR']['CIRCLE_TO_PEN'] = circle_to_pen_distance
-        yaml.dump(g_config_content, file, Dumper=yaml.RoundTripDumper)
-        file.close()
+        config_content()['Robot']['ROBOT_MANUFACTOR']['CIRCLE_TO_PEN'] = circle_to_pen_distance
+        save_config_file(g_config_path, yaml_writer(config_content()))
     
     @staticmethod      
     # 更新设备在图片中的轮廓信息    
@@ -466,21 +734,16 @@ class Config(object):
             temporary_contour = json.load(rf)
         
         #更新contour信息然后再写回文件中
-        file = open(g_sut_path, 'w')
-        g_sut_content['Model']['ContourPosition'] = temporary_contour
-        yaml.dump(g_sut_content, file, Dumper = yaml.RoundTripDumper)
-        file.close()
+        sut_content()['Model']['ContourPosition'] = temporary_contour
+        save_config_file(g_sut_path, yaml_writer(sut_content()))
     
     @staticmethod
     def update_ports(ports):
         """更新串口信息"""
-        read_file = open(path.join(g_tool_home, g_frontend_options_path))
-        frontend_content = yaml.load(read_file, Loader=yaml.Loader)
-        read_file.close()
+        frontend_options_path = path.join(g_tool_home, g_frontend_options_path)
+        frontend_content = read_config_file(frontend_options_path)
         frontend_content['ports'] = ports
-        file = open(path.join(g_tool_home, g_frontend_options_path), 'w')
-        yaml.dump(frontend_content, file, Dumper = yaml.RoundTripDumper)
-        file.close()
+        save_config_file(frontend_options_path, yaml_writer(frontend_content))
     
     @staticmethod
     def update_robot_layout(direction_matrix):
@@ -490,10 +753,8 @@ class Config(object):
             (x,y) = (px,py)direction_matrix
         """
         #更新contour信息然后再写回文件中
-        file = open(g_config_path, 'w')
-        g_config_content['Robot']['ROBOT_MANUFACTOR']['Layout'] = str(direction_matrix.tolist())
-        yaml.dump(g_config_content, file, Dumper = yaml.RoundTripDumper)
-        file.close()
+        config_content()['Robot']['ROBOT_MANUFACTOR']['Layout'] = str(direction_matrix.tolist())
+        save_config_file(g_config_path, yaml_writer(config_content()))
     
     @staticmethod
     def update_tip_fall_center(x,y):
@@ -501,11 +762,9 @@ class Config(object):
         Args:
             x,y = 落笔点击笔尖像素坐标
         """
-        file = open(g_sut_path, 'w')
-        g_sut_content['TipFall']['X'] = int(x)
-        g_sut_content['TipFall']['Y'] = int(y)
-        yaml.dump(g_sut_content, file, Dumper = yaml.RoundTripDumper)
-        file.close()
+        sut_content()['TipFall']['X'] = int(x)
+        sut_content()['TipFall']['Y'] = int(y)
+        save_config_file(g_sut_path, yaml_writer(sut_content()))
         
     @staticmethod      
     #记录临时数据
@@ -522,4 +781,3 @@ class Config(object):
         temporary_calibration_file_path = path.join(Config.get_output_dir(), 'temporary.json')
         with open(temporary_calibration_file_path, 'w') as json_file:
             json_file.write(json_str)
-
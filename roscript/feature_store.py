@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+"""
+Persistent store of SIFT/SURF features of widget and keyboard templates
+"""
+
+import os
+import threading
+
+import cv2
+import numpy as np
+
+import template_match
+from config import write_file_atomic
+
+FEATURE_STORE_VERSION = 1
+
+
+def save_npz(store_path, **arrays):
+    """以npz格式保存数组，先写入临时文件再替换，避免并发运行时读到不完整的文件
+
+    Returns:
+        是否保存成功，目录不可写时返回False，调用者只在进程内缓存
+    """
+    try:
+        write_file_atomic(store_path, lambda f: np.savez(f, **arrays), mode='wb')
+        return True
+    except OSError:
+        return False
+
+
+class FeatureStore(object):
+    """控件特征点缓存
+
+    控件特征点只计算一次，保存在进程内，并以 <图像名>.<算法>.npz 的形式保存在控件图像旁边,
+    下次运行时直接读取。控件图像被替换或缩放后的模板尺寸改变时自动重新计算
+
+    Attributes:
+        features: dict, 进程内缓存的控件特征点
+    """
+
+    def __init__(self):
+        self.features = {}
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def get_store_path(image_path, algorithm):
+        """获取控件特征点文件路径"""
+        root, _ = os.path.splitext(image_path)
+        return '{}.{}.npz'.format(root, algorithm)
+
+    def get_features(self, algorithm, image_path, widget_image):
+        """获取控件特征点
+
+        Args:
+            algorithm: 特征点算法, 'sift' 或 'surf'
+            image_path: 控件原始图像路径
+            widget_image: 缩放后的灰度控件图像
+        Returns:
+            template_match.WidgetFeatures
+        """
+        mtime = os.path.getmtime(image_path)
+        shape = tuple(widget_image.shape[:2])
+        key = (algorithm, image_path, mtime, shape)
+        with self.lock:
+            if key in self.features:
+                return self.features[key]
+
+        store_path = FeatureStore.get_store_path(image_path, algorithm)
+        features = FeatureStore.__load(store_path, mtime, shape)
+        if features is None:
+            features = template_match.compute_widget_features(algorithm, widget_image)
+            FeatureStore.__save(store_path, features, mtime)
+
+        with self.lock:
+            # 控件图像被替换后，旧的特征点不再有效
+            for stale_key in [k for k in self.features
+                              if k[:2] == key[:2] and k != key]:
+                del self.features[stale_key]
+            self.features[key] = features
+        return features
+
+    @staticmethod
+    def __load(store_path, mtime, shape):
+        """读取已保存的特征点，文件不存在或已过期时返回None"""
+        if not os.path.isfile(store_path):
+            return None
+        try:
+            with np.load(store_path) as data:
+                if (int(data['version']) != FEATURE_STORE_VERSION
+                        or str(data['opencv']) != cv2.__version__
+                        or float(data['mtime']) != mtime
+                        or tuple(data['shape']) != shape):
+                    return None
+                return template_match.WidgetFeatures(data['points'],
+                                                     data['descriptors'],
+                                                     shape)
+        except (OSError, ValueError, KeyError):
+            return None
+
+    @staticmethod
+    def __save(store_path, features, mtime):
+        """保存特征点，控件目录不可写时只在进程内缓存"""
+        save_npz(store_path,
+                 version=FEATURE_STORE_VERSION,
+                 opencv=cv2.__version__,
+                 mtime=mtime,
+                 shape=np.array(features.shape),
+                 points=features.points,
+                 descriptors=features.descriptors)
+
+    def clear(self):
+        """清空进程内缓存"""
+        with self.lock:
+            self.features.clear()
+
+
+FEATURE_STORE = FeatureStore()
@@ -4,12 +4,98 @@
 @author: szy
 """
 import os
+import cv2
 from ruamel import yaml
-from PIL import Image
 
 from config import Config
 from screenshot import Screenshot
 from test_script import TestScript
+import template_match
+from keyboard_store import KEYBOARD_STORE, KeyboardArtifact
+
+
+def parse_key_sequence(text):
+    """将键入的文字拆分为按键序列
+    使用“[”和"]"作为转义字符,存贮特殊按键,比如"[Return]"
+
+    Returns:
+        按键列表，例如'test[Return]' -> ['t', 'e', 's', 't', 'Return']
+    """
+    keys = []
+    key_str = ''
+    key_esc = False  # 是否转义
+    for key in text:
+        if key_esc:
+            if key == ']' and key_str != '':
+                key_esc = False
+                keys.append(key_str)
+                key_str = ''
+            else:
+                key_str += key
+        elif key == '[':
+            key_esc = True
+        else:
+            keys.append(key)
+    return keys
+
+
+def build_key_index(area):
+    """建立键盘的键位索引
+    索引只建立一次，按键查找结果与依次在各区域、各行中查找相同
+
+    Args:
+        area: 键盘配置文件中的区域配置
+    Returns:
+        dict, 小写键值 -> 键位中心在键盘图像中的横纵坐标比例
+    """
+    key_index = {}
+    for i in area:
+        kBarea = KBArea(area[i])
+        for row in kBarea.rows:
+            for k in row['keys']:
+                names = k.keys() if isinstance(k, dict) else [k]
+                for name in names:
+                    key = str(name).lower()
+                    # 多个区域都有该键值时使用第一个区域
+                    if key in key_index:
+                        continue
+                    key_area_coordinates = kBarea.find_key(str(name))
+                    if key_area_coordinates:
+                        key_index[key] = key_area_coordinates
+    return key_index
+
+
+def get_fit_rate(kb_original_size, screen_size):
+    """计算键盘图片的转换比例"""
+    if kb_original_size[0] == 0 or kb_original_size[1] == 0:
+        return 1
+    image_area = screen_size[0] * screen_size[1]
+    kb_area = kb_original_size[0] * kb_original_size[1]
+    return (image_area / kb_area) ** 0.5# 开根号
+
+
+def compile_keyboard(kb_image_path, keyboard_yaml, screen_size):
+    """编译键盘: 按屏幕尺寸缩放键盘图片，建立键位索引并计算SIFT特征点
+
+    Returns:
+        keyboard_store.KeyboardArtifact
+    """
+    with open(keyboard_yaml) as keyboard_file:
+        keyboard_data = yaml.load(keyboard_file, Loader=yaml.Loader)  # 读取配置文件
+    kb_original_size = keyboard_data['keyboard']['original_screen_size']
+    fitted = get_fit_rate(kb_original_size, screen_size)
+    kb_original_image = cv2.imread(kb_image_path)
+    if kb_original_image is None:
+        raise FileNotFoundError(kb_image_path)
+    kb_height, kb_width = kb_original_image.shape[:2]
+    kb_image = cv2.resize(kb_original_image, (int(kb_width * fitted),
+                                              int(kb_height * fitted)))
+    # 键盘匹配使用sift算法，只需要灰度图像
+    kb_image = cv2.cvtColor(kb_image, cv2.COLOR_BGR2GRAY)
+    key_index = build_key_index(keyboard_data['keyboard']['area'])
+    features = template_match.compute_widget_features('sift', kb_image)
+    return KeyboardArtifact(kb_image, key_index, features, fitted)
+
 
 class Keyboard(object):
     def __init__(self, log, keyboard_name):
@@ -17,60 +103,40 @@ class Keyboard(object):
         self.kb_images = ''
         self.kb_size = (0,0)
         self.fitted = 1
-        kb_image_path = os.path.abspath(os.path.join(
-                Config.get_keyboard_dir(), keyboard_name, 'keyboard.png'))  # 获取键盘图片
-        keyboard_yaml = os.path.abspath(os.path.join(
-                Config.get_keyboard_dir(), keyboard_name, 'keyboard.yaml'))  # 获取键盘配置文件
-        try:
-            keyboard_file = open(keyboard_yaml)
-            kb_original_image = Image.open(kb_image_path)
-        except FileNotFoundError as e:
-            raise FileNotFoundError(e)
-        keyboard_data = yaml.load(keyboard_file, Loader=yaml.Loader)  # 读取配置文件
-        keyboard_file.close()
-        
-        kb_original_size = keyboard_data['keyboard']['original_screen_size']
-        self.area = keyboard_data['keyboard']['area']
-        self.__fit(kb_original_size)# 计算转换比例
-        self.kb_size = kb_original_image.size
-        self.kb_size = (int(self.kb_size[0] * self.fitted), 
-                        int(self.kb_size[1] * self.fitted))
-        self.kb_images = kb_original_image.resize(self.kb_size)  # 转换键盘图片大小
+        keyboard_dir = os.path.abspath(os.path.join(Config.get_keyboard_dir(), keyboard_name))
+        kb_image_path = os.path.join(keyboard_dir, 'keyboard.png')  # 获取键盘图片
+        keyboard_yaml = os.path.join(keyboard_dir, 'keyboard.yaml')  # 获取键盘配置文件
+        if not os.path.isfile(keyboard_yaml):
+            raise FileNotFoundError(keyboard_yaml)
+        if not os.path.isfile(kb_image_path):
+            raise FileNotFoundError(kb_image_path)
+        # 缩放后的键盘图片、键位索引和特征点只编译一次，保存在键盘目录中
+        artifact = KEYBOARD_STORE.get_artifact(keyboard_dir,
+                                               Config.get_screenshot_size(),
+                                               compile_keyboard)
+        self.fitted = artifact.fitted
+        self.kb_images = artifact.image
+        self.key_index = artifact.key_index
+        self.kb_features = artifact.features
+        kb_height, kb_width = self.kb_images.shape[:2]
+        self.kb_size = (kb_width, kb_height)
         
-    def __fit(self, kb_original_size):
-        #计算转换比例
-        
-        if kb_original_size[0] == 0 or kb_original_size[1] == 0:
-            self.fitted = 1
-        else:
-            image_size = Config.get_screenshot_size()
-            image_area = image_size[0] * image_size[1]
-            kb_area = kb_original_size[0] * kb_original_size[1]
-            self.fitted = (image_area / kb_area) ** 0.5# 开根号
-        
-    def __match_exist_image(self, dirs_path, image):# 检查图片是否存在
-        try:
-            open(dirs_path + '/' + image)
-        except FileNotFoundError as e:
-            raise FileNotFoundError(e)
-        return dirs_path + '/' + image
-    
-    def get_keyboard_match_result(self, screen_shot_index, virtual_debug):
+    def get_keyboard_match_result(self, screen_shot_index, virtual_debug, frame=None):
         """确定keyboard键盘坐标
         
         Args:
             screen_shot_index: 当前拍摄的图像编号
             virtual_debug: 虚拟调试功能
+            frame: 当前拍摄的屏幕图像帧，为空时根据图像编号读取
         """
-        # 将转换大小后的临时键盘图像存储于widgets文件中，用于键盘匹配
-        temporary_keyboard_path = TestScript.get_temporary_keyboard_image(screen_shot_index)
-        self.kb_images.save(temporary_keyboard_path)
-        
-        # 获取对应的拍摄图像
+        # 获取对应的拍摄图像，转换大小后的键盘图像直接用于键盘匹配
         screen_shot = Screenshot(self.log,
-                                 widget_image = 'keyboard_{}.png'.format(screen_shot_index),
+                                 widget_image = TestScript.get_temporary_keyboard_image(screen_shot_index),
                                  screen_shot_index = screen_shot_index,
-                                 virtual_debug=virtual_debug)
+                                 virtual_debug=virtual_debug,
+                                 frame=frame,
+                                 widget=self.kb_images,
+                                 widget_features=self.kb_features)
         keyboard_match_result = screen_shot.get_image_match_result('sift')
         
 #        keyboard_match_result = template_match.surf_match(screen_shot_path,
@@ -78,9 +144,6 @@ class Keyboard(object):
         h,w = keyboard_match_result.get_image_size()
         keyboard_match_result.add_coordinates(-w/2, -h/2)# 将识别坐标改为左上角坐标
         
-        # 删除临时图像
-        os.remove(temporary_keyboard_path)
-        
         return keyboard_match_result
     
     def get_key_match_results(self, key, keyboard_area):
@@ -91,26 +154,29 @@ class Keyboard(object):
             keyboard_area: 键盘图像在图中的坐标
             [key_x, key_y]: 
         """
+        key_area_coordinates = self.key_index.get(key.lower())
+        if not key_area_coordinates:
+            return [0,0]
         
-        for i in self.area:
-            # 检测键值在那个area内
-            kBarea = KBArea(self.area[i])
-            # 判断键值是否在该区间,若存在，返回坐标，否则，坐标为空
-            key_area_coordinates = kBarea.find_key(key)
-            
-            if key_area_coordinates:
-                # 键值在该区间内
-                
-                # 整个键盘图标的横纵坐标起点,长宽
-                [x, y, w, h] = keyboard_area
-                # 键值横坐标为键值横坐标比例*键盘宽度+键盘起点横坐标
-                key_x = int(w * key_area_coordinates[0]) + x
-                
-                # 键值纵坐标为键值纵坐标比例*键盘高度+键盘起点纵坐标
-                key_y = int(h * key_area_coordinates[1]) + y
-                return [key_x, key_y]
+        # 整个键盘图标的横纵坐标起点,长宽
+        [x, y, w, h] = keyboard_area
+        # 键值横坐标为键值横坐标比例*键盘宽度+键盘起点横坐标
+        key_x = int(w * key_area_coordinates[0]) + x
+        # 键值纵坐标为键值纵坐标比例*键盘高度+键盘起点纵坐标
+        key_y = int(h * key_area_coordinates[1]) + y
+        return [key_x, key_y]
+    
+    def get_key_path(self, text, keyboard_area):
+        """将键入的文字转换为按键坐标序列
         
-        return [0,0]
+        Args:
+            text: 键入的文字，特殊按键使用"[]"转义
+            keyboard_area: 键盘图像在图中的坐标[x, y, w, h]
+        Returns:
+            [[key_x, key_y], ...]
+        """
+        return [self.get_key_match_results(key, keyboard_area)
+                for key in parse_key_sequence(text)]
     
 class KBArea(object):
     def __init__(self, area):
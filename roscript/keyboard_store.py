@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+"""
+Persistent store of compiled keyboards: scaled image, key index and SIFT features
+"""
+
+import hashlib
+import os
+import threading
+
+import cv2
+import numpy as np
+
+import template_match
+from feature_store import save_npz
+
+KEYBOARD_STORE_VERSION = 1
+
+
+def get_content_hash(*paths):
+    """计算文件内容的SHA1值"""
+    sha1 = hashlib.sha1()
+    for path in paths:
+        with open(path, 'rb') as f:
+            sha1.update(f.read())
+    return sha1.hexdigest()
+
+
+class KeyboardArtifact(object):
+    """编译后的键盘
+
+    Attributes:
+        image: 按屏幕尺寸缩放后的灰度键盘图像，只读
+        key_index: dict, 小写键值 -> 键位中心在键盘图像中的横纵坐标比例
+        features: template_match.WidgetFeatures, 键盘图像的SIFT特征点
+        fitted: 键盘图像的缩放比例
+    """
+
+    def __init__(self, image, key_index, features, fitted):
+        image.setflags(write=False)
+        self.image = image
+        self.key_index = key_index
+        self.features = features
+        self.fitted = fitted
+
+
+class KeyboardStore(object):
+    """编译后的键盘缓存
+
+    键盘只编译一次，保存在进程内，并以 keyboard.<宽>x<高>.kbc.npz 的形式保存在键盘目录中,
+    以键盘图片和配置文件的内容哈希及屏幕尺寸为键，内容改变后自动重新编译
+
+    Attributes:
+        artifacts: dict, 进程内缓存的键盘
+    """
+
+    def __init__(self):
+        self.artifacts = {}
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def get_store_path(keyboard_dir, screen_size):
+        """获取编译后的键盘文件路径"""
+        return os.path.join(keyboard_dir, 'keyboard.{}x{}.kbc.npz'.format(*screen_size))
+
+    def get_artifact(self, keyboard_dir, screen_size, compile_keyboard):
+        """获取编译后的键盘
+
+        Args:
+            keyboard_dir: 键盘目录，包含keyboard.png和keyboard.yaml
+            screen_size: 拍摄的屏幕图像尺寸
+            compile_keyboard: 缓存未命中时编译键盘的函数，
+                参数为键盘图片路径、配置文件路径和屏幕尺寸，返回KeyboardArtifact
+        Returns:
+            KeyboardArtifact
+        """
+        image_path = os.path.join(keyboard_dir, 'keyboard.png')
+        yaml_path = os.path.join(keyboard_dir, 'keyboard.yaml')
+        screen_size = tuple(screen_size)
+        # 进程内先按修改时间查找，避免每次计算哈希
+        key = (keyboard_dir, screen_size,
+               os.path.getmtime(image_path), os.path.getmtime(yaml_path))
+        with self.lock:
+            if key in self.artifacts:
+                return self.artifacts[key]
+
+        content_hash = get_content_hash(image_path, yaml_path)
+        store_path = KeyboardStore.get_store_path(keyboard_dir, screen_size)
+        artifact = KeyboardStore.__load(store_path, content_hash, screen_size)
+        if artifact is None:
+            artifact = compile_keyboard(image_path, yaml_path, screen_size)
+            KeyboardStore.__save(store_path, artifact, content_hash, screen_size)
+
+        with self.lock:
+            # 键盘被修改后，旧的编译结果不再有效
+            for stale_key in [k for k in self.artifacts
+                              if k[:2] == key[:2] and k != key]:
+                del self.artifacts[stale_key]
+            self.artifacts[key] = artifact
+        return artifact
+
+    @staticmethod
+    def __load(store_path, content_hash, screen_size):
+        """读取编译后的键盘，文件不存在或已过期时返回None"""
+        if not os.path.isfile(store_path):
+            return None
+        try:
+            with np.load(store_path) as data:
+                if (int(data['version']) != KEYBOARD_STORE_VERSION
+                        or str(data['opencv']) != cv2.__version__
+                        or str(data['hash']) != content_hash
+                        or tuple(data['screen_size']) != screen_size):
+                    return None
+                image = data['image']
+                key_index = {str(name): coordinates.tolist() for name, coordinates
+                             in zip(data['key_names'], data['key_coordinates'])}
+                features = template_match.WidgetFeatures(data['points'],
+                                                         data['descriptors'],
+                                                         tuple(image.shape[:2]))
+                return KeyboardArtifact(image, key_index, features, float(data['fitted']))
+        except (OSError, ValueError, KeyError):
+            return None
+
+    @staticmethod
+    def __save(store_path, artifact, content_hash, screen_size):
+        """保存编译后的键盘，键盘目录不可写时只在进程内缓存"""
+        save_npz(store_path,
+                 version=KEYBOARD_STORE_VERSION,
+                 opencv=cv2.__version__,
+                 hash=content_hash,
+                 screen_size=np.array(screen_size),
+                 image=artifact.image,
+                 fitted=artifact.fitted,
+                 key_names=np.array(list(artifact.key_index), dtype=str),
+                 key_coordinates=np.array(list(artifact.key_index.values()),
+                                          dtype=float).reshape(-1, 2),
+                 points=artifact.features.points,
+                 descriptors=artifact.features.descriptors)
+
+    def clear(self):
+        """清空进程内缓存"""
+        with self.lock:
+            self.artifacts.clear()
+
+
+KEYBOARD_STORE = KeyboardStore()
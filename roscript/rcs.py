@@ -7,11 +7,16 @@ Interface of the test engine
 
 import time
 import atexit
+from concurrent.futures import ThreadPoolExecutor
 from robot import Robot
 import robot
-from screenshot import Screenshot
+from screenshot import Screenshot, ScreenFrame
 from template_match import TemplateMatchResult, Algorithm
 from keyboard import Keyboard
+from widget_cache import WIDGET_CACHE
+from replay import REPLAY_ENGINE, NullLog, read_recorded_matches
+from roi_tracker import RoiTracker
+from screen_change import ScreenChangeDetector
 import contour
 from config import Config
 from rcslogger import RcsLogger
@@ -29,6 +34,8 @@ DETOUR_ACTION = {
     'double click',
     'drag',
     'find',
+    'find many',
+    'find all',
     'long press',
     'long press drag',
     'match',
@@ -38,6 +45,8 @@ DETOUR_ACTION = {
     'move to',
 }  # 需要执行规避动作的动作类型
 
+WAIT_RECHECK_INTERVAL = 1  # 屏幕没有变化时wait重新匹配控件的间隔(秒)
+
 
 def check_args():
     parser = argparse.ArgumentParser(description="Test script engine.", formatter_class=argparse.RawTextHelpFormatter)
@@ -65,6 +74,7 @@ class Rcs(object):
         algorithm: Algorithm类, 算法类，包含算法、阈值、阈值与识别结果关系运算符
         log: 记录不同的操作执行时间
         screen_shot_index: int, 图片图像拍摄计数
+        roi_tracker: RoiTracker, 控件位置先验索引, 未开启ROI跟踪时为空
     """
 
     def __init__(self):
@@ -76,12 +86,35 @@ class Rcs(object):
         self.lasted_widget = ''  # 上一步查找的图像
         self.algorithm = Algorithm()
         self.screen_shot_index = 0  # screenshot计数
+        # 控件位置先验索引，开启后先在控件上次出现的位置附近查找
+        self.roi_tracker = RoiTracker() if Config.is_roi_tracking_enabled() else None
+        if self.virtual_debug:
+            self.__start_replay()
         # 实际运行前，控制机械臂移动一段距离，以避免阻挡拍摄
         self.robot_dev.detour_from_origin()
         self.action_log = []
 
         atexit.register(self.exit_hooks)
 
+    def __start_replay(self):
+        """虚拟调试时预先读取录制的屏幕图像，并根据上次回放记录的动作预先匹配控件"""
+        REPLAY_ENGINE.start(Config.get_virtual_debug_dir(),
+                            [TestScript.get_pyname(), os.path.basename(TestScript.script_py_dir())],
+                            Config.get_match_workers())
+        action_log_path = os.path.join(TestScript.script_test_dir(), '%s.actions' % (TestScript.get_pyname()))
+        # 预先匹配整个屏幕范围，指定了其他匹配范围的动作在执行时匹配
+        contour = [int(round(v)) for v in Config.get_equipment_contour()]
+        recorded_matches = read_recorded_matches(action_log_path, TestScript.script_widgets_dir())
+        REPLAY_ENGINE.prefetch_matches([(image_path, template_path, self.algorithm.id, contour)
+                                        for image_path, template_path in recorded_matches],
+                                       Rcs.__prefetch_match)
+
+    @staticmethod
+    def __prefetch_match(image_path, template_path, algorithm, contour):
+        """在回放线程池中匹配控件"""
+        frame = ScreenFrame(REPLAY_ENGINE.get_image(image_path), 0, image_path)
+        return Screenshot(NullLog(), template_path, frame=frame).match_contour(contour, algorithm)
+
     @staticmethod
     def __is_image_file(image_name):
         """检测控件输入是否为图像
@@ -208,17 +241,17 @@ class Rcs(object):
         if region is None:
             region = [0, 0, 1, 1]
         reg = self.__is_region(region)
-        # 获取规避运动视频帧存储路径
-        detour_frame_path = self.robot_dev.get_detour_frame_path()
+        # 获取规避运动视频帧
+        detour_frame = self.robot_dev.get_detour_frame()
         # 找出图像位置,需要机器处于静止状态
         screen_shot = Screenshot(self.log,
                                  widget_image_name,
                                  screen_shot_index=0,
                                  region=reg,
                                  virtual_debug=self.virtual_debug,
-                                 detour_frame_path=detour_frame_path)
+                                 frame=detour_frame)
         # 选择要比对的图片
-        match_result = screen_shot.get_image_match_result(self.algorithm.id)
+        match_result = self.__get_match_result(screen_shot, widget_image_name, reg)
         # 如果在规避过程中能匹配到空间图像，则终止规避
         if self.algorithm.match_result_is_right(match_result.get_similarity()):
             self.match_result = match_result
@@ -252,11 +285,42 @@ class Rcs(object):
                                  widget_image_name,
                                  self.screen_shot_index,
                                  region=reg,
-                                 virtual_debug=self.virtual_debug)
+                                 virtual_debug=self.virtual_debug,
+                                 frame=self.robot_dev.get_screen_frame())
         # 选择要比对的图片
-        self.match_result = screen_shot.get_image_match_result(self.algorithm.id)
+        self.match_result = self.__get_match_result(screen_shot, widget_image_name, reg)
         return self.algorithm.match_result_is_right(self.match_result.get_similarity())
 
+    def __get_match_result(self, screen_shot, widget_image_name, region):
+        """获取控件匹配结果
+        
+        开启ROI跟踪时，先在控件上次出现的位置附近匹配，
+        相似度不满足阈值要求时再在整个查询范围内匹配
+        
+        Args:
+            screen_shot: Screenshot, 控件和屏幕图像
+            widget_image_name: string, 控件名称
+            region: 控件查询的范围
+        Returns:
+            TemplateMatchResult
+        """
+        if self.roi_tracker is not None:
+            roi = self.roi_tracker.get_roi(widget_image_name, region)
+            if roi is not None:
+                match_result = screen_shot.get_image_match_result(self.algorithm.id, roi)
+                if self.algorithm.match_result_is_right(match_result.get_similarity()):
+                    self.roi_tracker.record_hit()
+                    return match_result
+                self.roi_tracker.record_miss()
+
+        match_result = screen_shot.get_image_match_result(self.algorithm.id)
+        if self.roi_tracker is not None:
+            if self.algorithm.match_result_is_right(match_result.get_similarity()):
+                self.roi_tracker.update(widget_image_name, region, match_result)
+            else:
+                self.roi_tracker.remove(widget_image_name, region)
+        return match_result
+
     def end_script_run(self):
         """结束脚本运行"""
         # 释放接口
@@ -273,8 +337,8 @@ class Rcs(object):
             region: 控件查询的范围,默认为整个被测设备屏幕
             
         Returns:
-            一个包含所有可能结果的集合
-            集合单元为: 算法识别相似度、识别坐标
+            最相似的结果: [算法识别相似度, 横坐标, 纵坐标]
+            需要控件的多个实例时使用find_all
         """
         # 查找控件坐标
         # 分步规避动作
@@ -289,9 +353,10 @@ class Rcs(object):
                                  widget_image_name,
                                  screen_shot_index=self.screen_shot_index,
                                  region=reg,
-                                 virtual_debug=self.virtual_debug)
+                                 virtual_debug=self.virtual_debug,
+                                 frame=self.robot_dev.get_screen_frame())
         self.lasted_widget = widget_image_name
-        self.match_result = screen_shot.get_image_match_result(self.algorithm.id)
+        self.match_result = self.__get_match_result(screen_shot, widget_image_name, reg)
         similarity = self.match_result.get_similarity()
         x, y = self.match_result.get_coordinates()
 
@@ -302,6 +367,92 @@ class Rcs(object):
         self.log.record_action_end()
         return [similarity, x, y]
 
+    def find_all(self, widget_image_name, region=None, count=5):
+        """检测控件在屏幕中的多个实例
+        
+        在一次模板匹配中对匹配结果进行非极大值抑制，得到互不重叠的多个位置
+        
+        Args:
+            widget_image_name: string, 控件名称
+            region: 控件查询的范围,默认为整个被测设备屏幕
+            count: 最多返回的结果数量
+            
+        Returns:
+            满足模板匹配算法阈值的TemplateMatchResult列表, 按相似程度从高到低排列
+            不支持多结果的算法最多返回一个结果
+        """
+        self.log.record_action_start("find all", "'{}'".format(widget_image_name))
+        self.detour('find all', region=region)
+
+        if region is None:
+            region = [0, 0, 1, 1]
+        reg = self.__is_region(region)
+        self.__get_snapscreen('find')
+        screen_shot = Screenshot(self.log,
+                                 widget_image_name,
+                                 screen_shot_index=self.screen_shot_index,
+                                 region=reg,
+                                 virtual_debug=self.virtual_debug,
+                                 frame=self.robot_dev.get_screen_frame())
+        match_results = [m for m in screen_shot.get_image_match_results(self.algorithm.id, count)
+                         if self.algorithm.match_result_is_right(m.get_similarity())]
+        if match_results:
+            self.lasted_widget = widget_image_name
+            self.match_result = match_results[0]
+
+        self.dbg_record_action('find_all', [widget_image_name, region, count], match_results,
+                               [m.get_coordinates() for m in match_results])
+
+        if self.virtual_debug:
+            print("[Virtual Debug] find_all('{}'): {} found on screen {}".format(
+                  widget_image_name, len(match_results), self.screen_shot_index))
+        self.log.record_action_end()
+        return match_results
+
+    def find_many(self, widget_image_names, region=None):
+        """在同一张屏幕图像中检测多个控件的位置
+        
+        只拍摄一次屏幕图像，多个控件的模板匹配在线程池中并行执行
+        
+        Args:
+            widget_image_names: list, 控件名称列表
+            region: 控件查询的范围,默认为整个被测设备屏幕
+            
+        Returns:
+            dict, 控件名称到模板匹配结果TemplateMatchResult的映射
+        """
+        widget_image_names = list(dict.fromkeys(widget_image_names))
+        self.log.record_action_start("find many", "{}".format(widget_image_names))
+        self.detour('find many', region=region)
+
+        if region is None:
+            region = [0, 0, 1, 1]
+        reg = self.__is_region(region)
+        self.__get_snapscreen('find')
+        frame = self.robot_dev.get_screen_frame()
+        screen_shots = [Screenshot(self.log,
+                                   widget_image_name,
+                                   screen_shot_index=self.screen_shot_index,
+                                   region=reg,
+                                   virtual_debug=self.virtual_debug,
+                                   frame=frame)
+                        for widget_image_name in widget_image_names]
+        # 模板匹配主要在opencv中执行，会释放GIL，多线程可以利用多个CPU核
+        # 与find相同，开启ROI跟踪时先在控件上次出现的位置附近匹配
+        workers = min(Config.get_match_workers(), max(len(screen_shots), 1))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            match_results = list(executor.map(
+                    lambda screen_shot: self.__get_match_result(screen_shot, screen_shot.widget_name, reg),
+                    screen_shots))
+
+        self.dbg_record_action('find_many', [widget_image_names, region], match_results,
+                               [m.get_coordinates() for m in match_results])
+
+        if self.virtual_debug:
+            print("[Virtual Debug] find_many({}): Succeed!".format(widget_image_names))
+        self.log.record_action_end()
+        return dict(zip(widget_image_names, match_results))
+
     def match(self, widget_image_name, region=None):
         """对控件进行模板匹配
         
@@ -501,7 +652,8 @@ class Rcs(object):
             self.screen_shot_index = self.robot_dev.get_photo_index('press keyboard')
 
         keyboard_model = Keyboard(self.log, keyboard_name)  # 获取指定键盘信息
-        ensure_keyboard_result = keyboard_model.get_keyboard_match_result(self.screen_shot_index, self.virtual_debug)
+        ensure_keyboard_result = keyboard_model.get_keyboard_match_result(self.screen_shot_index, self.virtual_debug,
+                                                                          self.robot_dev.get_screen_frame())
 
         x, y = ensure_keyboard_result.get_coordinates()
         h, w = ensure_keyboard_result.get_image_size()
@@ -522,27 +674,10 @@ class Rcs(object):
                 self.reset_arms()
                 raise Exception("Can not find keyboard:'{}'!".format(keyboard_name))
 
-        key_str = ''
-        key_esc = False  # 是否转义
-        key_pos_seq = []
-        # 按顺序键入按键。使用“[”和"]"作为转义字符,存贮特殊按键,比如"Enter"
-        for key in text:
-            if key_esc:
-                if key == ']' and key_str != '':
-                    key_esc = False
-                    kpos = self.__click_key(keyboard_model, [x, y, w, h], key_str)
-                    key_pos_seq.append(kpos)
-                    key_str = ''
-                else:
-                    key_str += key
-            elif key == '[':
-                key_esc = True
-
-            else:
-                key_str += key
-                kpos = self.__click_key(keyboard_model, [x, y, w, h], key_str)
-                key_pos_seq.append(kpos)
-                key_str = ''
+        # 先将整个字符串转换为按键坐标序列，再一次生成全部点击动作
+        # 使用“[”和"]"作为转义字符,存贮特殊按键,比如"Enter"
+        key_pos_seq = keyboard_model.get_key_path(text, [x, y, w, h])
+        self.robot_dev.click_path(key_pos_seq)
 
         self.dbg_record_action('press_keyboard', [keyboard_name, text], [ensure_keyboard_result], key_pos_seq)
 
@@ -553,22 +688,6 @@ class Rcs(object):
 
         self.log.record_action_end()
 
-    def __click_key(self, keyboard_file, keyboard_area, text):
-        """在虚拟键盘中键入单个文字
-        
-        Args:
-            keyboard_file: string, 指定键盘文件
-            keyboard_area: 键盘在设备中所处的位置
-            text: 键入的单个按键
-            
-        Returns:
-            识别结果
-        """
-        # 获取键位坐标和键盘识别结果
-        key_x, key_y = keyboard_file.get_key_match_results(text, keyboard_area)
-        self.robot_dev.click(key_x, key_y)
-        return key_x, key_y
-
     def swipe(self, direction, region=[0, 0, 1, 1]):
         """在屏幕中朝指定方向滑动
         
@@ -880,9 +999,10 @@ class Rcs(object):
                                  widget_image_name,
                                  screen_shot_index=self.screen_shot_index,
                                  region=region,
-                                 virtual_debug=self.virtual_debug)
+                                 virtual_debug=self.virtual_debug,
+                                 frame=self.robot_dev.get_screen_frame())
         # 选择要比对的图像
-        self.match_result = screen_shot.get_image_match_result(self.algorithm.id)
+        self.match_result = self.__get_match_result(screen_shot, widget_image_name, region)
 
         if self.algorithm.match_result_is_right(self.match_result.get_similarity()):
             self.log.record_assert_match_result("Yes")
@@ -921,8 +1041,9 @@ class Rcs(object):
                                  widget_image_name,
                                  screen_shot_index=self.screen_shot_index,
                                  region=region,
-                                 virtual_debug=self.virtual_debug)
-        self.match_result = screen_shot.get_image_match_result(self.algorithm.id)
+                                 virtual_debug=self.virtual_debug,
+                                 frame=self.robot_dev.get_screen_frame())
+        self.match_result = self.__get_match_result(screen_shot, widget_image_name, region)
 
         if not self.algorithm.match_result_is_right(self.match_result.get_similarity()):
             self.log.record_assert_match_result("Yes")
@@ -944,13 +1065,13 @@ class Rcs(object):
             return False
 
     def wait(self, widget_image_name,
-             wait_time=Config.get_wait_time(),
+             wait_time=None,
              region=[0, 0, 1, 1]):
         """等待指定控件图像的出现
         
         Args:
             widget_image_name: string, 控件图名称
-            wait_time: 等待时间,默认为5s
+            wait_time: 等待时间,默认为配置的等待时间
             region: 控件查询的范围,默认为整个被测设备屏幕
             
         Returns: 
@@ -959,22 +1080,29 @@ class Rcs(object):
         Raises: 
             Exception: 没有等到指定控件
         """
+        if wait_time is None:
+            wait_time = Config.get_wait_time()
         self.log.record_action_start("wait",
                                      "'{}'".format(widget_image_name))
         self.detour('wait', region=region)
 
-        # 每一秒进行一次查询
-        for i in range(wait_time):
-            if not self.virtual_debug:
-                time.sleep(1)
-                self.log.record_sleep_time(1)
-            if self.__check_widget_exist(widget_image_name, region):
-                self.log.record_action_end()
-                self.dbg_record_action('wait', [widget_image_name, region], [self.match_result], [self.match_result.get_coordinates()])
+        if self.virtual_debug:
+            # 每次查询依次使用录制的屏幕图像
+            found = False
+            for i in range(wait_time):
+                if self.__check_widget_exist(widget_image_name, region):
+                    found = True
+                    break
+        else:
+            found = self.__wait_widget(widget_image_name, region, wait_time)
 
-                if self.virtual_debug:
-                    print("[Virtual Debug] Wait('{}') Succeed on screen {}".format(widget_image_name, self.screen_shot_index))
-                return True
+        if found:
+            self.log.record_action_end()
+            self.dbg_record_action('wait', [widget_image_name, region], [self.match_result], [self.match_result.get_coordinates()])
+
+            if self.virtual_debug:
+                print("[Virtual Debug] Wait('{}') Succeed on screen {}".format(widget_image_name, self.screen_shot_index))
+            return True
 
         self.dbg_record_action('wait', [widget_image_name, region], [self.match_result], [self.match_result.get_coordinates()])
         self.log.record_custom_message("Wait('{}') Failed!".format(widget_image_name))
@@ -985,6 +1113,40 @@ class Rcs(object):
         self.log.record_action_end()
         return False
 
+    def __wait_widget(self, widget_image_name, region, wait_time):
+        """实际运行时在等待时间内反复匹配控件
+
+        开启屏幕变化检测时，每次匹配失败后逐帧比较屏幕与匹配时的图像，屏幕发生变化后立即重新匹配，
+        查询间隔即摄像头的帧间隔；屏幕没有变化时最多每隔WAIT_RECHECK_INTERVAL秒重新匹配一次
+
+        Returns:
+            在等待时间内是否匹配到控件
+        """
+        detector = None
+        if Config.is_screen_change_enabled():
+            detector = ScreenChangeDetector(contour.get_region_contour(self.__is_region(region)))
+        deadline = time.perf_counter() + wait_time
+        found = self.__check_widget_exist(widget_image_name, region)
+        matches = 1
+        while not found and time.perf_counter() < deadline:
+            recheck_time = min(deadline, time.perf_counter() + WAIT_RECHECK_INTERVAL)
+            poll_start = time.perf_counter()
+            if detector is None:
+                time.sleep(recheck_time - poll_start)
+            else:
+                detector.set_reference(self.robot_dev.get_screen_frame().image)
+                while (time.perf_counter() < recheck_time
+                       and not detector.is_changed(self.robot_dev.peek_frame())):
+                    pass
+            self.log.record_sleep_time(time.perf_counter() - poll_start)
+            found = self.__check_widget_exist(widget_image_name, region)
+            matches += 1
+
+        if detector is not None:
+            self.log.record_custom_message("wait('{}'), matches: {}, screen checks: {}, changes: {}".format(
+                widget_image_name, matches, detector.checks, detector.changes))
+        return found
+
     def sleep(self, num):
         """脚本休眠"""
         self.log.record_action_start("sleep", "{}".format(num))
@@ -1129,11 +1291,22 @@ class Rcs(object):
                 dev_pos = Config.get_equipment_contour()
                 data = {"dev_pos": dev_pos, "debug_folder": Config.get_virtual_debug_dir(), "actions": self.action_log}
                 json.dump(data, f, indent=4)
+            # 等待调试标注图像写入结束
+            self.log.record_custom_message("replay, prefetched matches used: {}, unused: {}".format(
+                *REPLAY_ENGINE.close()))
+            self.log.close()
             return
 
         if self.robot_dev.is_need_reset():
             self.reset_arms()
         self.robot_dev.release()
+        self.log.record_custom_message("widget cache, hits: {}, misses: {}".format(
+            WIDGET_CACHE.hits, WIDGET_CACHE.misses))
+        self.log.record_custom_message("video frames, written: {}, dropped: {}".format(
+            *self.robot_dev.get_video_stats()))
+        if self.roi_tracker is not None:
+            self.log.record_custom_message("roi tracking, hits: {}, misses: {}".format(
+                self.roi_tracker.hits, self.roi_tracker.misses))
         self.log.record_script_end()
 
     def dbg_record_action(self, action_type, action_params, tm_match_results, coordinate_seq):
@@ -1158,9 +1331,21 @@ class Rcs(object):
             return
 
         screenshot_path = Screenshot.get_screenshot_path(self.screen_shot_index, self.virtual_debug)
-        screenshot = cv2.imread(screenshot_path)
+        action_image_path = TestScript.script_test_dir() + os.sep \
+                            + "%s_action_%d.png" % (TestScript.get_pyname(), self.screen_shot_index)
+        # 标注图像在后台线程中绘制和写入
+        REPLAY_ENGINE.submit_write(Rcs.__write_action_image, screenshot_path, action_image_path,
+                                   Config.get_equipment_contour(), action_type, coordinate_seq)
+
+    @staticmethod
+    def __write_action_image(screenshot_path, action_image_path, dev_region, action_type, coordinate_seq):
+        """在屏幕图像上标注动作类型和动作坐标，并写入调试目录"""
+        screenshot = REPLAY_ENGINE.get_image(screenshot_path)
+        if screenshot is None:
+            screenshot = cv2.imread(screenshot_path)
+        else:
+            screenshot = screenshot.copy()
         # 获取当前屏幕操作区域
-        dev_region = Config.get_equipment_contour()
         device_image = screenshot[dev_region[1]: dev_region[3], dev_region[0]: dev_region[2]]
         cv2.putText(device_image, action_type, (30, 40), cv2.FONT_HERSHEY_COMPLEX, 1, (0,255,0), 3)
 
@@ -1183,6 +1368,4 @@ class Rcs(object):
                     cv2.arrowedLine(device_image, last_pt, point, (0, 0, 255), 2, 8, 0, 0.2)
                 last_pt = point
 
-        action_image_path = TestScript.script_test_dir() + os.sep \
-                            + "%s_action_%d.png" % (TestScript.get_pyname(), self.screen_shot_index)
         cv2.imwrite(action_image_path, device_image)
\ No newline at end of file
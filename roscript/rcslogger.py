@@ -7,7 +7,12 @@ Created on Fri Jan 22 15:36:55 2021
 import os
 import time
 import logging
+import logging.handlers
+import threading
+from queue import Queue
 
+from action_metrics import ActionMetrics, format_summary
+from config import Config
 from test_script import TestScript
 
 
@@ -58,6 +63,8 @@ ACTION_SUMMARY = {
     'match': ACTION_LOG('match'),
     'wait': ACTION_LOG('wait'),
     'find': ACTION_LOG('find'),
+    'find many': ACTION_LOG('find many'),
+    'find all': ACTION_LOG('find all'),
     'template match': ACTION_LOG('template match'),
     'take photo': ACTION_LOG('take photo'),
     'detour': ACTION_LOG('detour'),
@@ -87,6 +94,7 @@ class RcsLogger(object):
         action_start_time: float, 记录开始时间时间
         log_type: string, log记录类型,
         logger: log记录
+        metrics: ActionMetrics, 每个动作的总耗时和各阶段耗时
         action_number: int, 指令执行的操作数
         opencv_number: int, 图像识别的操作数
         take_photo_number: int, 视频截取的操作数
@@ -108,8 +116,10 @@ class RcsLogger(object):
         """
         self.script_name = script_name
         self.logger = logging.getLogger("roscript")
-        self.__config_log()
+        log_path = TestScript.get_log_path()
+        self.__config_log(log_path)
         self.__record_script_name(virtual_debug)
+        self.metrics = self.__create_metrics(log_path)
 
         self.script_start_time = time.time()  # 脚本开始时间
         self.script_total_time = time.time()  # 脚本执行总时间
@@ -121,7 +131,9 @@ class RcsLogger(object):
         self.exec_action_num = 0  # 动作执行数量
 
         # 模板匹配信息
-        self.TM_start_time = 0  # 模板匹配开始时间
+        # 多个控件可以在不同线程中并行匹配，开始时间按线程分别记录
+        self.TM_local = threading.local()  # 模板匹配开始时间
+        self.TM_lock = threading.Lock()
         self.TM_idx = 0  # 模板匹配编号
 
         # 拍照信息
@@ -136,10 +148,11 @@ class RcsLogger(object):
         # 记录睡眠时间
         self.sleep_total_time = 0
 
-    def __config_log(self):
+    def __config_log(self, log_path):
         """配置log输出格式
         
         格式参考: 时间,等级,操作信息
+        日志先放入队列，由后台线程格式化并写入文件
         """
         # log输出格式
         formatter = logging.Formatter('%(asctime)s, %(levelname)s, %(message)s')
@@ -147,7 +160,7 @@ class RcsLogger(object):
         self.logger.handlers.clear()  # 清空log
         self.logger.setLevel(logging.INFO)
 
-        fh = logging.FileHandler(TestScript.get_log_path())
+        fh = logging.FileHandler(log_path)
         fh.setLevel(logging.INFO)
         fh.setFormatter(formatter)
 
@@ -155,10 +168,29 @@ class RcsLogger(object):
         #        wh.setLevel(logging.ERROR)
         #        wh.setFormatter(formatter)
 
-        self.logger.addHandler(fh)
+        log_queue = Queue()
+        self.logger.addHandler(logging.handlers.QueueHandler(log_queue))
+        self.log_listener = logging.handlers.QueueListener(log_queue, fh)
+        self.log_listener.start()
 
     #        self.logger.addHandler(wh)
 
+    @staticmethod
+    def __create_metrics(log_path):
+        """创建动作耗时记录，记录文件与日志文件同名"""
+        metrics_format = Config.get_metrics_format()
+        metrics_path = None
+        if metrics_format in ('JSONL', 'CSV'):
+            extension = '.metrics.csv' if metrics_format == 'CSV' else '.metrics.jsonl'
+            metrics_path = os.path.splitext(log_path)[0] + extension
+        return ActionMetrics(metrics_path, metrics_format,
+                             Config.get_metrics_buffer_size())
+
+    def close(self):
+        """写入剩余的动作耗时记录和日志"""
+        self.metrics.close()
+        self.log_listener.stop()
+
     def __record_script_name(self, virtual_debug):
         """记录脚本名"""
         self.logger.info("script: {}".format(self.script_name))
@@ -177,6 +209,7 @@ class RcsLogger(object):
         self.logger.info("----------------------------------------")
         self.logger.info("action {} start:".format(self.exec_action_message))
         ACTION_SUMMARY[self.exec_action_name].record_action_exec_num()
+        self.metrics.begin(action_name)
 
     def record_action_end(self):
         """记录动作结束"""
@@ -191,6 +224,7 @@ class RcsLogger(object):
         self.logger.info(action_message)
         self.logger.info("action {} end.".format(self.exec_action_message))
         ACTION_SUMMARY[self.exec_action_name].record_action_total_time(action_exec_time)
+        self.metrics.end()
 
     def record_script_end(self):
         """记录脚本结束"""
@@ -204,11 +238,13 @@ class RcsLogger(object):
         self.logger.info(script_message)
         # 打印细节信息
         self.print_action_summary()
+        self.close()
 
     def record_TM_start(self):
         """记录模板匹配开始时间"""
-        self.TM_start_time = time.time()
-        ACTION_SUMMARY["template match"].record_action_exec_num()
+        self.TM_local.start_time = time.perf_counter()
+        with self.TM_lock:
+            ACTION_SUMMARY["template match"].record_action_exec_num()
 
     def record_TM_scale(self, scaling):
         """记录模板匹配轮廓缩放"""
@@ -217,24 +253,28 @@ class RcsLogger(object):
 
     def record_TM_result(self, match_result):
         """记录模板匹配信息和结果"""
-        TM_exec_time = time.time() - self.TM_start_time
-        self.TM_idx += 1
+        TM_exec_time = time.perf_counter() - self.TM_local.start_time
+        self.metrics.add('match', TM_exec_time)
+        with self.TM_lock:
+            self.TM_idx += 1
+            TM_idx = self.TM_idx
+            ACTION_SUMMARY["template match"].record_action_total_time(TM_exec_time)
         x, y = match_result.get_coordinates()
         TM_message = ("template match, number: {}, time: {:.2f}s, "
                       "similarity: {:.2f}, coordinates: [{}, {}], images: [{}, {}]"
-                      .format(self.TM_idx, TM_exec_time, match_result.similarity, x, y,
+                      .format(TM_idx, TM_exec_time, match_result.similarity, x, y,
                               os.path.basename(match_result.image), os.path.basename(match_result.template)))
         self.logger.info(TM_message)
-        ACTION_SUMMARY["template match"].record_action_total_time(TM_exec_time)
 
     def record_TP_start(self):
         """记录拍照开始时间"""
-        self.TP_start_time = time.time()
+        self.TP_start_time = time.perf_counter()
         ACTION_SUMMARY["take photo"].record_action_exec_num()
 
     def record_TP_result(self, image_index):
         """记录模板匹配信息和结果"""
-        TP_exec_time = time.time() - self.TP_start_time
+        TP_exec_time = time.perf_counter() - self.TP_start_time
+        self.metrics.add('capture', TP_exec_time)
         self.TP_idx += 1
         self.TP_total_time += TP_exec_time
         TP_message = ("take photo, number: {}, time: {:.2f}s, "
@@ -244,25 +284,36 @@ class RcsLogger(object):
         ACTION_SUMMARY["take photo"].record_action_total_time(TP_exec_time)
 
     def record_touch_time(self, touch_time):
-        """记录触摸动作时间"""
+        """记录触摸动作(抬笔落笔)时间"""
         touch_message = "robot touch: {:.2f}s".format(touch_time)
         self.logger.info(touch_message)
         ACTION_SUMMARY["touch"].record_action_total_time(touch_time)
+        self.metrics.add('pen', touch_time)
 
     def record_move_time(self, move_time):
         """记录移动动作时间"""
         move_message = "robot move: {:.2f}s".format(move_time)
         self.logger.info(move_message)
         ACTION_SUMMARY["move"].record_action_total_time(move_time)
+        self.metrics.add('move', move_time)
+
+    def record_robot_wait_time(self, wait_time):
+        """记录等待机械臂停止的时间"""
+        self.metrics.add('wait', wait_time)
+
+    def record_queue_wait_time(self, wait_time):
+        """记录指令队列已满时等待加入指令的时间"""
+        self.metrics.add('queue', wait_time)
 
     def record_detour_start(self):
         """记录规避运动开始时间"""
-        self.detour_start_time = time.time()
+        self.detour_start_time = time.perf_counter()
         ACTION_SUMMARY["detour"].record_action_exec_num()
 
     def record_detour_result(self):
         """记录规避运动"""
-        detour_exec_time = time.time() - self.detour_start_time
+        detour_exec_time = time.perf_counter() - self.detour_start_time
+        self.metrics.add('detour', detour_exec_time)
         self.detour_idx += 1
         detour_message = ("detour: {:.2f}s".format(detour_exec_time))
         self.logger.info(detour_message)
@@ -286,6 +337,9 @@ class RcsLogger(object):
         for action in ACTION_SUMMARY:
             if ACTION_SUMMARY[action].action_exec_num != 0:
                 self.logger.info(ACTION_SUMMARY[action].get_message())
+        # 各动作的耗时分布
+        for line in format_summary(self.metrics.summary()):
+            self.logger.info(line)
 
     def record_assert_match_start(self, action_name, message=""):
         """记录操作开始"""
@@ -295,6 +349,7 @@ class RcsLogger(object):
         self.logger.info("----------------------------------------")
         self.logger.info("{} start:".format(self.exec_action_message))
         ACTION_SUMMARY[self.exec_action_name].record_action_exec_num()
+        self.metrics.begin(action_name)
 
     def record_assert_match_result(self, result):
         """记录动作结束"""
@@ -308,6 +363,7 @@ class RcsLogger(object):
         self.logger.info(action_message)
         self.logger.info("{}: {}!".format(self.exec_action_message, result))
         ACTION_SUMMARY[self.exec_action_name].record_action_total_time(action_exec_time)
+        self.metrics.end()
 
     def record_sleep_time(self, time):
         """记录脚本休眠时间"""
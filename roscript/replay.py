@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*-
+"""
+Offline replay of recorded screenshots in virtual debug mode
+"""
+
+import json
+import os
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+
+
+class ReplayEngine(object):
+    """虚拟调试回放引擎
+
+    虚拟调试开始时并行读取录制的全部屏幕图像，保存在内存中；根据上次回放记录的动作(.actions文件)，
+    在线程池中预先进行之后的动作要做的模板匹配；调试标注图像在后台线程中写入。
+    未开启时各个接口都返回空，调用者按原来的方式读取图像和匹配
+
+    Attributes:
+        images: dict, 屏幕图像路径 -> 只读的BGR图像
+        matches: dict, (屏幕图像路径, 控件图像路径, 算法, 匹配区域) -> 预先匹配的Future
+        hits: 使用预先匹配结果的次数
+    """
+
+    def __init__(self):
+        self.images = {}
+        self.matches = {}
+        self.hits = 0
+        self.executor = None
+        self.writer = None
+        self.lock = threading.Lock()
+
+    def is_started(self):
+        return self.executor is not None
+
+    def start(self, frame_dir, frame_names, workers):
+        """开始回放，并行读取录制的屏幕图像
+
+        Args:
+            frame_dir: 录制的屏幕图像所在目录
+            frame_names: 屏幕图像的文件名前缀，按优先顺序排列，文件名形如<前缀>_<编号>.png
+            workers: 读取图像和预先匹配的线程数
+        """
+        self.executor = ThreadPoolExecutor(workers)
+        self.writer = ThreadPoolExecutor(1)
+        frame_paths = get_frame_paths(frame_dir, frame_names)
+        for path, image in zip(frame_paths, self.executor.map(cv2.imread, frame_paths)):
+            if image is not None:
+                # 缓存的图像为只读，需要修改时先复制
+                image.setflags(write=False)
+                self.images[os.path.abspath(path)] = image
+
+    def get_image(self, image_path):
+        """获取预先读取的屏幕图像，未读取时返回None"""
+        return self.images.get(os.path.abspath(image_path))
+
+    def prefetch_matches(self, match_specs, match):
+        """在线程池中预先进行模板匹配
+
+        Args:
+            match_specs: [(屏幕图像路径, 控件图像路径, 算法, 匹配区域), ...]
+            match: 匹配函数，参数与match_specs中的各项相同，返回TemplateMatchResult
+        """
+        if not self.is_started():
+            return
+        with self.lock:
+            for image_path, template_path, algorithm, contour in match_specs:
+                key = (os.path.abspath(image_path), os.path.abspath(template_path),
+                       algorithm, tuple(contour))
+                if key not in self.matches and key[0] in self.images:
+                    self.matches[key] = self.executor.submit(match, *key)
+
+    def take_match(self, image_path, template_path, algorithm, contour):
+        """取出预先匹配的Future，没有预先匹配时返回None"""
+        key = (os.path.abspath(image_path), os.path.abspath(template_path), algorithm, tuple(contour))
+        with self.lock:
+            return self.matches.pop(key, None)
+
+    def get_match_result(self, future):
+        """等待预先匹配结束
+
+        Returns:
+            TemplateMatchResult的副本，预先匹配失败时返回None，由调用者重新匹配
+        """
+        try:
+            match_result = future.result()
+        except Exception:
+            return None
+        with self.lock:
+            self.hits += 1
+        return match_result.copy()
+
+    def submit_write(self, write, *args):
+        """在后台线程中写入文件，未开启回放时直接写入"""
+        if self.writer is None:
+            write(*args)
+        else:
+            self.writer.submit(write, *args)
+
+    def close(self):
+        """等待写入结束，释放预先读取的图像和匹配结果
+
+        Returns:
+            (使用的预先匹配数, 未使用的预先匹配数)
+        """
+        if not self.is_started():
+            return 0, 0
+        with self.lock:
+            for future in self.matches.values():
+                future.cancel()
+            unused = len(self.matches)
+            self.matches.clear()
+        self.executor.shutdown()
+        self.writer.shutdown()
+        self.executor = None
+        self.writer = None
+        self.images.clear()
+        return self.hits, unused
+
+
+class NullLog(object):
+    """预先匹配时使用的日志，不记录任何信息"""
+
+    def record_TM_start(self):
+        pass
+
+    def record_TM_scale(self, scaling):
+        pass
+
+    def record_TM_result(self, match_result):
+        pass
+
+
+def get_frame_paths(frame_dir, frame_names):
+    """查找录制的屏幕图像，同一编号存在多个前缀时使用靠前的前缀"""
+    if not os.path.isdir(frame_dir):
+        return []
+    patterns = [re.compile(r'^{}_(\d+)\.png$'.format(re.escape(name))) for name in frame_names]
+    frames = {}
+    for file_name in os.listdir(frame_dir):
+        for priority, pattern in enumerate(patterns):
+            m = pattern.match(file_name)
+            if m is not None:
+                index = int(m.group(1))
+                if index not in frames or frames[index][0] > priority:
+                    frames[index] = (priority, os.path.join(frame_dir, file_name))
+    return [frames[index][1] for index in sorted(frames)]
+
+
+def read_recorded_matches(action_log_path, widgets_dir):
+    """读取上次回放记录的模板匹配
+
+    Returns:
+        [(屏幕图像路径, 控件图像路径), ...], 只包含控件目录中的控件
+    """
+    if not os.path.isfile(action_log_path):
+        return []
+    try:
+        with open(action_log_path) as f:
+            actions = json.load(f)['actions']
+    except (OSError, ValueError, KeyError):
+        return []
+    recorded = []
+    for action in actions:
+        for tm_match in action.get('tm_match') or []:
+            if tm_match is None:
+                continue
+            template = tm_match['template']
+            if os.path.dirname(template) == os.path.abspath(widgets_dir):
+                recorded.append((tm_match['image'], template))
+    return recorded
+
+
+REPLAY_ENGINE = ReplayEngine()
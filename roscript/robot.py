@@ -4,6 +4,7 @@ Connect the robot
 """
 import os
 import math
+import time
 import numpy as np
 
 from test_script import TestScript
@@ -11,7 +12,7 @@ from config import Config
 import contour
 import screenshot
 from sut_monitor import SutMonitor
-from command_queue import CommandQueue
+from command_queue import BLOCK_COMMAND, CommandQueue, estimate_exec_time
 
 # 规避运动过程中远离离屏幕坐标系的距离，
 # 防止机械臂遮挡屏幕，
@@ -24,13 +25,12 @@ MOVE_OUTSIDE_DISTANCE = {
     5: 0,
 }
 
-g_one_cm_steps = Config.get_one_cm_steps()  # 步进电机运动1cm需要的步进距离
-pen_initial_height = Config.get_tip_initial_height()
 
-PRESS_TIME = Config.get_press_time()  # 长按时间
-DOUBLE_CLICK_TIME = Config.get_double_click_time()  # 双击时间
-DETOUR_STEP_THRESHOLD = Config.get_detour_step_threshold()  # 获取分步规避阈值
-DETOUR_STEP_DISTANCE = Config.get_detour_step_distance()  # 获取分步规避单次移动距离
+# 连续运动轨迹规划参数
+PATH_SETTLE_TIME = 50  # 连续点击时每次移动、抬笔后的稳定时间(ms)
+RAMP_DISTANCE = 2000  # 电机转动量超过此步进距离的移动在起止阶段减速，减小停止时的晃动
+RAMP_RATE = 0.15  # 加、减速段各占移动距离的比例
+RAMP_SPEED_RATE = 0.5  # 加、减速段的速度与电机速度的比例
 
 
 def normalize_device_direction(sx, sy):
@@ -74,8 +74,13 @@ class Robot(object):
 
         self.sut = SutMonitor()  # 视频监控
         self.cq = CommandQueue()  # 机器人指令队列
+        if not virtual_debug:
+            # 记录连接时查询的固件版本及支持的功能
+            self.log.record_custom_message(self.cq.get_ebb_capabilities().get_message())
 
         self.action_duration = 0  # 指令动作持续时间
+        self.last_action_future = None  # 最近加入指令队列的动作执行结束时完成的Future
+        self.screen_frame = None  # 最近一次拍摄的屏幕图像帧
 
         self.robot_current_coordinates = np.array([0, 0])  # 机械臂在机器人坐标系内的坐标(物理距离)
         # 分析在不同方向上的规避许可
@@ -103,13 +108,13 @@ class Robot(object):
             step_distance: 物理运动距离，1cm=g_step_by_cm步step
         """
         p2r = Config.get_scale_rate()
-        step_distance = float(pixel_distance / p2r * g_one_cm_steps)
+        step_distance = float(pixel_distance / p2r * Config.get_one_cm_steps())
         return int(step_distance)
 
     def __robot_steps_to_pixels(self, robot_steps):
         """将机器人物理运动步进距离转换成像素距离"""
         p2r = Config.get_scale_rate()
-        pixel_distance = int((robot_steps / g_one_cm_steps) * p2r)
+        pixel_distance = int((robot_steps / Config.get_one_cm_steps()) * p2r)
         return pixel_distance
 
     # 获取当前坐标
@@ -117,6 +122,33 @@ class Robot(object):
         """获取机器人当前坐标"""
         return self.robot_current_coordinates.tolist()
 
+    def __put(self, action_commands):
+        """将动作的指令加入指令队列，并分别记录预计的移动和抬笔落笔时间，以及等待队列空位的时间
+        动作的Future记录为last_action_future，之后的动作需要机械臂停止时等待其完成
+        """
+        move_time, pen_time = 0, 0
+        for command in action_commands:
+            if command.startswith('SP'):
+                pen_time += estimate_exec_time(command)
+            else:
+                move_time += estimate_exec_time(command)
+        self.log.record_move_time(move_time / 1000)
+        self.log.record_touch_time(pen_time / 1000)
+        # 等待执行的指令队列有长度限制，队列已满时加入指令会阻塞
+        start_time = time.perf_counter()
+        future = self.cq.put(action_commands)
+        self.log.record_queue_wait_time(time.perf_counter() - start_time)
+        if future is not None:
+            self.last_action_future = future
+
+    def __wait(self, action_name):
+        """需要机械臂停止的动作等待上一个动作的指令执行结束，并记录等待时间"""
+        start_time = time.perf_counter()
+        # 指令队列按顺序执行，上一个动作的最后一条指令结束时之前的指令都已结束
+        if action_name in BLOCK_COMMAND and self.last_action_future is not None:
+            self.last_action_future.result()
+        self.log.record_robot_wait_time(time.perf_counter() - start_time)
+
     # 返回一个完整的动作持续时间
     def get_action_exec_time(self):
         """获取当前动作持续时间"""
@@ -124,7 +156,7 @@ class Robot(object):
 
     # 计算移动时间
     def __calculate_move_time(self, x, y,
-                              motor_speed=Config.get_motor_speed()):
+                              motor_speed=None):
         """计算机械臂移动指定距离电机所需时间
         
         Args:
@@ -138,6 +170,8 @@ class Robot(object):
             max_motor_move: 在相同时间内电机最大的转动量
             move_time: 转动时间
         """
+        if motor_speed is None:
+            motor_speed = Config.get_motor_speed()
         motor_A_rotation = x + y
         motor_B_rotation = x - y
 
@@ -149,7 +183,6 @@ class Robot(object):
     def __estimate_pen_fall_height(self):
         # 获取笔的高度、设备厚度、笔的高度落差和机械臂的最大移动范围
 
-        global g_one_cm_steps
         tip_altitude = Config.get_tip_height()  # 笔尖到屏幕的距离
         pen_high_dead = Config.get_pen_high_dead()  # 机械臂XY两轴的高度落差
         if pen_high_dead[0] == 0 and pen_high_dead[1] == 0:
@@ -175,8 +208,8 @@ class Robot(object):
         # 实际距离与像素坐标的转换
         p2r = Config.get_scale_rate()
         # 将图片中的像素坐标转换称实际移动距离和方向
-        px = int(device_center[0] / p2r * g_one_cm_steps)
-        py = int(device_center[1] / p2r * g_one_cm_steps)
+        px = int(device_center[0] / p2r * Config.get_one_cm_steps())
+        py = int(device_center[1] / p2r * Config.get_one_cm_steps())
         device_center_x, device_center_y = normalize_device_direction(px, py)
 
         # 当前坐标到设备中心在Y轴上的距离
@@ -198,14 +231,16 @@ class Robot(object):
 
     # 计算不同action运动时间
     def __estimate_action_time(self, action_type, x=0, y=0, dx=0, dy=0,
-                               press_time=PRESS_TIME):
+                               press_time=None):
         """ 计算不同的action运动时间
         Args:
             action_type: action类型
             x,y: 本次运动的步进距离
-            dx,dy: action动作执行过程中的运动步进距离，例如swipe中间的滑动
-            press_time=PRESS_TIME: 长按时间
+            dx,dy: action动作执行过程中的运动步进距离
+            press_time: 长按时间，默认为配置文件中配置的时间
         """
+        if press_time is None:
+            press_time = Config.get_press_time()
         pen_fall_height = self.__estimate_pen_fall_height()
         if action_type == 'click':
             """click time"""
@@ -223,29 +258,11 @@ class Robot(object):
             double_click_fall_pen_time = 0.2
             action_wait_time = (fall_pen_time + double_click_fall_pen_time) * 2
 
-        elif action_type == 'swipe':
-            """swipe time"""
-            fall_pen_time = pen_fall_height / 10000
-            move_time = self.__calculate_move_time(x, y, motor_speed=10000)
-            action_wait_time = move_time + fall_pen_time * 2
-
         elif action_type == 'long press':
             """long press time"""
             fall_pen_time = pen_fall_height / 10000
             action_wait_time = fall_pen_time * 2 + press_time
 
-        elif action_type == 'drag':
-            """drag time"""
-            fall_pen_time = pen_fall_height / 10000
-            drag_time = self.__calculate_move_time(x, y, motor_speed=10000)
-            action_wait_time = drag_time + fall_pen_time * 2
-
-        elif action_type == 'press drag':
-            """press drag time"""
-            fall_pen_time = pen_fall_height / 10000
-            drag_time = self.__calculate_move_time(x, y, motor_speed=10000)
-            action_wait_time = drag_time + fall_pen_time * 2 + press_time
-
         elif action_type == 'reset':
             """reset time"""
             reset_time = self.__calculate_move_time(x, y)
@@ -290,7 +307,7 @@ class Robot(object):
             x,y: 机械臂运动的实际横纵坐标
         """
         # 判断是否需要等待上个动作执行完毕
-        self.cq.do_necessary_wait('move')
+        self.__wait('move')
         # 计算当前动作执行总时间
         self.__estimate_action_time('move', x, y)
         move_time = math.ceil(self.__calculate_move_time(x, y) * 1000)
@@ -301,7 +318,136 @@ class Robot(object):
         # 这一句是为了等待机械臂挺稳，避免滑动造成误差
         action_commands.append('XM,{},0,0\r'.format(100))
         # 将指令集合加入到指令队列中
-        self.cq.put(action_commands)
+        self.__put(action_commands)
+
+    def __plan_move(self, x, y, settle_time=PATH_SETTLE_TIME,
+                    motor_speed=None, ramp=True):
+        """规划机械臂移动相对距离的指令
+        EBB的XM指令匀速运动，较长的移动拆分为减速起步、匀速、减速停止三段，
+        停止时晃动较小，之后只需要较短的稳定时间
+
+        Args:
+            x,y: 机械臂运动的相对步进距离
+            settle_time: 移动结束后的稳定时间(ms)
+            motor_speed: 电机速度
+            ramp: 是否在起止阶段减速，连续拖拽经过路径点时不减速
+        Returns:
+            commands: 机器指令列表
+            duration: 预计运行时间(秒)
+        """
+        if motor_speed is None:
+            motor_speed = Config.get_motor_speed()
+        if ramp and max(abs(x + y), abs(x - y)) > RAMP_DISTANCE:
+            segments = [(RAMP_RATE, motor_speed * RAMP_SPEED_RATE),
+                        (1 - 2 * RAMP_RATE, motor_speed),
+                        (RAMP_RATE, motor_speed * RAMP_SPEED_RATE)]
+        else:
+            segments = [(1, motor_speed)]
+        commands = []
+        duration = 0
+        moved_x, moved_y = 0, 0
+        for i, (rate, speed) in enumerate(segments):
+            if i == len(segments) - 1:
+                # 最后一段补齐取整的误差
+                sx, sy = int(x) - moved_x, int(y) - moved_y
+            else:
+                sx, sy = int(x * rate), int(y * rate)
+            moved_x += sx
+            moved_y += sy
+            move_time = math.ceil(self.__calculate_move_time(sx, sy, motor_speed=speed) * 1000)
+            if move_time > 0:
+                commands.append('XM,{},{},{}\r'.format(move_time, sx, sy))
+                duration += move_time / 1000
+        if settle_time > 0:
+            commands.append('XM,{},0,0\r'.format(settle_time))
+            duration += settle_time / 1000
+        return commands, duration
+
+    def __move_to_pixel(self, x, y):
+        """记录机械臂移动到像素坐标后的坐标，返回移动的相对步进距离"""
+        target = normalize_device_direction(self.__robot_step(x), self.__robot_step(y))
+        relative_x, relative_y = target - self.robot_current_coordinates
+        self.__record_cur_position(target)
+        return relative_x, relative_y
+
+    def click_path(self, pixel_points):
+        """按顺序连续点击多个目标，例如键盘按键
+        一次生成全部移动和点击指令，点击之间不等待机械臂停止
+
+        Args:
+            pixel_points: [(x, y), ...], 点击目标像素坐标序列
+        Returns:
+            预计运行时间(秒)
+        """
+        if self.virtual_debug:
+            for x, y in pixel_points:
+                self.__move_to_pixel(x, y)
+            return 0
+
+        self.__wait('click')
+        action_commands = []
+        duration = 0
+        for x, y in pixel_points:
+            relative_x, relative_y = self.__move_to_pixel(x, y)
+            move_commands, move_time = self.__plan_move(relative_x, relative_y)
+            # 落笔高度与机械臂当前位置有关
+            pen_fall_height = self.__estimate_pen_fall_height()
+            pen_fall_time = math.ceil(abs(pen_fall_height / 10))
+            action_commands += move_commands
+            action_commands += ['SC,5,{}\r'.format(Config.get_tip_initial_height() + pen_fall_height),
+                                'SP,0,{}\r'.format(pen_fall_time),
+                                'SC,4,{}\r'.format(Config.get_tip_initial_height()),
+                                'SP,1,{}\r'.format(pen_fall_time + PATH_SETTLE_TIME)]
+            duration += move_time + (pen_fall_time * 2 + PATH_SETTLE_TIME) / 1000
+        if action_commands:
+            # 加此部分是为了等待笔的完全抬高，否则容易出现抬笔过程中对其他控件产生拖拽现象
+            action_commands.append('XM,{},0,0\r'.format(100))
+            duration += 0.1
+            self.__put(action_commands)
+        self.action_duration = duration
+        return duration
+
+    def drag_path(self, pixel_points, press_time=0):
+        """沿多个路径点连续拖拽，drag、press_drag和swipe都使用该方法
+        移动到第一个点后落笔，依次经过其余各点，最后抬笔
+
+        Args:
+            pixel_points: [(x, y), ...], 拖拽路径像素坐标序列
+            press_time: 落笔后开始拖拽前的长按时间(秒)
+        Returns:
+            预计运行时间(秒)
+        """
+        if self.virtual_debug or not pixel_points:
+            for x, y in pixel_points:
+                self.__move_to_pixel(x, y)
+            return 0
+
+        self.__wait('drag')
+        action_commands, duration = self.__plan_move(*self.__move_to_pixel(*pixel_points[0]))
+        pen_fall_height = self.__estimate_pen_fall_height()
+        pen_fall_time = math.ceil(abs(pen_fall_height / 10))
+        action_commands += ['SC,5,{}\r'.format(Config.get_tip_initial_height() + pen_fall_height),
+                            'SP,0,{}\r'.format(pen_fall_time),
+                            # 等待笔的完全落笔
+                            'XM,{},0,0\r'.format(50)]
+        if press_time > 0:
+            action_commands.append('XM,{},0,0\r'.format(math.ceil(press_time * 1000)))
+            duration += press_time
+        # 拖拽运动速度为10000步进/s，经过路径点时不停顿
+        for x, y in pixel_points[1:]:
+            relative_x, relative_y = self.__move_to_pixel(x, y)
+            move_commands, move_time = self.__plan_move(relative_x, relative_y, settle_time=0,
+                                                        motor_speed=10000, ramp=False)
+            action_commands += move_commands
+            duration += move_time
+        action_commands += ['XM,{},0,0\r'.format(50),
+                            'SC,4,{}\r'.format(Config.get_tip_initial_height()),
+                            'SP,1,{}\r'.format(pen_fall_time + 50),
+                            'XM,{},0,0\r'.format(100)]
+        duration += (pen_fall_time * 2 + 200) / 1000
+        self.action_duration = duration
+        self.__put(action_commands)
+        return duration
 
     # 控制机械臂移动相对距离
     def move(self, lx, ly):
@@ -309,8 +455,7 @@ class Robot(object):
         Args:
             lx, ly: 机械臂移动的相对距离，单位厘米(cm)
         """
-        global g_one_cm_steps
-        move_distance = np.array([int(lx * g_one_cm_steps), int(ly * g_one_cm_steps)])
+        move_distance = np.array([int(lx * Config.get_one_cm_steps()), int(ly * Config.get_one_cm_steps())])
         # 计算机器人坐标系内移动的目标坐标
         target_x, target_y = self.robot_current_coordinates + move_distance
         #        print(target_x,target_y)
@@ -326,109 +471,19 @@ class Robot(object):
             x1,y1: 拖拽运动起点像素坐标
             x2,y2: 拖拽运动终点像素坐标
         """
-        px1 = self.__robot_step(x1)
-        py1 = self.__robot_step(y1)
-        px2 = self.__robot_step(x2)
-        py2 = self.__robot_step(y2)
-
-        # 计算运动起点到终点的步进运动距离
-        dx, dy = normalize_device_direction(px2 - px1, py2 - py1)
-        origin_coordinate = normalize_device_direction(px1, py1)
-
-        relative_x, relative_y = origin_coordinate - self.robot_current_coordinates
-
-        # 记录当前机械臂的坐标
-        current_x, current_y = normalize_device_direction(px2, py2)
-        self.__record_cur_position(current_x, current_y)
-
-        # 计算机械臂与第一个目标之间的相对位置
-        if self.virtual_debug:
-            return
-
-        # 先控制机械臂移动到指定位置
-        self.__control_robot_move(relative_x, relative_y)
-
-        # 执行拖拽动作
-
-        self.cq.do_necessary_wait('drag')
-        # 等待上个动作执行完毕
-        self.__estimate_action_time('drag', dx, dy)
-        # 拖拽，
-        # 参数： 坐标、拖拽时间、落笔时间
-        # 拖拽运动速度为10000步进/s
-        drag_move_time = math.ceil(
-            self.__calculate_move_time(dx, dy, motor_speed=10000) * 1000)
-        pen_fall_height = self.__estimate_pen_fall_height()
-        pen_fall_time = int(abs(pen_fall_height / 10))
-
-        action_commands = []
-        action_commands.append('SC,5,{}\r'.format(pen_initial_height + pen_fall_height))
-        action_commands.append('SP,0,{}\r'.format(pen_fall_time))
-        # 加此部分是为了等待笔的完全落笔，否则会导致在滑动开始时触屏笔没有完全落下的现象
-        action_commands.append('XM,{},0,0\r'.format(50))
-        action_commands.append('XM,{},{},{},\r'.format(
-            drag_move_time, int(dx), int(dy)))
-        action_commands.append('XM,{},0,0\r'.format(50))
-        action_commands.append('SC,4,{}\r'.format(pen_initial_height))
-        action_commands.append('SP,1,{}\r'.format(pen_fall_time + 50))
-        # 将指令集合加入到指令队列中
-        self.cq.put(action_commands)
+        self.drag_path([(x1, y1), (x2, y2)])
 
     # 长按后拖拽，参数：拖拽起点坐标、终点坐标、长按时间
-    def press_drag(self, x1, y1, x2, y2, press_time=PRESS_TIME):
+    def press_drag(self, x1, y1, x2, y2, press_time=None):
         """
         Args:
             x1,y1: 拖拽运动起点像素坐标
             x2,y2: 拖拽运动终点像素坐标
+            press_time: 长按时间(秒)，默认为配置的长按时间
         """
-        px1 = self.__robot_step(x1)
-        py1 = self.__robot_step(y1)
-        px2 = self.__robot_step(x2)
-        py2 = self.__robot_step(y2)
-
-        dx, dy = normalize_device_direction(px2 - px1, py2 - py1)  # 两个目标之间的相对距离
-        # 机器人坐标系中的移动距离
-        origin_coordinate = normalize_device_direction(px1, py1)
-        # 计算机械臂与第一个目标之间的相对位置
-        relative_x, relative_y = origin_coordinate - self.robot_current_coordinates
-
-        # 计算并记录运动完后的机械臂坐标    
-        current_x, current_y = normalize_device_direction(px2, py2)
-        self.__record_cur_position(current_x, current_y)
-        if self.virtual_debug:
-            return
-
-        # 先控制机械臂移动到指定位置
-        self.__control_robot_move(relative_x, relative_y)
-
-        self.cq.do_necessary_wait('press drag')
-        # 等待上个动作执行完毕
-        self.__estimate_action_time('press drag', dx, dy)
-        # 长按后拖拽，
-        # 参数： 坐标、拖拽时间、长按时间、落笔时间
-        # 机器人长按时间1s=1000数值
-        # 拖拽运动速度为10000步进/s
-        press_time = math.ceil(press_time * 1000)
-        drag_move_time = math.ceil(
-            self.__calculate_move_time(dx, dy, motor_speed=10000) * 1000)
-        pen_fall_height = self.__estimate_pen_fall_height()
-        pen_fall_time = math.ceil(abs(pen_fall_height / 10))
-
-        action_commands = []
-        action_commands.append('SC,5,{}\r'.format(pen_initial_height + pen_fall_height))
-        action_commands.append('SP,0,{}\r'.format(pen_fall_time))
-        # 加此部分是为了等待笔的完全落笔，否则会导致在滑动开始时触屏笔没有完全落下的现象
-        action_commands.append('XM,{},0,0\r'.format(pen_fall_time))
-        action_commands.append('XM,{},0,0\r'.format(press_time))
-        action_commands.append('XM,{},{},{}\r'.format(drag_move_time,
-                                                      int(dx), int(dy)))
-        action_commands.append('XM,{},0,0\r'.format(50))
-        action_commands.append('SC,4,{}\r'.format(pen_initial_height))
-        action_commands.append('SP,1,{}\r'.format(pen_fall_time))
-        # 加此部分是为了等待笔的完全抬高，否则容易出现抬笔过程中对其他控件产生拖拽现象
-        action_commands.append('XM,{},0,0\r'.format(100))
-        # 将指令集合加入到指令队列中
-        self.cq.put(action_commands)
+        if press_time is None:
+            press_time = Config.get_press_time()
+        self.drag_path([(x1, y1), (x2, y2)], press_time)
 
     @classmethod
     def snap_screen(self):
@@ -444,12 +499,21 @@ class Robot(object):
         self.temp_image_index += 1
         return self.temp_image_index
 
-    def get_detour_frame_path(self):
+    def get_detour_frame(self):
         """获取规避运动中的视频帧"""
         # TODO 加一个对规避运动过程的判断
-        self.cq.do_necessary_wait('detour')
-        self.sut.record_detour_frame()
-        return TestScript.get_detour_image_path()
+        self.__wait('detour')
+        frame = self.sut.record_detour_frame()
+        return screenshot.ScreenFrame(frame, 0, TestScript.get_detour_image_path())
+
+    def peek_frame(self, command='match'):
+        """获取下一视频帧，不增加图像编号也不保存图像，用于检测屏幕变化（实际运行）"""
+        self.__wait(command)
+        return self.sut.get_frame()
+
+    def get_screen_frame(self):
+        """获取最近一次拍摄的屏幕图像帧，虚拟调试时为空"""
+        return self.screen_frame
 
     def get_photo_index(self, command, save_frame=False):
         """记录拍照时间和编号，接收操作过程中的图像编号（实际运行）
@@ -465,155 +529,74 @@ class Robot(object):
 
         if save_frame:  # 规避运动保存视频帧
             return self.temp_image_index
-        self.cq.do_necessary_wait(command)
+        self.__wait(command)
         self.log.record_TP_start()
-        self.sut.take_photo(self.temp_image_index)
+        frame = self.sut.take_photo(self.temp_image_index)
+        self.screen_frame = screenshot.ScreenFrame(
+            frame, self.temp_image_index,
+            TestScript.get_screenshot_image_path(self.temp_image_index))
         # 记录拍照时间
         self.log.record_TP_result(self.temp_image_index)
         return self.temp_image_index
 
-    # 滑动操作起始位置相对距离
+    # 滑动操作起始位置
     def __swipe_origin(self, region_contour, region_size, dx, dy):
-        """ 屏幕中心点到swipe起点的距离
+        """ swipe起点在设备屏幕中的像素坐标
         
         Args:
             region_contour: 滑动区域在屏幕中的像素轮廓[x,y,x+w,y+h]
             region_size: 区域分辨率[w,h]
             dx,dy: int,滑动起点据屏幕中心的长度
         Return:
-            px, py: 机械臂预计滑动的实际滑动距离
+            origin_x, origin_y: 滑动起点相对设备屏幕左上角的像素坐标
         """
 
         # 设备屏幕在图像中的轮廓[x,y,x+w,y+h]
         screen_contour = contour.get_region_contour()
-        # 设备屏幕区域中心点在机器人运动坐标系中的坐标
+        # 设备屏幕区域中心点的像素坐标
         # 计算公式：区域像素坐标 + 半个区域分辨率 - 屏幕左上角在图像中的像素坐标
         region_center = [region_contour[i] + region_size[i] / 2 - screen_contour[i] for i in range(2)]
         # 计算滑动起点坐标
         origin_x = region_center[0] - dx * 1 / 3
         origin_y = region_center[1] - dy * 1 / 3
-        px = self.__robot_step(origin_x)
-        py = self.__robot_step(origin_y)
-        return px, py
+        return origin_x, origin_y
 
     def swipe(self, region, direction):
         """
         Args:
             region: 滑动区域
             direction: 滑动方向
+        Returns:
+            滑动起点像素坐标和滑动像素距离(x, y, dx, dy)
         """
         # 获取滑动区域轮廓
         region_contour = contour.get_region_contour(region)
         region_size = contour.get_contour_size(region)
-        swipe_x, swipe_y = 0, 0  # 滑动横纵坐标长度
-
         swipe_dc = 2 / 3  # 滑动距离系数，全称Swipe distance coefficient
 
         # 滑动计算步骤：
-        # 1、控制机械臂运动到滑动起点:
-        #   首先获取滑动起点实际坐标px,py
-        #   其次将起点像素坐标转换成机械臂运动实际坐标swipe_start_coor
-        #   最后计算机械臂运动到滑动起点的相对运动距离relative_origin_x,relative_origin_y
-        # 2、确定滑动方向和距离
-        #   首先根据滑动方向计算在该方向上的机械臂滑动像素长度dx,dy
-        #   其次将像素长度转换为机械臂运动距离swipe_x,swipe_y
-        #   最后再根据起点坐标(px, py)和滑动距离(swipe_x,swipe_y)
-        #   记录运动后的终点坐标(swipe_end_x, swipe_end_y)
-
+        # 1、根据滑动方向计算滑动起点的像素坐标(origin_x, origin_y)
+        # 2、计算该方向上的滑动像素距离(dx, dy)
+        # 3、从起点到终点拖拽，机械臂的移动、落笔和抬笔由drag_path完成
+        dx, dy = 0, 0
         if direction == 'up':  # 向上滑动
-            # 计算滑动操作起点坐标
-            px, py = self.__swipe_origin(region_contour, region_size, 0, -region_size[1])
-            swipe_start_coor = normalize_device_direction(px, py)  # 将图像坐标系转换成机械臂坐标系
-
-            # 计算当前位置到滑动起点的相对距离
-            relative_origin_x, relative_origin_y = swipe_start_coor - self.robot_current_coordinates
-            # 计算在y轴方向滑动距离,并转换成实际移动距离(半个操作空间长度)
-            dy = region_size[1] * swipe_dc  # 在y轴方向滑动距离
-            swipe_y = -self.__robot_step(dy)
-
+            origin_x, origin_y = self.__swipe_origin(region_contour, region_size, 0, -region_size[1])
+            dy = -region_size[1] * swipe_dc
         elif direction == 'down':  # 向下滑动
-            # 计算滑动操作起点坐标
-            px, py = self.__swipe_origin(region_contour, region_size, 0, region_size[1])
-            swipe_start_coor = normalize_device_direction(px, py)  # 将图像坐标系转换成机械臂坐标系
-
-            # 计算当前位置到滑动起点的相对距离
-            relative_origin_x, relative_origin_y = swipe_start_coor - self.robot_current_coordinates
-            # 计算在y轴方向滑动距离,并转换成实际移动距离(半个操作空间长度)
+            origin_x, origin_y = self.__swipe_origin(region_contour, region_size, 0, region_size[1])
             dy = region_size[1] * swipe_dc
-            swipe_y = self.__robot_step(dy)
-
         elif direction == 'left':  # 向左滑动
-            # 计算滑动操作起点坐标
-            px, py = self.__swipe_origin(region_contour, region_size, -region_size[0], 0)
-            swipe_start_coor = normalize_device_direction(px, py)  # 将图像坐标系转换成机械臂坐标系
-
-            # 计算当前位置到滑动起点的相对距离
-            relative_origin_x, relative_origin_y = swipe_start_coor - self.robot_current_coordinates
-            # 计算在x轴方向滑动距离,并转换成实际移动距离(半个操作空间长度)
-            dx = region_size[0] * swipe_dc
-            swipe_x = -self.__robot_step(dx)
-
+            origin_x, origin_y = self.__swipe_origin(region_contour, region_size, -region_size[0], 0)
+            dx = -region_size[0] * swipe_dc
         elif direction == 'right':  # 向右滑动
-            # 计算滑动操作起点坐标
-            px, py = self.__swipe_origin(region_contour, region_size, region_size[0], 0)
-            swipe_start_coor = normalize_device_direction(px, py)  # 将图像坐标系转换成机械臂坐标系
-
-            # 计算当前位置到滑动起点的相对距离
-            relative_origin_x, relative_origin_y = swipe_start_coor - self.robot_current_coordinates
-            # 计算在x轴方向滑动距离,并转换成实际移动距离(半个操作空间长度)
+            origin_x, origin_y = self.__swipe_origin(region_contour, region_size, region_size[0], 0)
             dx = region_size[0] * swipe_dc
-            swipe_x = self.__robot_step(dx)
-
         else:
             self.release()
             raise Exception('No Right Direction')
 
-            # 将滑动相对距离转换成机械臂移动的实际位移
-        robot_swipe_x, robot_swipe_y = normalize_device_direction(swipe_x, swipe_y)
-        # 计算滑动操作终点坐标
-        swipe_end_x = swipe_start_coor[0] + int(robot_swipe_x)
-        swipe_end_y = swipe_start_coor[1] + int(robot_swipe_y)
-
-        self.__record_cur_position(swipe_end_x, swipe_end_y)  # 记录移动后的机器人坐标
-
-        swipe_start_pixel_x = self.__robot_steps_to_pixels(px)
-        swipe_start_pixel_y = self.__robot_steps_to_pixels(py)
-        swipe_pixel_dx = self.__robot_steps_to_pixels(swipe_x)
-        swipe_pixel_dy = self.__robot_steps_to_pixels(swipe_y)
-        if self.virtual_debug:
-            return swipe_start_pixel_x, swipe_start_pixel_y, swipe_pixel_dx, swipe_pixel_dy
-
-            # 先控制机械臂移动到指定起点位置
-        self.__control_robot_move(relative_origin_x, relative_origin_y)
-
-        self.cq.do_necessary_wait('swipe')
-        # 等待上个动作执行完毕
-        # 移动到滑动起始位置
-        self.__estimate_action_time('swipe', robot_swipe_x, robot_swipe_y)
-        # 计算滑动移动时间
-        # 长按后拖拽，
-        # 参数： 坐标、滑动时间、落笔时间
-        swipe_move_time = math.ceil(
-            self.__calculate_move_time(
-                robot_swipe_x, robot_swipe_y, motor_speed=10000) * 1000)
-        pen_fall_height = self.__estimate_pen_fall_height()
-        pen_fall_time = math.ceil(abs(pen_fall_height / 10))
-        # 生成机器执行指令集合
-        action_commands = []
-        action_commands.append('SC,5,{}\r'.format(pen_initial_height + pen_fall_height))
-        action_commands.append('SP,0,{}\r'.format(pen_fall_time))
-        # 加此部分是为了等待笔的完全落笔，否则会导致在滑动开始时触屏笔没有完全落下的现象
-        action_commands.append('XM,{},0,0\r'.format(100))
-        action_commands.append('XM,{},{},{}\r'.format(swipe_move_time,
-                                                      int(robot_swipe_x), int(robot_swipe_y)))
-        action_commands.append('SC,4,{}\r'.format(pen_initial_height))
-        action_commands.append('SP,1,{}\r'.format(pen_fall_time + 50))
-        # 加此部分是为了等待笔的完全抬高，否则容易出现抬笔过程中对其他控件产生拖拽现象
-        action_commands.append('XM,{},0,0\r'.format(100))
-        # 将指令集合加入到指令队列中
-        self.cq.put(action_commands)
-
-        return swipe_start_pixel_x, swipe_start_pixel_y, swipe_pixel_dx, swipe_pixel_dy
+        self.drag_path([(origin_x, origin_y), (origin_x + dx, origin_y + dy)])
+        return int(origin_x), int(origin_y), int(dx), int(dy)
 
     def click(self, x, y):
         """点击目标坐标
@@ -635,7 +618,7 @@ class Robot(object):
         # 移动到动作起始位置
         self.__control_robot_move(relative_x, relative_y)
 
-        self.cq.do_necessary_wait('click')
+        self.__wait('click')
         # 判断等待上个动作执行完毕
         self.__estimate_action_time('click')
         # 计算落笔时间
@@ -644,21 +627,23 @@ class Robot(object):
         pen_fall_height = self.__estimate_pen_fall_height()
         pen_fall_time = math.ceil(abs(pen_fall_height / 10))
         #        print('pen_fall_height:', pen_fall_height)
-        action_commands = ['SC,5,{}\r'.format(pen_initial_height + pen_fall_height),
+        action_commands = ['SC,5,{}\r'.format(Config.get_tip_initial_height() + pen_fall_height),
                            'SP,0,{}\r'.format(pen_fall_time),
-                           'SC,4,{}\r'.format(pen_initial_height),
+                           'SC,4,{}\r'.format(Config.get_tip_initial_height()),
                            'SP,1,{}\r'.format(pen_fall_time + 50),
                            # 加此部分是为了等待笔的完全抬高，否则容易出现抬笔过程中对其他控件产生拖拽现象
                            'XM,{},0,0\r'.format(100)]
         # 将指令集合加入到指令队列中
-        self.cq.put(action_commands)
+        self.__put(action_commands)
 
-    def double_click(self, x, y, double_fall_time=DOUBLE_CLICK_TIME):
+    def double_click(self, x, y, double_fall_time=None):
         """点击目标坐标
         Args:
             x,y: 双击目标点像素坐标
             double_fall_time: 双击间隔时间
         """
+        if double_fall_time is None:
+            double_fall_time = Config.get_double_click_time()
         px = self.__robot_step(x)
         py = self.__robot_step(y)
         robot_move_coor = normalize_device_direction(px, py)  # 像素转换成实际距离
@@ -673,7 +658,7 @@ class Robot(object):
         # 控制机械臂移动到双击位置
         self.__control_robot_move(relative_x, relative_y)
 
-        self.cq.do_necessary_wait('double click')
+        self.__wait('double click')
         # 判断等待上个动作执行完毕
         self.__estimate_action_time('double click')
         # 计算落笔时间
@@ -685,25 +670,27 @@ class Robot(object):
 
         hover_distance = 1000
         # 转化成对应的机器指令
-        action_commands = ['SC,5,{}\r'.format(pen_initial_height + pen_fall_height + hover_distance),
+        action_commands = ['SC,5,{}\r'.format(Config.get_tip_initial_height() + pen_fall_height + hover_distance),
                            'SP,0,{}\r'.format(pen_fall_time),
-                           'SC,5,{}\r'.format(pen_initial_height + pen_fall_height),
+                           'SC,5,{}\r'.format(Config.get_tip_initial_height() + pen_fall_height),
                            'SP,0,{}\r'.format(hover_distance // 10),
                            'SP,1,{}\r'.format(double_click_interval),
                            'SP,0,{}\r'.format(double_click_interval + 20),
-                           'SC,4,{}\r'.format(pen_initial_height),
+                           'SC,4,{}\r'.format(Config.get_tip_initial_height()),
                            'SP,1,{}\r'.format(pen_fall_time + 50),
                            # 加此部分是为了等待笔的完全抬高，否则容易出现抬笔过程中对其他控件产生拖拽现象
                            'XM,{},0,0\r'.format(100)]
         # 将指令集合加入到指令队列中
-        self.cq.put(action_commands)
+        self.__put(action_commands)
 
-    def long_press(self, x, y, press_time=PRESS_TIME):
+    def long_press(self, x, y, press_time=None):
         """在目标坐标处控制点击器长按
         Args:
             x,y: 长按目标点像素坐标
             press_time:长按时间，默认为配置文件中配置的时间
         """
+        if press_time is None:
+            press_time = Config.get_press_time()
         px = self.__robot_step(x)
         py = self.__robot_step(y)
 
@@ -721,7 +708,7 @@ class Robot(object):
         self.__control_robot_move(relative_x, relative_y)
 
         # 长按控制
-        self.cq.do_necessary_wait('long press')
+        self.__wait('long press')
         # 判断等待上个动作执行完毕
         self.__estimate_action_time('long press')
         # 计算落笔时间
@@ -732,15 +719,15 @@ class Robot(object):
         press_time = math.ceil(press_time * 1000)
 
         # 转化成对应的机器指令
-        action_commands = ['SC,5,{}\r'.format(pen_initial_height + pen_fall_height),
+        action_commands = ['SC,5,{}\r'.format(Config.get_tip_initial_height() + pen_fall_height),
                            'SP,0,{}\r'.format(pen_fall_time),
                            'XM,{},0,0\r'.format(press_time),
-                           'SC,4,{}\r'.format(pen_initial_height),
+                           'SC,4,{}\r'.format(Config.get_tip_initial_height()),
                            'SP,1,{}\r'.format(pen_fall_time + 50),
                            # 加此部分是为了等待笔的完全抬高，否则容易出现抬笔过程中对其他控件产生拖拽现象
                            'XM,{},0,0\r'.format(100)]
         # 将指令集合加入到指令队列中
-        self.cq.put(action_commands)
+        self.__put(action_commands)
 
     # 将机械臂移出屏幕坐标系
     # 计算当前机械臂位置，以及该往哪个角落移动
@@ -787,7 +774,7 @@ class Robot(object):
         # 移动到规避预计位置
         self.__control_robot_move(relative_x, relative_y)
         # 等待规避结束
-        self.cq.do_necessary_wait('detour')
+        self.__wait('detour')
 
     def step_detour_outside_of_screen(self):
         """分步规避函数"""
@@ -814,15 +801,15 @@ class Robot(object):
         # 分步规避动作每次执行的长度
         detour_step_move_distance = 0
         # 检测规避动作长度是否低于分步规避的最低值
-        # 分步规避移动范围低于DETOUR_STEP_THRESHOLD则执行整个规避动作
+        # 分步规避移动范围低于分步规避阈值则执行整个规避动作
 
         if self.x_evadable ^ self.y_evadable:
             if self.x_evadable:
                 # x方向可规避，y方向不可规避
                 # 如果在X方向上规避距离高于阈值，则将其拆分成分步规避
                 # 否则按照整体规避进行规避运动
-                if abs(relative_x) > DETOUR_STEP_THRESHOLD:
-                    detour_step_move_distance = DETOUR_STEP_DISTANCE
+                if abs(relative_x) > Config.get_detour_step_threshold():
+                    detour_step_move_distance = Config.get_detour_step_distance()
 
                 if relative_x < 0:
                     relative_x += detour_step_move_distance
@@ -835,8 +822,8 @@ class Robot(object):
                 # x方向不可规避，y方向可规避
                 # 如果在Y方向上规避距离高于阈值，则将其拆分成分步规避
                 # 否则按照整体规避进行规避运动
-                if abs(relative_y) > DETOUR_STEP_THRESHOLD:
-                    detour_step_move_distance = DETOUR_STEP_DISTANCE
+                if abs(relative_y) > Config.get_detour_step_threshold():
+                    detour_step_move_distance = Config.get_detour_step_distance()
                 # X轴上无运动
                 relative_x = 0
                 if relative_y < 0:
@@ -847,8 +834,8 @@ class Robot(object):
         elif self.x_evadable & self.y_evadable:
             # 判断最短方向上的规避距离是否高于阈值，
             # 高，则拆分成分步规避，否则，一次规避
-            if min(abs(relative_x), abs(relative_y)) > DETOUR_STEP_THRESHOLD:
-                detour_step_move_distance = DETOUR_STEP_DISTANCE
+            if min(abs(relative_x), abs(relative_y)) > Config.get_detour_step_threshold():
+                detour_step_move_distance = Config.get_detour_step_distance()
 
             # 在据边界最近的方向上执行规避动作
             if abs(relative_x) < abs(relative_y):
@@ -934,7 +921,7 @@ class Robot(object):
             return
 
         # 落笔控制
-        self.cq.do_necessary_wait('pen down')
+        self.__wait('pen down')
         # 判断等待上个动作执行完毕
         self.__estimate_action_time('pen down')
         # 计算落笔时间
@@ -942,17 +929,17 @@ class Robot(object):
         pen_fall_height = self.__estimate_pen_fall_height()
         pen_fall_time = math.ceil(abs(pen_fall_height / 10))
         # 转化成对应的机器指令
-        action_commands = ['SC,5,{}\r'.format(pen_initial_height + pen_fall_height),
+        action_commands = ['SC,5,{}\r'.format(Config.get_tip_initial_height() + pen_fall_height),
                            'SP,0,{}\r'.format(pen_fall_time)]
         # 将指令集合加入到指令队列中
-        self.cq.put(action_commands)
+        self.__put(action_commands)
 
     def pen_up(self):
         """控制舵机抬笔"""
         if self.virtual_debug:
             return
         # 抬笔控制
-        self.cq.do_necessary_wait('pen up')
+        self.__wait('pen up')
         # 判断等待上个动作执行完毕
         self.__estimate_action_time('pen up')
         # 计算落笔时间
@@ -960,12 +947,12 @@ class Robot(object):
         pen_fall_height = self.__estimate_pen_fall_height()
         pen_fall_time = math.ceil(abs(pen_fall_height / 10))
         # 转化成对应的机器指令
-        action_commands = ['SC,4,{}\r'.format(pen_initial_height),
+        action_commands = ['SC,4,{}\r'.format(Config.get_tip_initial_height()),
                            'SP,1,{}\r'.format(pen_fall_time),
                            # 加此部分是为了等待笔的完全抬高，否则容易出现抬笔过程中对其他控件产生拖拽现象
                            'XM,{},0,0\r'.format(pen_fall_time)]
         # 将指令集合加入到指令队列中
-        self.cq.put(action_commands)
+        self.__put(action_commands)
 
     def detour_from_origin(self):
         """将机械臂往设备屏幕外移动指定距离，以防止阻碍图像拍摄"""
@@ -985,7 +972,7 @@ class Robot(object):
         action_commands = ['XM,{},{},{}\r'.format(
             detour_move_time, x, y)]
         # 将指令集合加入到指令队列中
-        self.cq.put(action_commands)
+        self.__put(action_commands)
 
     def is_need_reset(self):
         if self.robot_current_coordinates[0] == 0 and self.robot_current_coordinates[1] == 0:
@@ -1003,9 +990,9 @@ class Robot(object):
             return
 
         # 判断是否需要等待上个动作执行完毕
-        self.cq.do_necessary_wait('reset')
+        self.__wait('reset')
 
-        if self.cq.get_ebb_version() >= "2.6.2":
+        if self.cq.get_ebb_capabilities().supports_home:
             # HM指令，机器人运动回初始起点位置, 只在2.6.2以上版本存在
             # 参数：StepFrequency，步进频率，表示运动过程中的速度   
             action_commands = ['HM,{}\r'.format(Config.get_motor_speed())]
@@ -1022,12 +1009,18 @@ class Robot(object):
                 reset_move_time, x, y)]
 
         # 指令加入到脚本指令队列中
-        self.cq.put(action_commands)
+        self.__put(action_commands)
+
+    def get_video_stats(self):
+        """获取视频录制写入和丢弃的视频帧数"""
+        if self.virtual_debug:
+            return 0, 0
+        return self.sut.get_video_stats()
 
     # 释放当前接口
     def release(self):
         """释放机器人当前接口，即为结束当前测试活动"""
-        self.cq.do_necessary_wait('release')
+        self.__wait('release')
         # 等待上次动作执行结束
         # 关闭视频监控
         self.sut.close()
@@ -4,10 +4,12 @@ Serial communication with the robot
 @author: szy
 """
 
+import re
 import time
 import serial
 import serial.tools.list_ports
 from config import Config 
+from serial_channel import SerialChannel
 
 BAUDRATE = 9600 # 波特率
 BYTESIZE = 8#字节大小
@@ -15,26 +17,107 @@ PARITY = 'N'#校验位
 STOPBITS = 1#停止位
 TIMEOUT = 0.5#读超时设置
 
+EBB_VERSION_PATTERN = re.compile(r"Version (\d+(?:\.\d+)*)")
+
+
+class EbbCapabilities(object):
+    """EBB固件版本及其支持的功能，连接机器人时查询一次
+    
+    QM返回值: QM,CommandStatus,Motor1Status,Motor2Status,FIFOStatus
+        CommandStatus 若当前在执行任何运动命令，则为非0
+        Motor1Status 若当前电机1在执行运动，则为非0
+        Motor2Status 若当前电机2在执行运动，则为非0
+        FIFOStatus 如果FIFO不为空，则FIFOStatus为非0(仅在2.4.4以上版本中存在)
+    
+    Attributes:
+        version: string, 固件版本号，未能查询到时为空
+        supports_motor_query: 是否支持QM指令查询电机状态(2.2.6以上版本)
+        supports_fifo_status: QM指令是否返回FIFO缓冲区状态(2.4.4以上版本)
+        supports_home: 是否支持HM指令回到初始位置(2.6.2以上版本)
+    """
+    
+    def __init__(self, version=''):
+        self.version = version
+        version_info = tuple(int(v) for v in version.split('.')) if version else ()
+        self.supports_motor_query = version_info >= (2, 2, 6)
+        self.supports_fifo_status = version_info >= (2, 4, 4)
+        self.supports_home = version_info >= (2, 6, 2)
+        # 根据版本预先编译电机状态的解析表达式
+        if self.supports_fifo_status:
+            self.__fifo_blocked = re.compile(r"QM,([0-1]),([0-1]),([0-1]),1")
+            self.__robot_idle = re.compile(r"QM,0,0,0,0")
+        else:
+            self.__fifo_blocked = re.compile(r"QM,1,([0-1]),([0-1])")
+            self.__robot_idle = re.compile(r"QM,0,0,0")
+    
+    @staticmethod
+    def parse(version_answer):
+        """从V指令的返回值中解析固件版本"""
+        version = EBB_VERSION_PATTERN.search(str(version_answer))
+        return EbbCapabilities(version.group(1) if version else '')
+    
+    def is_fifo_blocked(self, motor_state):
+        """根据QM指令的返回值判断机器缓冲区是否不能接收新的指令"""
+        if not self.supports_motor_query:
+            # 再老的版本不支持此指令
+            return True
+        if motor_state == '':
+            return True
+        return self.__fifo_blocked.search(motor_state) is not None
+    
+    def is_robot_idle(self, motor_state):
+        """根据QM指令的返回值判断机器指令是否全部执行结束"""
+        if motor_state == '':
+            return True
+        return self.__robot_idle.search(motor_state) is not None
+    
+    def get_message(self):
+        """获取固件版本及功能信息，用于记录日志"""
+        return ("EBB version: {}, motor query: {}, FIFO status: {}, home: {}"
+                .format(self.version or 'unknown', self.supports_motor_query,
+                        self.supports_fifo_status, self.supports_home))
+
+
 class RobotCommunicate(object):
+    """机器人串口通信
     
-    def __init__(self, pen_fall_hight=5):
-        if Config.get_virtual_debug_model():
+    Attributes:
+        robot_port: 串口编号
+        ser: 串口
+        channel: SerialChannel, 按行读取指令返回值
+        capabilities: EbbCapabilities, 连接时查询的固件版本及支持的功能
+    """
+    
+    def __init__(self, pen_fall_hight=5, ser=None):
+        """
+        Args:
+            ser: 已打开的串口，例如serial_channel.FakeEbbSerial，为None时自动连接机器人
+        """
+        if ser is not None:
+            self.robot_port = None
+            self.ser = ser
+            self.channel = SerialChannel(self.ser)
+            self.__init_pen()
+            self.capabilities = EbbCapabilities.parse(self.query_motor_version())
+        elif Config.get_virtual_debug_model():
             self.robot_port = 'COM3'
             self.ser = serial.Serial()
+            self.channel = SerialChannel(self.ser)
+            self.capabilities = EbbCapabilities()
         else:
             self.robot_port = self.__get_robot_port()#获取机器人串口编号
             self.ser = serial.Serial()            
             self.__connect()
+            self.channel = SerialChannel(self.ser)
             self.__init_pen()
+            # 固件版本在连接时查询一次
+            self.capabilities = EbbCapabilities.parse(self.query_motor_version())
     
     # 初始化笔的位置
     def __init_pen(self):
-        command = 'QP\r'
-        self.ser.write(command.encode())
-        pen_state = self.ser.read()
-        if pen_state == b'0':
-            command = 'SP,1\r'
-            self.ser.write(command.encode())
+        pen_state = self.channel.query('QP\r')
+        if pen_state[:1] == ['0']:
+            self.channel.send('SP,1\r')
             time.sleep(0.5)
             
     # 获取设备端口号
@@ -63,17 +146,11 @@ class RobotCommunicate(object):
     
     def qure_step_movement(self):
         #步骤位置对应的并不是准确的x,y坐标，移动给的两个坐标与实际坐标也不同，例如move(1000，1000)，结果给出的结果增加的是2000，0
-        command = 'QS\r'
-        try:            
-            self.ser.write(command.encode())
-            time.sleep(0.01)
-            read = self.ser.read_all()
-        except OSError:
-            read = ''
-        return read
+        reply = self.channel.query('QS\r')
+        return reply[0] if reply else ''
     
     def run(self, command):
-        self.ser.write(command.encode())
+        self.channel.send(command)
         
     def query_motor_state(self):
         #QS: 查询电机步骤位置，可以利用
@@ -83,28 +160,17 @@ class RobotCommunicate(object):
         #    Motor1Status 若当前电机1在执行运动，则为1
         #    Motor2Status 若当前电机2在执行运动，则为1
         #    FIFOStatus 如果FIFO不为空，则FIFOStatus为1(FIFO缓冲区)
-        read = ''
-        command = 'QM\r'
-        try:            
-            self.ser.write(command.encode())
-#        if self.ser.in_waiting:
-            time.sleep(0.01)
-            read = self.ser.read_all()
-        except OSError:
-            read = ''
-        return read
+        reply = self.channel.query('QM\r')
+        return reply[0] if reply else ''
     
     # 查询固件版本号
     def query_motor_version(self):
-        read = ''
-        command = 'V\r'
-        try:            
-            self.ser.write(command.encode())
-            time.sleep(0.01)
-            read = self.ser.read_all()
-        except OSError:
-            read = ''
-        return read
+        reply = self.channel.query('V\r')
+        return reply[0] if reply else ''
+    
+    def query_many(self, commands):
+        """一次发送多条查询指令，例如['QM\\r', 'QS\\r']，返回各指令返回值的第一行"""
+        return [reply[0] if reply else '' for reply in self.channel.query_many(commands)]
     
     # 关闭接口
     def close(self):
@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+"""
+Spatial prior of widget locations, used to shrink template match windows
+"""
+
+import threading
+
+from config import Config
+
+
+class RoiTracker(object):
+    """控件位置先验索引
+
+    记录每个控件在每个查询范围内最近一次匹配成功的位置，
+    下一次查找该控件时先在这个位置附近的小区域(ROI)内匹配。
+    find_many在线程池中并行匹配多个控件，各方法加锁后可以被多个线程调用
+
+    Attributes:
+        margin: float, ROI在控件四周扩展的距离与控件宽高的比例
+        locations: dict, (控件名, 查询范围) -> (x, y, h, w),
+            以设备左上角为原点的控件中心坐标及控件大小
+        hits: int, 在ROI内匹配成功的次数
+        misses: int, ROI内匹配失败后在整个查询范围内匹配的次数
+    """
+
+    def __init__(self, margin=None):
+        if margin is None:
+            margin = Config.get_roi_margin()
+        self.margin = margin
+        self.locations = {}
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get_roi(self, widget_image_name, region):
+        """获取控件上次出现位置附近的ROI
+
+        Returns:
+            [x1, y1, x2, y2], 以设备左上角为原点的像素坐标; 没有记录时返回None
+        """
+        with self.lock:
+            location = self.locations.get((widget_image_name, tuple(region)))
+        if location is None:
+            return None
+        x, y, h, w = location
+        dx = w * (0.5 + self.margin)
+        dy = h * (0.5 + self.margin)
+        return [x - dx, y - dy, x + dx, y + dy]
+
+    def update(self, widget_image_name, region, match_result):
+        """记录控件匹配成功的位置"""
+        x, y = match_result.get_coordinates()
+        h, w = match_result.get_image_size()
+        with self.lock:
+            self.locations[(widget_image_name, tuple(region))] = (x, y, h, w)
+
+    def record_hit(self):
+        """记录一次在ROI内匹配成功"""
+        with self.lock:
+            self.hits += 1
+
+    def record_miss(self):
+        """记录一次ROI内匹配失败，之后在整个查询范围内匹配"""
+        with self.lock:
+            self.misses += 1
+
+    def remove(self, widget_image_name, region):
+        """控件在整个查询范围内都没有匹配成功时，删除记录的位置"""
+        with self.lock:
+            self.locations.pop((widget_image_name, tuple(region)), None)
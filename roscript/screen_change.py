@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+"""
+Cheap screen-change detection on downsampled frames, used to skip redundant template matches
+"""
+
+import cv2
+import numpy as np
+
+from config import Config
+
+SIGNATURE_SIZE = 48  # 缩略图长边的像素数，每个像素约为屏幕的1/48
+
+
+class ScreenChangeDetector(object):
+    """比较视频帧与最近一次匹配的屏幕图像，判断屏幕是否发生变化
+
+    将查询范围内的图像缩小为灰度缩略图，缩小时的区域平均可以去掉摄像头噪声；
+    任一缩略图像素与参考图像的差超过阈值时认为屏幕发生了变化。
+    使用最大差而不是平均差，屏幕上只出现一个小控件时也能检测到
+
+    Attributes:
+        region_contour: [x1, y1, x2, y2], 视频帧中比较的区域
+        threshold: float, 缩略图像素灰度差的阈值
+        reference: 最近一次匹配的屏幕图像的缩略图，为空时任何视频帧都视为发生了变化
+        checks: int, 比较的次数
+        changes: int, 检测到变化的次数
+    """
+
+    def __init__(self, region_contour, threshold=None):
+        if threshold is None:
+            threshold = Config.get_screen_change_threshold()
+        self.region_contour = [int(round(v)) for v in region_contour]
+        self.threshold = threshold
+        self.reference = None
+        self.checks = 0
+        self.changes = 0
+
+    def get_signature(self, frame):
+        """获取视频帧中比较区域的灰度缩略图"""
+        x1, y1, x2, y2 = self.region_contour
+        image = frame[max(y1, 0):y2, max(x1, 0):x2]
+        if image.ndim == 3:
+            image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        h, w = image.shape[:2]
+        scale = SIGNATURE_SIZE / max(h, w)
+        size = (max(1, int(round(w * scale))), max(1, int(round(h * scale))))
+        return cv2.resize(image, size, interpolation=cv2.INTER_AREA).astype(np.int16)
+
+    def set_reference(self, frame):
+        """记录进行了模板匹配的屏幕图像"""
+        self.reference = self.get_signature(frame)
+
+    def is_changed(self, frame):
+        """判断视频帧与参考图像相比是否发生了变化"""
+        self.checks += 1
+        signature = self.get_signature(frame)
+        if self.reference is None or self.reference.shape != signature.shape:
+            changed = True
+        else:
+            changed = np.abs(signature - self.reference).max() > self.threshold
+        if changed:
+            self.changes += 1
+        return changed
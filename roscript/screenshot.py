@@ -10,6 +10,9 @@ import numpy as np
 from PIL import Image
 import cv2
 import template_match
+from widget_cache import WIDGET_CACHE
+from feature_store import FEATURE_STORE
+from replay import REPLAY_ENGINE
 from test_script import TestScript
 from config import Config
 from ruamel import yaml
@@ -32,6 +35,21 @@ def _get_device_contour(oper_region, contour_size):
     return region_area.tolist()
 
 
+class ScreenFrame(object):
+    """拍摄得到的屏幕图像帧
+    
+    Attributes:
+        image: BGR图像数组
+        index: 图像编号
+        path: 图像对应的文件路径, 仅在调试产物模式或虚拟调试时存在于磁盘中
+    """
+    
+    def __init__(self, image, index=0, path=''):
+        self.image = image
+        self.index = index
+        self.path = path
+
+
 class Screenshot(object):
     """图像控制类
     
@@ -41,7 +59,9 @@ class Screenshot(object):
         screen_shot_index: 图像编号
         region: 匹配区域，默认为整个屏幕
         virtual_debug: 虚拟调试功能
-        detour_frame_path: 分步规避运动的视频帧存储路径
+        frame: ScreenFrame, 已拍摄的屏幕图像帧, 为空时根据图像编号从磁盘读取
+        widget: 已解码的控件图像, 为空时根据控件图像名读取
+        widget_features: 已计算的控件特征点, 为空时由特征点匹配算法从特征点缓存中获取
     """
     
     def __init__(self,
@@ -50,40 +70,55 @@ class Screenshot(object):
                  screen_shot_index=0,
                  region=[0, 0, 1, 1], 
                  virtual_debug=False, 
-                 detour_frame_path=''):
+                 frame=None,
+                 widget=None,
+                 widget_features=None):
         self.log = log
-        self.widget_scaled = False
-        self.widget_image_path = self.__get_widget_path(widget_image)
+        self.widget_name = widget_image
+        self.widget_image_path = widget_image
+        # 控件模板在匹配时根据算法从控件缓存中获取
+        self.widget_image = widget
+        self.widget_features = widget_features
+        if widget is None:
+            self.widget_image_path = os.path.join(TestScript.script_widgets_dir(), widget_image)
+            Screenshot.__check_image_exist(self.widget_image_path)
         self.oper_region = region
-        if screen_shot_index != 0:
-            self.screen_shot_path = Screenshot.get_screenshot_path(screen_shot_index, virtual_debug)
-        elif detour_frame_path != '':
-            self.screen_shot_path = detour_frame_path
-        else:
-            raise FileNotFoundError('No Screen Shot Image')
+        if frame is None:
+            if screen_shot_index == 0:
+                raise FileNotFoundError('No Screen Shot Image')
+            frame = Screenshot.load_screen_frame(screen_shot_index, virtual_debug)
+        self.screen_frame = frame
+        self.screen_shot_path = frame.path
     
-    # 返回目标图片集的绝对路径
-    def __get_widget_path(self, widget_image):
+    # 返回缩放后的控件图像
+    def __get_widget_image(self, gray=False):
         """获取根据屏幕分辨率修改后的控件图像
         Args:
-            widget_image: 控件图像名
-        Return: 根据裁剪时和运行时的屏幕分辨率缩放后的控件图像
+            gray: 是否获取灰度控件图像
+        Return: 根据裁剪时和运行时的屏幕分辨率缩放后的控件图像,
+            缩放后的控件图像缓存在进程内，重复使用同一控件时不再读取和缩放
         """
-        widget_dir = TestScript.script_widgets_dir()
-        widget_path = os.path.join(widget_dir, widget_image)
-        Screenshot.__check_image_exist(widget_path)
-        return self.__scale_normalize(widget_path, widget_image)
+        widget, scaling = WIDGET_CACHE.get_template(self.widget_image_path,
+                                                    Config.get_equipment_contour(),
+                                                    self.__scale_normalize,
+                                                    gray,
+                                                    self.__get_widget_snapscreen_path(self.widget_name))
+        if scaling is not None:
+            # 记录缩放数据，使用缓存的模板时同样记录
+            self.log.record_TM_scale(scaling)
+        return widget
     
     # 修改widget大小
-    def __scale_normalize(self, widget_path, widget_image):# 大小修改
+    def __scale_normalize(self, widget):# 大小修改
         """修改控件大小
         Args:
-            widget_path: 原始控件路径
-            widget_image: 控件名
+            widget: 原始控件图像
+        Returns:
+            缩放后的控件图像, 缩放比例(未缩放时为None)
         """
-        wiget_device_contour = self.__get_widget_device_contour(widget_image)
+        wiget_device_contour = self.__get_widget_device_contour(self.widget_name)
         if wiget_device_contour == self.__get_cur_device_contour():
-            return widget_path
+            return widget, None
         
         button_device_area = wiget_device_contour[0] * wiget_device_contour[1]
         
@@ -93,20 +128,13 @@ class Screenshot(object):
         # 缩放公式：当前设备轮廓/记录控件时的设备轮廓
         scaling = (cur_device_area / button_device_area) ** 0.5
         if scaling < (1 + DELTA) and scaling > (1 - DELTA):
-            return widget_path
+            return widget, None
 
-        # 记录缩放数据
-        self.log.record_TM_scale(scaling)
-
-        origin_widget = Image.open(widget_path)
         #原始控件的大小
-        width, height = origin_widget.size
-        scaling_widget = origin_widget.resize((int(width * scaling), int(height * scaling)), Image.ANTIALIAS)
-        #将缩放后的控件存为临时控件
-        scaling_widget_path = os.path.join(TestScript.script_test_dir(), widget_image)
-        scaling_widget.save(scaling_widget_path)
-        self.widget_scaled = True
-        return scaling_widget_path
+        height, width = widget.shape[:2]
+        # 缩放后的控件只保存在内存中
+        return cv2.resize(widget, (int(width * scaling), int(height * scaling)),
+                          interpolation=cv2.INTER_AREA), scaling
     
     # 检测图片是否存在
     @staticmethod
@@ -134,6 +162,15 @@ class Screenshot(object):
             若不存在，则返回默认的配置文件'default.snapscreen',
             若默认的配置文件也不存在,则使用当前记录的设备分辨率,写在'sut.yaml'中。
         """
+        screenshot_config_path = self.__get_widget_snapscreen_path(widget_image)
+        if screenshot_config_path is None:
+            return self.__get_cur_device_contour()
+        
+        return self.__get_screenshot_config(screenshot_config_path)
+    
+    @staticmethod
+    def __get_widget_snapscreen_path(widget_image):
+        """获取控件图像使用的'.snapscreen'文件路径，优先使用控件同名的文件，其次为'default.snapscreen'，都不存在时返回None"""
         #获取控件图片集的绝对路径
         widget_dir = TestScript.script_widgets_dir()
         #获取控件图片对应的配置文件路径
@@ -143,13 +180,11 @@ class Screenshot(object):
         
         # 判断是否存在该图片的特殊配置文件
         if os.path.isfile(widget_config_path):
-            screenshot_config_path = widget_config_path
-        else:
-            screenshot_config_path = TestScript.get_default_snapscreen_path()
-            if not os.path.isfile(screenshot_config_path):
-                return self.__get_cur_device_contour()
-        
-        return self.__get_screenshot_config(screenshot_config_path)
+            return widget_config_path
+        screenshot_config_path = TestScript.get_default_snapscreen_path()
+        if os.path.isfile(screenshot_config_path):
+            return screenshot_config_path
+        return None
     
     #读取screenshot文件信息
     def __get_screenshot_config(self, config_file_path):
@@ -190,75 +225,157 @@ class Screenshot(object):
                 Screenshot.__check_image_exist(screen_shot_path)
                 return screen_shot_path
         else:
-            screen_shot_dir = TestScript.script_temporary_dir()
-            screen_shot_name = '{}_{}.png'.format(TestScript.get_pyname(), screen_shot_index)
-            screen_shot_path = os.path.join(screen_shot_dir, screen_shot_name)
+            screen_shot_path = TestScript.get_screenshot_image_path(screen_shot_index)
             Screenshot.__check_image_exist(screen_shot_path)
             return screen_shot_path
     
+    @staticmethod
+    def load_screen_frame(screen_shot_index, virtual_debug):
+        """从磁盘中读取已存储的屏幕图像帧，虚拟调试回放时使用预先读取的图像"""
+        screen_shot_path = Screenshot.get_screenshot_path(screen_shot_index, virtual_debug)
+        image = REPLAY_ENGINE.get_image(screen_shot_path)
+        if image is None:
+            image = cv2.imread(screen_shot_path)
+        return ScreenFrame(image, screen_shot_index, screen_shot_path)
+    
     #获取图像匹配结果
-    def get_image_match_result(self, algorithm='tcfn'):
+    def get_image_match_result(self, algorithm='tcfn', roi=None):
+        """获取控件匹配结果
+        
+        Args:
+            algorithm: 模板匹配算法
+            roi: 以设备左上角为原点的像素区域[x1, y1, x2, y2], 不为空时只在该区域与匹配范围的交集内匹配,
+                交集小于控件图像时在整个匹配范围内匹配
+        Returns:
+            TemplateMatchResult, 坐标为以设备左上角为原点的控件中心点
+        """
+        return self.get_image_match_results(algorithm, 1, roi)[0]
+    
+    #获取多个图像匹配结果
+    def get_image_match_results(self, algorithm='tcfn', count=1, roi=None):
+        """在一次匹配中获取控件的多个实例
+        
+        Args:
+            algorithm: 模板匹配算法, 不支持多结果的算法只返回一个结果
+            count: 最多返回的结果数量
+            roi: 同get_image_match_result
+        Returns:
+            TemplateMatchResult列表, 按匹配程度从好到差排列,
+            坐标为以设备左上角为原点的控件中心点
+        """
         # 目标匹配
-        screen_shot =  Image.open(self.screen_shot_path)
+        self.__load_widget_image(algorithm)
         #获取当前屏幕操作区域
         equipment_contour = Config.get_equipment_contour()
         cur_device_contour = _get_device_contour(self.oper_region, equipment_contour)
-        #切割设备屏幕
-        device_image = screen_shot.crop((cur_device_contour[0],
-                                         cur_device_contour[1],
-                                         cur_device_contour[2],
-                                         cur_device_contour[3]))# 获取设备轮廓图
-        
-        #保存屏幕轮廓图（可删）
-        (filepath, tempfilename) = os.path.split(self.screen_shot_path)
-        (filename, extension) = os.path.splitext(tempfilename)
-        device_image_path = '{}/{}_contour.png'.format(TestScript.script_test_dir(), filename)
-        device_image.save(device_image_path)# 存取识别轮廓图（可删）
-        
-        template_match_result = self.match(device_image_path, algorithm)# 识别结果只是轮廓区域的左上角
-        h,w = template_match_result.get_image_size()
+        if roi is not None:
+            roi_contour = [max(cur_device_contour[0], equipment_contour[0] + roi[0]),
+                           max(cur_device_contour[1], equipment_contour[1] + roi[1]),
+                           min(cur_device_contour[2], equipment_contour[0] + roi[2]),
+                           min(cur_device_contour[3], equipment_contour[1] + roi[3])]
+            widget_h, widget_w = self.widget_image.shape[:2]
+            if (roi_contour[2] - roi_contour[0] > widget_w + 1
+                    and roi_contour[3] - roi_contour[1] > widget_h + 1):
+                cur_device_contour = roi_contour
+        #切割设备屏幕，直接在图像数组上切片，不产生中间文件
+        [x1, y1, x2, y2] = [int(round(v)) for v in cur_device_contour]
+        device_image = self.screen_frame.image[y1:y2, x1:x2]# 获取设备轮廓图
         
-        #画识别区域
-        #TODO
-        #存放结果图片（可删）
-        x, y = template_match_result.get_coordinates()
+        # 识别结果只是轮廓区域的左上角
+        if count > 1 and algorithm in template_match.OPENCV_TEMPLATE_MATCH_METHODS:
+            template_match_results = self.match_top_k(device_image, algorithm, count)
+        else:
+            template_match_results = [self.__get_prefetched_match(algorithm, [x1, y1, x2, y2])
+                                      or self.match(device_image, algorithm)]
         
-        device_screen_image = cv2.imread(device_image_path)# 获取当前图片
-        cv2.rectangle(device_screen_image,(int(x), int(y)), (int(x + w), int(y + h)), (0,0,255),2)
-        match_result_path = '{}/{}_match.png'.format(TestScript.script_test_dir(), filename)
-        cv2.imwrite(match_result_path, device_screen_image)# 将识别结果存储到文件中
-        os.remove(device_image_path)
+        if Config.is_artifact_enabled():
+            #存放结果图片
+            (filepath, tempfilename) = os.path.split(self.screen_shot_path)
+            (filename, extension) = os.path.splitext(tempfilename)
+            device_screen_image = device_image.copy()
+            for template_match_result in template_match_results:
+                h,w = template_match_result.get_image_size()
+                x, y = template_match_result.get_coordinates()
+                cv2.rectangle(device_screen_image,(int(x), int(y)), (int(x + w), int(y + h)), (0,0,255),2)
+            match_result_path = '{}/{}_match.png'.format(TestScript.script_test_dir(), filename)
+            cv2.imwrite(match_result_path, device_screen_image)# 将识别结果存储到文件中
         
         # 计算region区域到设备轮廓边界的距离
         px = cur_device_contour[0] - equipment_contour[0]
         py = cur_device_contour[1] - equipment_contour[1]
         #将位置调整到设备轮廓中的控件中心点，以设备左上角为原点
-        template_match_result.add_coordinates(w/2 + px, h/2 + py)
-        return template_match_result
+        for template_match_result in template_match_results:
+            h,w = template_match_result.get_image_size()
+            template_match_result.add_coordinates(w/2 + px, h/2 + py)
+        return template_match_results
+    
+    def __load_widget_image(self, algorithm):
+        """根据匹配算法获取缩放后的彩色或灰度控件图像"""
+        if self.widget_image is None:
+            gray = algorithm in template_match.GRAY_TEMPLATE_MATCHERS
+            self.widget_image = self.__get_widget_image(gray)
+    
+    def __get_prefetched_match(self, algorithm, contour):
+        """获取虚拟调试回放时预先匹配的结果，没有时返回None"""
+        future = REPLAY_ENGINE.take_match(self.screen_shot_path, self.widget_image_path,
+                                          algorithm, contour)
+        if future is None:
+            return None
+        self.log.record_TM_start()
+        match_result = REPLAY_ENGINE.get_match_result(future)
+        if match_result is not None:
+            self.log.record_TM_result(match_result)
+        return match_result
+    
+    def match_contour(self, contour, algorithm='tcfn'):
+        """在屏幕图像的像素区域[x1, y1, x2, y2]内匹配控件，用于回放时预先匹配
+        
+        Returns:
+            TemplateMatchResult, 坐标为区域内控件的左上角
+        """
+        self.__load_widget_image(algorithm)
+        [x1, y1, x2, y2] = contour
+        return self.match(self.screen_frame.image[y1:y2, x1:x2], algorithm)
     
     #进行图像匹配
-    def match(self, device_image_path, algorithm):
+    def match(self, device_image, algorithm):
         # 选择图像识别函数
         self.log.record_TM_start()
         #选择算法
-        match_result = template_match.TEMPLATE_MATCHERS[algorithm](device_image_path, self.widget_image_path)
+        if algorithm in template_match.FEATURE_TEMPLATE_MATCHERS:
+            # 控件特征点只计算一次，每次匹配只检测屏幕图像的特征点
+            if self.widget_features is None:
+                self.widget_features = FEATURE_STORE.get_features(
+                        algorithm, self.widget_image_path, self.widget_image)
+            match_result = template_match.TEMPLATE_MATCHERS[algorithm](
+                    device_image, self.widget_image, self.widget_features)
+        else:
+            match_result = template_match.TEMPLATE_MATCHERS[algorithm](device_image, self.widget_image)
+        match_result.image = self.screen_shot_path
+        match_result.template = self.widget_image_path
         self.log.record_TM_result(match_result)
-
-        if self.widget_scaled:
-            os.remove(self.widget_image_path)
         return match_result
     
+    #进行多结果图像匹配
+    def match_top_k(self, device_image, algorithm, count):
+        self.log.record_TM_start()
+        match_results = template_match.opencv_template_match_top_k(
+                device_image, self.widget_image,
+                template_match.OPENCV_TEMPLATE_MATCH_METHODS[algorithm], count)
+        for match_result in match_results:
+            match_result.image = self.screen_shot_path
+            match_result.template = self.widget_image_path
+        if match_results:
+            self.log.record_TM_result(match_results[0])
+        return match_results
+    
     def save_detour_frame(self, screen_shot_index, virtual_debug):
         """保存规避过程中保留的视频帧"""
+        if not Config.is_artifact_enabled():
+            return
         
-        temporary_dir = TestScript.script_temporary_dir()
-        screen_shot_name = '{}_{}.png'.format(TestScript.get_pyname(),
-                                              screen_shot_index)
-        
-        screen_shot_path = '{}/{}'.format(temporary_dir, screen_shot_name)
-        # 读取临时帧路径，并保到指定文件中
-        frame = cv2.imread(self.screen_shot_path)
-        cv2.imwrite(screen_shot_path, frame)
+        screen_shot_path = TestScript.get_screenshot_image_path(screen_shot_index)
+        cv2.imwrite(screen_shot_path, self.screen_frame.image)
         
     
 def crop_snap_screen(snap_path):
@@ -0,0 +1,283 @@
+# -*- coding: utf-8 -*-
+"""
+Request/response layer on top of the robot serial port
+@author: szy
+"""
+
+import threading
+import time
+from collections import deque
+
+import serial
+
+# EBB对各指令的返回行数，其余指令返回一行'OK'
+REPLY_LINES = {
+    'V': 1,   # 固件版本
+    'QM': 1,  # 电机状态
+    'QS': 2,  # 电机步进位置, OK
+    'QP': 2,  # 笔的状态, OK
+}
+# 返回值的开头，用于丢弃与查询指令不对应的行
+REPLY_PREFIXES = {
+    'V': 'EBB',
+    'QM': 'QM,',
+}
+# 各查询指令等待返回的最长时间(秒)，缓冲区已满时EBB要等缓冲区空闲才会解析新的指令
+QUERY_TIMEOUTS = {
+    'V': 0.5,
+    'QM': 0.2,
+    'QS': 0.2,
+    'QP': 0.2,
+}
+DEFAULT_TIMEOUT = 0.5
+# 串口每次读取的超时(秒)，查询的截止时间在读取循环中判断，不在每次读取前修改串口设置
+READ_TIMEOUT = 0.02
+
+
+def command_name(command):
+    """获取指令名，例如'XM,100,10,10\\r'的指令名为'XM'"""
+    return command.strip().split(',')[0].upper()
+
+
+class SerialChannel(object):
+    """按行解析串口返回值，并将返回值与发送的指令一一对应
+
+    EBB对每条指令都有返回，运动指令返回'OK'。不需要返回值的指令只发送不等待，
+    其返回值在之后的查询中按顺序读取并丢弃；查询指令按照发送顺序读取各自的返回行。
+    返回值以换行符分行，兼容旧版本固件'\\n\\r'形式的行结束符
+
+    Attributes:
+        ser: 串口，需要提供write, read_until和timeout，读超时设置为READ_TIMEOUT
+        pending_lines: 已发送但还未读取的返回行数
+        partial: 超时时已读取的不完整的返回行
+    """
+
+    def __init__(self, ser):
+        self.ser = ser
+        self.ser.timeout = READ_TIMEOUT
+        self.pending_lines = 0
+        self.partial = b''
+        self.lock = threading.Lock()
+
+    def send(self, command):
+        """发送不需要返回值的指令，可以是以'\\r'分隔的多条指令"""
+        with self.lock:
+            self.ser.write(command.encode())
+            self.pending_lines += sum(REPLY_LINES.get(command_name(text), 1)
+                                      for text in command.split('\r') if text.strip())
+
+    def query(self, command, timeout=None):
+        """发送查询指令并读取返回值
+
+        Args:
+            command: 指令字符串，以'\\r'结尾
+            timeout: 等待返回值的最长时间，默认按指令类型确定
+        Returns:
+            返回值各行组成的列表，超时或串口错误时返回空列表
+        """
+        return self.query_many([command], timeout)[0]
+
+    def query_many(self, commands, timeout=None):
+        """一次发送多条查询指令，再依次读取各自的返回值
+
+        Returns:
+            每条指令的返回行列表
+        """
+        with self.lock:
+            try:
+                self.ser.write(''.join(commands).encode())
+            except (OSError, serial.SerialException):
+                return [[] for command in commands]
+            replies = []
+            deadline = time.monotonic()
+            for i, command in enumerate(commands):
+                name = command_name(command)
+                deadline += timeout if timeout is not None else QUERY_TIMEOUTS.get(name, DEFAULT_TIMEOUT)
+                lines = self.__read_reply(name, deadline)
+                if lines is None:
+                    # 超时的返回值之后仍会到达，记入未读取的行数，由之后的查询丢弃
+                    self.pending_lines += sum(REPLY_LINES.get(command_name(c), 1)
+                                              for c in commands[i + 1:])
+                    replies.extend([] for c in commands[i:])
+                    break
+                replies.append(lines)
+            return replies
+
+    def __read_reply(self, name, deadline):
+        """先丢弃之前发送的指令的返回值，再读取当前查询指令的返回值，超时返回None"""
+        while self.pending_lines > 0:
+            if self.__read_line(deadline) is None:
+                # 当前查询的返回值排在未读取的返回值之后，同样记入未读取的行数
+                self.pending_lines += REPLY_LINES.get(name, 1)
+                return None
+            self.pending_lines -= 1
+        prefix = REPLY_PREFIXES.get(name)
+        lines = []
+        line_count = REPLY_LINES.get(name, 1)
+        while len(lines) < line_count:
+            line = self.__read_line(deadline)
+            if line is None:
+                self.pending_lines += line_count - len(lines)
+                return None
+            if not lines and prefix is not None and not line.startswith(prefix) and not line.startswith('!'):
+                # 与查询不对应的行(例如丢失计数的'OK')
+                continue
+            lines.append(line)
+        return lines
+
+    def __read_line(self, deadline):
+        """读取一个非空返回行，超时返回None，已读取的部分留到下次读取"""
+        while True:
+            if time.monotonic() >= deadline:
+                return None
+            try:
+                raw = self.ser.read_until(b'\n')
+            except (OSError, serial.SerialException):
+                return None
+            self.partial += raw
+            if not self.partial.endswith(b'\n'):
+                continue
+            line = self.partial.decode(errors='replace').strip('\r\n')
+            self.partial = b''
+            if line:
+                return line
+
+
+class FakeEbbSerial(object):
+    """模拟EBB控制板的串口，用于在没有机器人时测试串口通信和指令队列
+
+    按XM/SP指令的运行时间模拟电机运动和一条指令的FIFO缓冲区: 缓冲区已满时，
+    后续指令要等到缓冲区空闲才会被解析，返回值也随之延迟
+
+    Attributes:
+        version: 模拟的固件版本
+        timeout: 读超时(秒)
+        position: 电机步进位置
+        pen_up: 笔是否抬起
+    """
+
+    def __init__(self, version='2.5.3', timeout=0.5):
+        self.version = version
+        self.timeout = timeout
+        self.is_open = True
+        self.position = [0, 0]
+        self.pen_up = True
+        self.moves = []  # 运动指令: [开始时间, 结束时间, dx, dy]
+        self.replies = deque()  # 返回值: (可读取的时间, 字节串)
+        self.buffer = b''
+        self.parse_time = 0  # 控制板可以解析下一条指令的时间
+        self.fifo_free_time = 0  # FIFO缓冲区空闲的时间
+        self.motor_free_time = 0  # 电机运动结束的时间
+        self.lock = threading.Lock()
+
+    def write(self, data):
+        now = time.monotonic()
+        with self.lock:
+            for command in data.decode().split('\r'):
+                if command.strip():
+                    self.__parse(command.strip(), now)
+        return len(data)
+
+    def __parse(self, command, now):
+        args = command.split(',')
+        name = args[0].upper()
+        t = max(now, self.parse_time)
+        if name in ('XM', 'SP', 'HM'):
+            duration, dx, dy = self.__motion(name, args)
+            # 指令要等FIFO空闲后才能进入缓冲区
+            accept = max(t, self.fifo_free_time)
+            start = max(accept, self.motor_free_time)
+            end = start + duration
+            self.moves.append([start, end, dx, dy])
+            if name == 'SP':
+                self.pen_up = args[1] == '1'
+            self.fifo_free_time = start
+            self.motor_free_time = end
+            self.parse_time = accept
+            self.__reply(accept, 'OK\r\n')
+        elif name == 'V':
+            self.__reply(t, 'EBBv13_and_above EB Firmware Version {}\r\n'.format(self.version))
+        elif name == 'QM':
+            self.__reply(t, 'QM,{},{},{},{}\n\r'.format(*self.__motor_state(t)))
+        elif name == 'QS':
+            x, y = self.__step_position(t)
+            self.__reply(t, '{},{}\n\rOK\r\n'.format(x, y))
+        elif name == 'QP':
+            self.__reply(t, '{}\n\rOK\r\n'.format(1 if self.pen_up else 0))
+        else:
+            self.__reply(t, 'OK\r\n')
+
+    def __motion(self, name, args):
+        """返回运动指令的运行时间(秒)和步进距离"""
+        if name == 'XM':
+            return int(args[1]) / 1000, int(args[2]), int(args[3])
+        if name == 'SP':
+            return (int(args[2]) / 1000 if len(args) > 2 else 0), 0, 0
+        # HM,StepFrequency: 回到初始位置
+        x, y = self.__step_position(self.motor_free_time)
+        frequency = int(args[1]) if len(args) > 1 else 1000
+        return max(abs(x), abs(y)) / frequency, -x, -y
+
+    def __motor_state(self, t):
+        executing = any(start <= t < end for start, end, dx, dy in self.moves)
+        in_fifo = any(start > t for start, end, dx, dy in self.moves)
+        busy = executing or in_fifo
+        return int(busy), int(executing), int(executing), int(in_fifo)
+
+    def __step_position(self, t):
+        x, y = self.position
+        for start, end, dx, dy in self.moves:
+            if t >= end:
+                rate = 1
+            elif t <= start:
+                rate = 0
+            else:
+                rate = (t - start) / (end - start)
+            x += int(dx * rate)
+            y += int(dy * rate)
+        return x, y
+
+    def __reply(self, t, text):
+        self.replies.append((t, text.encode()))
+
+    def __available(self, now):
+        while self.replies and self.replies[0][0] <= now:
+            self.buffer += self.replies.popleft()[1]
+
+    @property
+    def in_waiting(self):
+        with self.lock:
+            self.__available(time.monotonic())
+            return len(self.buffer)
+
+    def read_until(self, expected=b'\n', size=None):
+        deadline = time.monotonic() + (self.timeout if self.timeout is not None else 1e9)
+        while True:
+            now = time.monotonic()
+            with self.lock:
+                self.__available(now)
+                index = self.buffer.find(expected)
+                if index >= 0:
+                    data, self.buffer = self.buffer[:index + len(expected)], self.buffer[index + len(expected):]
+                    return data
+                next_time = self.replies[0][0] if self.replies else None
+            if now >= deadline:
+                with self.lock:
+                    data, self.buffer = self.buffer, b''
+                return data
+            wait = deadline - now if next_time is None else min(deadline, next_time) - now
+            time.sleep(max(wait, 0.0005))
+
+    def read_all(self):
+        with self.lock:
+            self.__available(time.monotonic())
+            data, self.buffer = self.buffer, b''
+            return data
+
+    def reset_input_buffer(self):
+        with self.lock:
+            self.__available(time.monotonic())
+            self.buffer = b''
+
+    def close(self):
+        self.is_open = False
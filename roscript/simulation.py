@@ -0,0 +1,180 @@
+# -*- coding: utf-8 -*-
+"""
+Simulated robot and camera for running test scripts without a rig
+
+机器人使用serial_channel.FakeEbbSerial，按XM/SP指令的运行时间模拟电机运动和FIFO缓冲区；
+摄像头按拍照编号返回录制的屏幕图像，并按视频帧间隔模拟等待新视频帧的时间。
+调用install后新建的Rcs对象使用模拟的机器人和摄像头，可以在普通的计算机上测量动作耗时
+"""
+
+import os
+import time
+
+import cv2
+
+import command_queue
+import robot
+import sut_monitor
+from config import Config, config_content
+from replay import get_frame_paths
+from robot_communicate import RobotCommunicate
+from serial_channel import FakeEbbSerial
+from test_script import TestScript
+
+
+class SimulatedCamera(object):
+    """按拍照编号提供录制的屏幕图像
+
+    录制的屏幕图像即实际运行时保存的旋转后的视频帧，文件名形如<前缀>_<编号>.png，与虚拟调试使用的图像相同。
+    没有对应编号的图像时使用编号最接近的之前的图像
+
+    Attributes:
+        frames: [(编号, 图像), ...]，按编号排列
+        frame_interval: 视频帧间隔(秒)，拍照时等到下一帧开始采集
+        start_time: 模拟视频录制开始的时间(time.monotonic)
+        last_index: 最近一次拍照的编号
+        photo_count: 拍照次数
+    """
+
+    def __init__(self):
+        self.frames = []
+        self.frame_interval = 1.0 / sut_monitor.fps
+        self.start_time = time.monotonic()
+        self.last_index = 0
+        self.photo_count = 0
+
+    def load(self, frame_dir, frame_names, frame_interval=None):
+        """读取录制的屏幕图像
+
+        Args:
+            frame_dir: 录制的屏幕图像所在目录
+            frame_names: 屏幕图像的文件名前缀，按优先顺序排列
+            frame_interval: 视频帧间隔(秒)，默认按视频监控的帧率计算
+        """
+        self.frames = []
+        for path in get_frame_paths(frame_dir, frame_names):
+            image = cv2.imread(path)
+            if image is not None:
+                index = int(os.path.splitext(path)[0].rsplit('_', 1)[1])
+                self.frames.append((index, image))
+        if not self.frames:
+            raise Exception('No recorded frames in {}'.format(frame_dir))
+        if frame_interval is not None:
+            self.frame_interval = frame_interval
+        self.start_time = time.monotonic()
+        self.last_index = 0
+        self.photo_count = 0
+
+    def get_frame(self, index):
+        """获取编号对应的屏幕图像副本"""
+        image = self.frames[0][1]
+        for frame_index, frame in self.frames:
+            if frame_index > index:
+                break
+            image = frame
+        return image.copy()
+
+    def wait_frame_after(self, request_time):
+        """等待请求时间之后开始采集的第一帧"""
+        elapsed = request_time - self.start_time
+        next_frame_time = self.start_time + (int(elapsed / self.frame_interval) + 1) * self.frame_interval
+        delay = next_frame_time - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+
+    def take_photo(self, index):
+        self.wait_frame_after(time.monotonic())
+        self.last_index = index
+        self.photo_count += 1
+        return self.get_frame(index)
+
+    def peek_frame(self):
+        """等待下一视频帧，即下一次拍照时的屏幕"""
+        self.wait_frame_after(time.monotonic())
+        return self.get_frame(self.last_index + 1)
+
+    def record_detour_frame(self):
+        """规避运动的视频帧，即下一次拍照时的屏幕"""
+        self.wait_frame_after(time.monotonic() + sut_monitor.DETOUR_FRAME_DELAY)
+        return self.get_frame(self.last_index + 1)
+
+
+class SimulatedSutMonitor(object):
+    """模拟的视频监控，接口与sut_monitor.SutMonitor相同"""
+
+    def __init__(self):
+        pass
+
+    def take_photo(self, index):
+        frame = SIMULATED_CAMERA.take_photo(index)
+        if Config.is_artifact_enabled():
+            cv2.imwrite(TestScript.get_screenshot_image_path(index), frame)
+        return frame
+
+    def get_frame(self):
+        return SIMULATED_CAMERA.peek_frame()
+
+    @staticmethod
+    def close():
+        pass
+
+    @staticmethod
+    def get_video_stats():
+        return 0, 0
+
+    def snap_screen(self, snap_screen_path):
+        cv2.imwrite(snap_screen_path, SIMULATED_CAMERA.get_frame(SIMULATED_CAMERA.last_index))
+
+    @staticmethod
+    def record_detour_frame():
+        frame = SIMULATED_CAMERA.record_detour_frame()
+        frame = cv2.resize(frame, tuple(Config.get_screenshot_size()),
+                           interpolation=cv2.INTER_AREA)
+        if Config.is_artifact_enabled():
+            cv2.imwrite(TestScript.get_detour_image_path(), frame)
+        return frame
+
+    @staticmethod
+    def get_img(save_path, size=None):
+        frame = SIMULATED_CAMERA.get_frame(SIMULATED_CAMERA.last_index)
+        if size is not None:
+            frame = cv2.resize(frame, tuple(size), interpolation=cv2.INTER_AREA)
+        cv2.imwrite(save_path, frame)
+
+
+class SimulatedRobotCommunicate(RobotCommunicate):
+    """连接模拟的EBB控制板的机器人串口通信"""
+
+    firmware_version = '2.5.3'  # 模拟的固件版本
+
+    def __init__(self, pen_fall_hight=5, ser=None):
+        if ser is None:
+            ser = FakeEbbSerial(SimulatedRobotCommunicate.firmware_version)
+        RobotCommunicate.__init__(self, pen_fall_hight, ser)
+
+
+def install(frame_dir, frame_names, frame_interval=None, firmware_version=None):
+    """之后新建的Rcs对象使用模拟的机器人和摄像头，并关闭虚拟调试
+
+    Args:
+        frame_dir: 录制的屏幕图像所在目录
+        frame_names: 屏幕图像的文件名前缀，按优先顺序排列
+        frame_interval: 视频帧间隔(秒)，默认按视频监控的帧率计算
+        firmware_version: 模拟的固件版本，例如'2.7.0'时支持HM指令
+    """
+    SIMULATED_CAMERA.load(frame_dir, frame_names, frame_interval)
+    if firmware_version is not None:
+        SimulatedRobotCommunicate.firmware_version = firmware_version
+    robot.SutMonitor = SimulatedSutMonitor
+    command_queue.RobotCommunicate = SimulatedRobotCommunicate
+    # 模拟实际运行，虚拟调试开关只修改内存中的配置
+    config_content()['VirtualDebug'] = False
+
+
+def uninstall():
+    """恢复使用实际的机器人和摄像头"""
+    robot.SutMonitor = sut_monitor.SutMonitor
+    command_queue.RobotCommunicate = RobotCommunicate
+
+
+SIMULATED_CAMERA = SimulatedCamera()
@@ -6,6 +6,7 @@ Created on Fri Feb 28 11:19:52 2020
 """
 
 import threading
+import queue
 import cv2
 import os
 import time
@@ -13,43 +14,42 @@ from config import Config
 from test_script import TestScript
 import numpy as np
 
-get_frame = threading.Event()  # 拍照时截取视频帧事件
-get_frame_ready = threading.Event()  # 视频帧截取完毕
 start_sut_monitor = threading.Event()  # 开始视频录制
-get_detour_frame_event = threading.Event()  # 拍照时截取规避视频帧事件
 
 sut_true_running = True  # 视频录制出现问题
 close_sut_monitor = False  # 结束视频录制
 cap_release = threading.Event()  # 确定关闭视频录制事件，必须加，否在在控制台中运行有bug44
-detour_frame = ''
 
-record_script_in_video = Config.get_sut_monitor_setting()  # 视频存放路径
+PHOTO_TIMEOUT = 5  # 等待拍照视频帧的最长时间(秒)
+DETOUR_FRAME_DELAY = 0.1  # 规避视频帧需要在请求之后多久开始采集(秒)，视频帧的获取总会比想象的快一些
 
 fps = 20  # 秒内的视频帧数量
 
-rotation_angle = Config.get_rotation_angle()  # 旋转角度
-[width, height] = Config.get_screenshot_size()  # 分辨率
+# 视频编码: (fourcc, 视频文件扩展名)
+VIDEO_CODECS = {
+    'I420': ('I420', '.avi'),  # 不压缩
+    'MJPG': ('MJPG', '.avi'),
+    'H264': ('avc1', '.mp4'),
+}
+video_writer = None  # 当前的视频写入线程
 
 g_run_event = True  # 辅助摄像设备运行
 g_sut_tip_event = threading.Event()  # 监视落笔过程
 g_record_tip_img_event = threading.Event()  # 存储落笔图片
 
 
-def rotate_image(image):
-    """旋转图像到指定角度
+def get_rotation_matrix(h, w):
+    """计算旋转到指定角度的仿射变换矩阵
     
     Args:
-        image: 待旋转的图像
+        h, w: 待旋转图像的分辨率
     Returns:
-        rotated_image: 旋转后的图像
+        M: 旋转矩阵
+        (nW, nH): 旋转后图像的分辨率
     """
-    global rotation_angle, width, height
-
-    # 获取图像分辨率
-    (h, w) = image.shape[:2]
     (cX, cY) = (w // 2, h // 2)
     # getRotationMatrix2D有三个参数，第一个为旋转中心，第二个为旋转角度，第三个为缩放比例
-    M = cv2.getRotationMatrix2D((cX, cY), rotation_angle, 1)
+    M = cv2.getRotationMatrix2D((cX, cY), Config.get_rotation_angle(), 1)
     cos = np.abs(M[0, 0])
     sin = np.abs(M[0, 1])
     # 计算图像新边界的分辨率
@@ -60,23 +60,184 @@ def rotate_image(image):
     # adjust the rotation matrix to take into account translation
     M[0, 2] += (nW / 2) - cX
     M[1, 2] += (nH / 2) - cY
+    return M, (nW, nH)
+
+
+def rotate_image(image, dst=None):
+    """旋转图像到指定角度
+    
+    Args:
+        image: 待旋转的图像
+        dst: 存放旋转结果的预分配图像，为空时新建图像
+    Returns:
+        rotated_image: 旋转后的图像
+    """
+    # 获取图像分辨率
+    (h, w) = image.shape[:2]
+    M, size = get_rotation_matrix(h, w)
     # 旋转指定角度
     # perform the actual rotation and return the image
-    rotated_image = cv2.warpAffine(image, M, (nW, nH))
+    rotated_image = cv2.warpAffine(image, M, size, dst=dst)
     return rotated_image
 
 
-class RecordVideo(object):
-    """ Record video when the script is running. 
+class FrameRingBuffer(object):
+    """保存最近N帧旋转后视频帧的环形缓冲区
+    
+    只有视频录制线程写入，读取时不加锁：写入线程先增加开始写入的帧数，再写入图像和采集时间，最后增加帧计数发布新帧；
+    读取线程复制图像后检查复制过程中是否开始写入覆盖该位置的帧，被覆盖时重新读取
     
+    Attributes:
+        size: int, 缓冲区帧数，为空时第一帧写入时读取配置
+        frames: 预分配的图像数组 (size, h, w, 3)，第一帧写入时按旋转后的分辨率分配
+        timestamps: 每帧开始采集的时间(time.monotonic)
+        count: int, 已写入的帧总数
+        started: int, 已开始写入的帧总数，正在写入时比count大1
+        frame_arrived: 新视频帧写入事件
+    """
+
+    def __init__(self, size=None):
+        self.size = size
+        self.frames = None
+        self.timestamps = None
+        self.count = 0
+        self.started = 0
+        self.frame_arrived = threading.Event()
+
+    def write(self, frame, capture_time):
+        """旋转视频帧并直接写入缓冲区中最旧的位置
+        
+        Args:
+            frame: 摄像头读取的原始视频帧
+            capture_time: 开始读取该帧的时间
+        Returns:
+            缓冲区中旋转后的视频帧，在被覆盖之前有效
+        """
+        (h, w) = frame.shape[:2]
+        M, (nW, nH) = get_rotation_matrix(h, w)
+        shape = (nH, nW) + frame.shape[2:]
+        if self.frames is None or self.frames.shape[1:] != shape:
+            if self.size is None:
+                self.size = Config.get_frame_buffer_size()
+            if self.timestamps is None:
+                self.timestamps = np.zeros(self.size)
+            self.frames = np.empty((self.size,) + shape, frame.dtype)
+        slot = self.count % self.size
+        self.started += 1
+        cv2.warpAffine(frame, M, (nW, nH), dst=self.frames[slot])
+        self.timestamps[slot] = capture_time
+        # 发布新帧
+        self.count += 1
+        self.frame_arrived.set()
+        return self.frames[slot]
+
+    def get_frame_after(self, request_time, timeout=None):
+        """获取请求时间之后开始采集的第一帧
+        
         Args:
-            screen_shot_path: The path to store the video
-            screen_shot_idx: The index of screen shot
+            request_time: 请求时间(time.monotonic)
+            timeout: 最长等待时间(秒)，为空时一直等待
+        Returns:
+            视频帧的副本，超时返回None
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            # 先清除事件再检查，避免错过检查过程中写入的新帧
+            self.frame_arrived.clear()
+            count = self.count
+            overwritten = False
+            for i in range(max(0, count - self.size) if count else 0, count):
+                if self.timestamps[i % self.size] < request_time:
+                    continue
+                frame = self.frames[i % self.size].copy()
+                # 开始写入第 i + size 帧时会覆盖该位置
+                if self.started <= i + self.size:
+                    return frame
+                overwritten = True
+                break
+            wait_time = None if deadline is None else deadline - time.monotonic()
+            if wait_time is not None and wait_time <= 0:
+                return None
+            # 复制过程中该位置被覆盖时立即重新读取，否则等待新帧
+            if not overwritten:
+                self.frame_arrived.wait(wait_time)
+
+
+frame_buffer = FrameRingBuffer()  # 最近拍摄的视频帧
+
+
+class AsyncVideoWriter(object):
+    """在独立线程中编码和写入视频
+    
+    视频录制线程只把视频帧的副本放入有界队列，队列已满时丢弃该帧并计数，
+    视频编码和磁盘写入不会阻塞视频帧的采集和拍照
+    
+    Attributes:
+        video_path: 视频存放路径
+        codec: 视频编码, VIDEO_CODECS中的键
+        frames: 待写入的视频帧队列
+        written_count: 已写入的视频帧数
+        dropped_count: 因队列已满丢弃的视频帧数
     """
 
-    def __init__(self):
-        self.screen_shot_path = ''
-        self.screen_shot_idx = 0
+    def __init__(self, video_path, codec, queue_size):
+        self.video_path = video_path
+        self.codec = codec
+        self.frames = queue.Queue(maxsize=queue_size)
+        self.written_count = 0
+        self.dropped_count = 0
+        self.thread = threading.Thread(target=self.__run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def write(self, frame):
+        """将视频帧放入写入队列，不阻塞"""
+        if self.frames.full():
+            self.dropped_count += 1
+            return
+        try:
+            self.frames.put_nowait(frame.copy())
+        except queue.Full:
+            self.dropped_count += 1
+
+    def close(self):
+        """写完队列中剩余的视频帧后关闭视频文件"""
+        self.frames.put(None)
+        self.thread.join()
+
+    def __run(self):
+        video_writer = None
+        while True:
+            frame = self.frames.get()
+            if frame is None:
+                break
+            if video_writer is None:
+                # 按第一帧旋转后的实际分辨率创建视频文件
+                video_writer = self.__open(frame.shape[:2])
+            video_writer.write(frame)  # 保存视频
+            self.written_count += 1
+        if video_writer is not None:
+            video_writer.release()
+
+    def __open(self, shape):
+        """创建视频文件，当前opencv不支持配置的编码时使用MJPG编码"""
+        (h, w) = shape
+        fourcc = cv2.VideoWriter_fourcc(*VIDEO_CODECS[self.codec][0])
+        video_writer = cv2.VideoWriter(self.video_path, fourcc, fps, (w, h))
+        if not video_writer.isOpened() and self.codec != 'MJPG':
+            print('Cannot record video with codec {}, use MJPG instead'.format(self.codec))
+            self.codec = 'MJPG'
+            self.video_path = os.path.splitext(self.video_path)[0] + VIDEO_CODECS['MJPG'][1]
+            fourcc = cv2.VideoWriter_fourcc(*VIDEO_CODECS['MJPG'][0])
+            video_writer = cv2.VideoWriter(self.video_path, fourcc, fps, (w, h))
+        return video_writer
+
+
+class RecordVideo(object):
+    """ Record video when the script is running. 
+    
+        The rotated frames are kept in the module level frame_buffer.
+    """
 
     def record_video(self, video_dir):
         """Record video when the script is running
@@ -84,7 +245,7 @@ class RecordVideo(object):
         Args:
             video_dir: The folder path to store the video
         """
-        global sut_true_running, close_sut_monitor, detour_frame, height, width
+        global sut_true_running, close_sut_monitor, video_writer
 
         focus = Config.get_camera_focus()
 
@@ -98,53 +259,34 @@ class RecordVideo(object):
         cameraCapture.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc('M', 'J', 'P', 'G'))
 
         # 设置摄像头的分辨率和焦距
+        width, height = Config.get_screenshot_size()
         cameraCapture.set(cv2.CAP_PROP_FRAME_WIDTH, width)
         cameraCapture.set(cv2.CAP_PROP_FRAME_HEIGHT, height)
         cameraCapture.set(cv2.CAP_PROP_FOCUS, focus)
 
         # video 视频存放路径
+        codec = Config.get_video_codec()
         moment = time.strftime('%H-%M')
-        video_name = '{}_{}.avi'.format(TestScript.get_pyname(), moment)
+        video_name = '{}_{}{}'.format(TestScript.get_pyname(), moment, VIDEO_CODECS[codec][1])
         video_path = os.path.join(video_dir, video_name)
 
-        # 写视频
-        videoWriter = cv2.VideoWriter(
-            video_path, cv2.VideoWriter_fourcc('I', '4', '2', '0'), fps, (width, height))
+        # 写视频，视频的编码和写入在单独的线程中进行
+        if Config.get_sut_monitor_setting():
+            video_writer = AsyncVideoWriter(video_path, codec, Config.get_video_queue_size())
 
         # 写视频
         while True:
+            capture_time = time.monotonic()
             ret, frame = cameraCapture.read()
             start_sut_monitor.set()
-            get_detour_frame_event.set()
             # print(ret)
             if ret:
-                # print(frame)
-                # 旋转
-                frame = rotate_image(frame)
-                detour_frame = frame
+                # 旋转后的视频帧直接写入环形缓冲区，拍照时从缓冲区中读取，不阻塞视频录制
+                frame = frame_buffer.write(frame, capture_time)
                 sut_true_running = True  # Set
 
-                if record_script_in_video:
-                    videoWriter.write(frame)  # 保存视频
-
-                # 存放拍照时的结果帧
-                if get_frame.is_set():
-                    """保存两帧会优化图像质量，但会额外消耗时间"""
-                    # TODO
-                    # self.screen_shot_idx += 1
-                    # if self.screen_shot_idx % 6 == 0:
-                    # 好像存储的第六帧图像都会模糊
-                    # ret, frame = cameraCapture.read()
-                    ret, frame = cameraCapture.read()
-                    #                    ret, frame = cameraCapture.read()
-                    # 旋转
-                    frame = rotate_image(frame)
-                    cv2.imwrite(self.screen_shot_path, frame)
-
-                    if record_script_in_video:
-                        videoWriter.write(frame)  # 保存视频
-                    get_frame_ready.set()
-                    get_frame.clear()
+                if video_writer is not None:
+                    video_writer.write(frame)  # 保存视频
             else:
                 sut_true_running = False
                 print('Cannot Sut Monitor in Threading')
@@ -155,7 +297,10 @@ class RecordVideo(object):
                 print('Close the Sut Monitor')
                 break
 
-        videoWriter.release()
+        if video_writer is not None:
+            video_writer.close()
+            print('Video frames written: {}, dropped: {}'.format(
+                video_writer.written_count, video_writer.dropped_count))
         cameraCapture.release()
         cap_release.set()
 
@@ -227,14 +372,25 @@ class SutMonitor(object):
     # Take photo in threading
     # Args:
     #     index: The index of the new photo
+    # Returns:
+    #     The first rotated frame captured after the request, 
+    #     it is only written to disk in artifact mode
     def take_photo(self, index):
-        get_frame.set()
-        self.rv.screen_shot_path = "{}/{}_{}.png".format(
-            TestScript.script_temporary_dir(),
-            TestScript.get_pyname(),
-            index)
-        get_frame_ready.wait()
-        get_frame_ready.clear()
+        frame = SutMonitor.__get_frame_after(time.monotonic())
+        if Config.is_artifact_enabled():
+            cv2.imwrite(TestScript.get_screenshot_image_path(index), frame)
+        return frame
+
+    def get_frame(self):
+        """获取请求之后采集的下一帧，不保存图像，用于检测屏幕变化"""
+        return SutMonitor.__get_frame_after(time.monotonic())
+
+    @staticmethod
+    def __get_frame_after(request_time):
+        frame = frame_buffer.get_frame_after(request_time, PHOTO_TIMEOUT)
+        if frame is None:
+            raise Exception('Cannot get frame from Sut Monitor')
+        return frame
 
     # Close the threading and video
     @staticmethod
@@ -243,39 +399,43 @@ class SutMonitor(object):
         close_sut_monitor = True
         cap_release.wait()
 
+    # Get the frame counters of the video writer
+    # Returns:
+    #     (written frames, dropped frames), (0, 0) if the video is not recorded
+    @staticmethod
+    def get_video_stats():
+        if video_writer is None:
+            return 0, 0
+        return video_writer.written_count, video_writer.dropped_count
+
     # Get snap screen
     # Args:
     #     snap_screen_path: The folder path to store the snap screen
     def snap_screen(self, snap_screen_path):
-
-        get_frame.set()
-        self.rv.screen_shot_path = snap_screen_path
-
-        get_frame_ready.wait()
-        get_frame_ready.clear()
+        frame = SutMonitor.__get_frame_after(time.monotonic())
+        cv2.imwrite(snap_screen_path, frame)
 
     @staticmethod
     def record_detour_frame():
-        """返回规避运动的视频帧存储路径"""
-        global detour_frame
-        time.sleep(0.1)
-        # 视频帧的获取总会比想象的快一些，不加sleep的话会获取之前的视频帧，导致无法测试
-        get_detour_frame_event.clear()
-        get_detour_frame_event.wait()
-        # 获取存放路径
-        detour_image_path = TestScript.get_detour_image_path()
-        # 存放视频帧
-        cv2.imwrite(detour_image_path,
-                    cv2.resize(detour_frame, (width, height),
-                               interpolation=cv2.INTER_AREA))
+        """返回规避运动的视频帧"""
+        # 视频帧的获取总会比想象的快一些，只使用请求之后一段时间才开始采集的视频帧，否则会获取之前的视频帧，导致无法测试
+        frame = SutMonitor.__get_frame_after(time.monotonic() + DETOUR_FRAME_DELAY)
+        frame = cv2.resize(frame, tuple(Config.get_screenshot_size()),
+                           interpolation=cv2.INTER_AREA)
+        if Config.is_artifact_enabled():
+            # 存放视频帧
+            cv2.imwrite(TestScript.get_detour_image_path(), frame)
+        return frame
 
     @staticmethod
-    def get_img(save_path, size=Config.get_screenshot_size()):
+    def get_img(save_path, size=None):
         """主摄像机拍摄的图像
         Args:
             save_path: 保存路径
-            size: 图像分辨率
+            size: 图像分辨率，默认为配置的拍摄图像分辨率
         """
+        if size is None:
+            size = Config.get_screenshot_size()
         focus = Config.get_camera_focus()
 
         camera_capture = cv2.VideoCapture(Config.get_capture_id() + cv2.CAP_DSHOW)
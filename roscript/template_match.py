@@ -3,6 +3,9 @@
 @author: szy
 """
 
+import os
+import tempfile
+import threading
 import cv2
 import ctypes
 from config import Config
@@ -12,6 +15,36 @@ import numpy as np
 
 MIN_MATCH_COUNT = 5#最低匹配点数
 MAX_LOOP_COUNT = 5#最大循环次数
+BHM_BLOCK_COUNT = 4#分块直方图每个方向的分块数
+BHM_BIN_COUNT = 16#分块直方图每个颜色通道的区间数
+BHM_BATCH_WINDOWS = 2048#分块直方图每批计算的窗口数量
+PYRAMID_CANDIDATE_COUNT = 3#金字塔匹配在原图中细化的候选位置数量
+PYRAMID_MIN_TEMPLATE_SIZE = 8#金字塔顶层控件图像的最小边长
+
+
+def read_image(image, flags=cv2.IMREAD_COLOR):
+    """读取匹配图像
+    
+    Args:
+        image: 图像路径或已解码的BGR图像数组
+        flags: cv2.imread读取方式，对于图像数组仅处理彩色/灰度转换
+    Returns:
+        图像数组
+    """
+    if isinstance(image, str):
+        return cv2.imread(image, flags)
+    if flags == cv2.IMREAD_GRAYSCALE and image.ndim == 3:
+        return cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    if flags == cv2.IMREAD_COLOR and image.ndim == 2:
+        return cv2.cvtColor(image, cv2.COLOR_GRAY2BGR)
+    return image
+
+
+def image_name(image):
+    """获取图像在日志中的名称，图像数组没有对应的文件"""
+    if isinstance(image, str):
+        return image
+    return ''
 
 class Algorithm(object):
     """ 算法选择类
@@ -51,6 +84,8 @@ class TemplateMatchResult(object):
         self.y = y
         self.h = h
         self.w = w
+        self.image = ''  # 屏幕图像名
+        self.template = ''  # 控件图像名
        
     #返回记录的相似度
     def get_similarity(self):
@@ -74,6 +109,13 @@ class TemplateMatchResult(object):
     def add_coordinates(self, dx, dy):
         self.x = self.x + dx
         self.y = self.y + dy
+    
+    #复制匹配结果
+    def copy(self):
+        match_result = TemplateMatchResult(self.similarity, self.x, self.y, self.h, self.w)
+        match_result.image = self.image
+        match_result.template = self.template
+        return match_result
         
 
 #BBS算法根据模板图像计算不同的权重
@@ -88,145 +130,163 @@ def __patch_size(size):
     else:
         return 7
         
-def bbs_tempalte_match(screen_image_path, widget_image_path):
+def bbs_tempalte_match(screen_image, widget_image):
     #最佳友好相似度模板匹配
-    widget_size = Image.open(widget_image_path).size
-    bbsDll = ctypes.WinDLL(Config.get_bbs_lib_path())
-    weight = __patch_size(widget_size)
-    
-    #BBS匹配算法
-    #定义用来接收bbsDll返回数据的结构体类
-    class MatchResult(ctypes.Structure):  
-        _fields_ = [("similarity", ctypes.c_double),
-                    ("x", ctypes.c_int),
-                    ("y", ctypes.c_int)]
+    #bbsDll只能读取图像文件，图像数组需要先存储为临时文件
+    #每次调用使用单独的临时文件，多个线程或进程同时匹配时互不覆盖
+    temp_files = []
+    try:
+        screen_image_path = __bbs_image_file(screen_image, temp_files)
+        widget_image_path = __bbs_image_file(widget_image, temp_files)
+        widget_size = Image.open(widget_image_path).size
+        bbsDll = ctypes.WinDLL(Config.get_bbs_lib_path())
+        weight = __patch_size(widget_size)
+        
+        #BBS匹配算法
+        #定义用来接收bbsDll返回数据的结构体类
+        class MatchResult(ctypes.Structure):  
+            _fields_ = [("similarity", ctypes.c_double),
+                        ("x", ctypes.c_int),
+                        ("y", ctypes.c_int)]
+            
+        #由于图像数据的传递不方便，所以先将basic和target图像存储成本地文件，以方便bbsDll直接读取
+        bbsDll.bbs_template_match.restype = ctypes.POINTER(MatchResult)
+        result = bbsDll.bbs_template_match(screen_image_path.encode(),
+                                           widget_image_path.encode(),
+                                           ctypes.c_int(weight))
         
-    #由于图像数据的传递不方便，所以先将basic和target图像存储成本地文件，以方便bbsDll直接读取
-    bbsDll.bbs_template_match.restype = ctypes.POINTER(MatchResult)
-    result = bbsDll.bbs_template_match(screen_image_path.encode(),
-                                       widget_image_path.encode(),
-                                       ctypes.c_int(weight))
-    
-    template_match_result = TemplateMatchResult(result.contents.similarity,
-                                                result.contents.x,
-                                                result.contents.y,
-                                                widget_size[0],
-                                                widget_size[1])
+        template_match_result = TemplateMatchResult(result.contents.similarity,
+                                                    result.contents.x,
+                                                    result.contents.y,
+                                                    widget_size[0],
+                                                    widget_size[1])
+    finally:
+        for temp_file in temp_files:
+            os.remove(temp_file)
     
     return template_match_result
 
+#图像数组存储为唯一的临时文件，文件路径加入temp_files，由调用者删除
+def __bbs_image_file(image, temp_files):
+    if isinstance(image, str):
+        return image
+    fd, image_path = tempfile.mkstemp(suffix='.png')
+    os.close(fd)
+    temp_files.append(image_path)
+    cv2.imwrite(image_path, image)
+    return image_path
+
 #分块直方图找相似位置
-def __block_difference(hist1, hist2):
-    similarity = 0
-    
-    for i in range(len(hist1)):
-        if (hist1[i] == hist2[i]):
-            similarity += 1
-        else:
-            similarity += 1 - float(abs(hist1[i] - hist2[i]))/ max(hist1[i], hist2[i])
-
-    return similarity / len(hist1)
-
-#分块直方图发计算匹配相似度
-def __get_bhmatch_similarity(screen_region_image, widget_image):
-    #将两张图缩放到统一尺寸
-    img1 = screen_region_image.resize((64,64)).convert('RGB')
-    img2 = widget_image.resize((64,64)).convert('RGB')  
-    #分块直方图法
-    similarity = 0;
-    for i in range(4):
-        for j in range(4):
-            hist1 = img1.crop((i*16, j*16, i*16+15, j*16+15)).copy().histogram()
-            hist2 = img2.crop((i*16, j*16, i*16+15, j*16+15)).copy().histogram()
-            similarity += __block_difference(hist1, hist2)
-    
-    return similarity/16
-
-def __bh_match_loop(screen_image, widget_image, loop_num):
-    #模板匹配循环，原图、控件、循环次数
-    #根据模板匹配算法寻找图中是否含有小图片，loop_num代表匹配循环测试
-    screen_size = screen_image.size
-    template_match_result = TemplateMatchResult(0, 0, 0, 0, 0)
-    
-    #截取的图片距原图片左边界距离x， 距上边界距离y，距离图片左边界距离+裁剪框宽度x+w，距离图片上边界距离+裁剪框高度y+h
-    x, y = 0,0
-    [w,h] = widget_image.size
-    
-    #将切割图片向周围移动距离比例
-    #循环次数越多，切分越详细
+#将每个通道量化到BHM_BIN_COUNT个区间，返回 (H, W, 3) 的区间编号
+def __histogram_bins(image):
+    return ((image.astype(np.uint16) * BHM_BIN_COUNT) >> 8).astype(np.uint8)
+
+#积分图: 对一个颜色区间的指示图像求二维前缀和，任意矩形区域内该区间的像素数只需4次查表
+#每次只计算一个区间的积分图，内存占用与区间数无关
+def __bin_integrals(bins):
+    for channel in range(3):
+        channel_bins = bins[:, :, channel]
+        for bin_index in range(BHM_BIN_COUNT):
+            indicator = (channel_bins == bin_index).view(np.uint8)
+            yield cv2.integral(indicator, sdepth=cv2.CV_32S)
+
+#窗口各分块的角点在积分图中的一维下标
+#xs, ys 为窗口左上角在积分图中的坐标，integral_w 为积分图宽度，返回 (len(ys), len(xs), 分块行+1, 分块列+1)
+def __block_corners(xs, ys, w, h, integral_w):
+    block_x = np.arange(BHM_BLOCK_COUNT + 1) * w // BHM_BLOCK_COUNT
+    block_y = np.arange(BHM_BLOCK_COUNT + 1) * h // BHM_BLOCK_COUNT
+    edge_x = xs[:, None] + block_x[None, :]
+    edge_y = ys[:, None] + block_y[None, :]
+    return (edge_y[:, None, :, None] * integral_w + edge_x[None, :, None, :]).astype(np.int32)
+
+#批量计算窗口中一个区间的分块像素数，返回 (len(ys), len(xs), 分块行, 分块列)
+def __block_counts(integral, corners):
+    corners = integral.ravel()[corners]
+    return (corners[:, :, 1:, 1:] - corners[:, :, :-1, 1:]
+            - corners[:, :, 1:, :-1] + corners[:, :, :-1, :-1])
+
+#控件的分块直方图，返回 (区间数, 分块行, 分块列)
+def __widget_histogram(widget_image):
+    h, w = widget_image.shape[:2]
+    origin = np.zeros(1, np.int64)
+    corners = __block_corners(origin, origin, w, h, w + 1)
+    return np.stack([__block_counts(integral, corners)[0, 0]
+                     for integral in __bin_integrals(__histogram_bins(widget_image))])
+
+#窗口在一个方向上的所有起点，最后一个窗口贴齐区域边界
+def __window_starts(start, end, size, step):
+    starts = np.arange(start, end - size, step)
+    starts = np.append(starts, end - size)
+    return np.unique(np.round(starts).astype(np.int64))
+
+#分块直方图计算所有窗口的匹配相似度
+#每个分块每个区间的相似度为 1 - |a-b|/max(a,b)，两者相等时为1，窗口相似度为所有分块和区间的平均值
+#逐个区间计算积分图并累加各窗口的差异，按行分批以限制内存占用
+def __window_similarity(bins, widget_hist, xs, ys, w, h):
+    ratio_sum = np.zeros((len(ys), len(xs)), np.float32)
+    rows_per_batch = max(1, BHM_BATCH_WINDOWS // len(xs))
+    #各批窗口的角点下标对所有区间相同，只计算一次
+    batches = [(i, __block_corners(xs, ys[i:i + rows_per_batch], w, h, bins.shape[1] + 1))
+               for i in range(0, len(ys), rows_per_batch)]
+    for integral, widget_counts in zip(__bin_integrals(bins), widget_hist):
+        for i, corners in batches:
+            counts = __block_counts(integral, corners)
+            diff = np.abs(counts - widget_counts).astype(np.float32)
+            peak = np.maximum(counts, widget_counts)
+            ratio_sum[i:i + rows_per_batch] += (diff / np.maximum(peak, 1)).sum(axis=(2, 3))
+    return 1 - ratio_sum / widget_hist.size
+
+def __bh_match_loop(bins, widget_hist, region, w, h, loop_num):
+    #模板匹配循环，屏幕图像的区间编号、控件直方图、查找区域、控件宽高、循环次数
+    #循环次数越多，窗口移动步长越小，匹配范围也逐步缩小
+    [x1, y1, x2, y2] = region
     proportion = 5 * loop_num
-    foot_x, foot_y = 0, 0
+    step_x, step_y = w / proportion, h / proportion
+    xs = __window_starts(x1, x2, w, step_x)
+    ys = __window_starts(y1, y2, h, step_y)
     
-    #向左右及上下移动次数
-    foot_x_all = math.ceil((screen_size[0] - w)*proportion/w)
-    foot_y_all = math.ceil((screen_size[1] - h)*proportion/h)
+    #地毯式匹配所有窗口，积分图只在查找区域内计算
+    similarity = __window_similarity(bins[y1:y2, x1:x2], widget_hist, xs - x1, ys - y1, w, h)
+    row, col = np.unravel_index(np.argmax(similarity), similarity.shape)
+    best_similarity = float(similarity[row, col])
+    best_x, best_y = int(xs[col]), int(ys[row])
+    template_match_result = TemplateMatchResult(best_similarity, best_x, best_y, h, w)
     
-    #开始地毯式匹配相似区域
-    for foot_x in range(foot_x_all+1):
-        y = 0
-        for foot_y in range(foot_y_all+1):
-            
-            #剪切和widget一样大小的图片
-            screen_region = screen_image.crop((x, y, x+w, y+h))
-            result = __get_bhmatch_similarity(screen_region, widget_image)   #两张同等大小的图像相似度
-            if result > template_match_result.get_similarity():
-                """寻找最相似的点"""
-                template_match_result.save_data(result,x,y)
-            
-            y = y + h / proportion
-            if y + h > screen_size[1]:
-                y = screen_size[1] - h
-        
-        x = x + w / proportion
-        if x + w  > screen_size[0]:
-            x = screen_size[0] - w
-    
-    #每次循环都会提高阈值
-    if template_match_result.get_similarity() < 1 - loop_num/100:
-        # 超出循环次数则结束
-        if loop_num > MAX_LOOP_COUNT:
-            return template_match_result    
-        
-        else:
-            x, y = template_match_result.get_coordinate()
-            #缩小匹配范围
-            if x > 0:
-                x = x - w / proportion
-                if y > 0:
-                    y = y - h / proportion
-                
-                length = min(x + w + 2*w/proportion, screen_size[0])
-                height = min(y + h + 2*h/proportion, screen_size[1])
-                
-                #将下一次查找的区域剪切出来
-                screen_region = screen_image.crop((x, y, length, height))
-                region_tmr = __bh_match_loop(screen_region, widget_image, loop_num + 1)
-                
-                #递归查找模板匹配最符合要求的区域
-                if template_match_result.get_similarity() > region_tmr.get_similarity():
-                    template_match_result.add_coordinate(w/2, h/2)
-                
-                else:
-                    region_x, region_y = region_tmr.get_coordinate()
-                    template_match_result.save_data(region_tmr.get_similarity, x + region_x, y + region_y)
-                
-                return template_match_result
-            
-    # 比阈值小或者匹配范围已经最小则返回记录的最相似区域
-    template_match_result.add_coordinate(w/2, h/2)
+    #每次循环都会提高阈值，超出循环次数则结束
+    if best_similarity < 1 - loop_num/100 and loop_num <= MAX_LOOP_COUNT:
+        #缩小匹配范围到最相似位置周围一个步长内
+        screen_h, screen_w = bins.shape[:2]
+        sub_region = [max(0, int(best_x - step_x)), max(0, int(best_y - step_y)),
+                      min(screen_w, int(math.ceil(best_x + w + step_x))),
+                      min(screen_h, int(math.ceil(best_y + h + step_y)))]
+        region_tmr = __bh_match_loop(bins, widget_hist, sub_region, w, h, loop_num + 1)
+        #递归查找模板匹配最符合要求的区域
+        if region_tmr.get_similarity() > best_similarity:
+            return region_tmr
+    
+    # 比阈值大或者匹配范围已经最小则返回记录的最相似区域
     return template_match_result
 
 #分块直方图模板匹配算法
-def block_histogram_match(screen_image_path, widget_image_path):
+def block_histogram_match(screen_image, widget_image):
+    screen_image = read_image(screen_image)
+    widget_image = read_image(widget_image)
+    screen_h, screen_w = screen_image.shape[:2]
+    h, w = widget_image.shape[:2]
+    if h > screen_h or w > screen_w:
+        return TemplateMatchResult(0, 0, 0, h, w)
     
-    screen_image = Image.open(screen_image_path)
-    widget_image = Image.open(widget_image_path)
-    return __bh_match_loop(screen_image, widget_image, 0)
+    #屏幕图像只量化一次，所有窗口及递归细化都复用
+    bins = __histogram_bins(screen_image)
+    widget_hist = __widget_histogram(widget_image)
+    return __bh_match_loop(bins, widget_hist, [0, 0, screen_w, screen_h], w, h, 1)
 
 #opencv模板匹配算法
-def __opencv_template_match(screen_image_path, widget_image_path, opencv_algorithm):
-    screen_image = cv2.imread(screen_image_path)
-    widget_image = cv2.imread(widget_image_path)
+def __opencv_template_match(screen_image, widget_image, opencv_algorithm):
+    screen_image_path = image_name(screen_image)
+    widget_image_path = image_name(widget_image)
+    screen_image = read_image(screen_image)
+    widget_image = read_image(widget_image)
     
     w,h,_ = widget_image.shape
     
@@ -243,54 +303,226 @@ def __opencv_template_match(screen_image_path, widget_image_path, opencv_algorit
     return template_match_result
 
 # 相关系数匹配
-def tm_ccoeff_match(screen_image_path, widget_image_path):
-    return __opencv_template_match(screen_image_path, widget_image_path, cv2.TM_CCOEFF)
+def tm_ccoeff_match(screen_image, widget_image):
+    return __opencv_template_match(screen_image, widget_image, cv2.TM_CCOEFF)
 
 # 归一化相关系数匹配
-def tm_ccoeff_normed_match(screen_image_path, widget_image_path):
-    return __opencv_template_match(screen_image_path, widget_image_path, cv2.TM_CCOEFF_NORMED)
+def tm_ccoeff_normed_match(screen_image, widget_image):
+    return __opencv_template_match(screen_image, widget_image, cv2.TM_CCOEFF_NORMED)
     
 # 相关匹配
-def tm_ccorr_match(screen_image_path, widget_image_path):
-    return __opencv_template_match(screen_image_path, widget_image_path, cv2.TM_CCORR)
+def tm_ccorr_match(screen_image, widget_image):
+    return __opencv_template_match(screen_image, widget_image, cv2.TM_CCORR)
 
 # 归一化相关匹配
-def tm_ccorr_normed_match(screen_image_path, widget_image_path):
-    return __opencv_template_match(screen_image_path, widget_image_path, cv2.TM_CCORR_NORMED)
+def tm_ccorr_normed_match(screen_image, widget_image):
+    return __opencv_template_match(screen_image, widget_image, cv2.TM_CCORR_NORMED)
 
 # 平方差匹配
-def tm_sqdiff_match(screen_image_path, widget_image_path):
-    return __opencv_template_match(screen_image_path, widget_image_path, cv2.TM_SQDIFF)
+def tm_sqdiff_match(screen_image, widget_image):
+    return __opencv_template_match(screen_image, widget_image, cv2.TM_SQDIFF)
 
 # 归一化平方差匹配
-def tm_sqdiff_normed_match(screen_image_path, widget_image_path):
-    return __opencv_template_match(screen_image_path, widget_image_path, cv2.TM_SQDIFF_NORMED)
+def tm_sqdiff_normed_match(screen_image, widget_image):
+    return __opencv_template_match(screen_image, widget_image, cv2.TM_SQDIFF_NORMED)
 
 
+#在匹配结果图中寻找互不重叠的最佳匹配位置
+def __find_match_peaks(match_result, peak_count, w, h, opencv_algorithm):
+    #对于平方差匹配结果越小越好，取反后统一按最大值寻找
+    if opencv_algorithm in [cv2.TM_SQDIFF, cv2.TM_SQDIFF_NORMED]:
+        scores = -match_result
+    else:
+        scores = match_result.copy()
+    suppressed = float(scores.min())
+    peaks = []
+    for i in range(peak_count):
+        _, max_val, _, max_loc = cv2.minMaxLoc(scores)
+        if peaks and max_val <= suppressed:
+            break
+        x, y = max_loc
+        peaks.append((x, y))
+        #抑制与该位置的匹配框重叠的其他结果，即横纵距离都小于控件宽高的位置
+        scores[max(0, y - h + 1): y + h,
+               max(0, x - w + 1): x + w] = suppressed
+    return peaks
+
+#opencv模板匹配算法，返回互不重叠的多个最佳匹配位置
+def opencv_template_match_top_k(screen_image, widget_image, opencv_algorithm, count):
+    """在一次匹配中获取多个控件实例的位置，对匹配结果图进行非极大值抑制
+    
+    Args:
+        screen_image: 屏幕图像
+        widget_image: 控件图像
+        opencv_algorithm: opencv模板匹配算法
+        count: 最多返回的结果数量
+    Returns:
+        TemplateMatchResult列表，按匹配程度从好到差排列
+    """
+    screen_image_path = image_name(screen_image)
+    widget_image_path = image_name(widget_image)
+    screen_image = read_image(screen_image)
+    widget_image = read_image(widget_image)
+    
+    widget_h, widget_w = widget_image.shape[:2]
+    match_result = cv2.matchTemplate(screen_image, widget_image, opencv_algorithm)
+    peaks = __find_match_peaks(match_result, count, widget_w, widget_h, opencv_algorithm)
+    template_match_results = []
+    for (x, y) in peaks:
+        template_match_result = TemplateMatchResult(float(match_result[y, x]), x, y,
+                                                    widget_h, widget_w)
+        template_match_result.image = screen_image_path
+        template_match_result.template = widget_image_path
+        template_match_results.append(template_match_result)
+    return template_match_results
+
+#图像金字塔由粗到细的opencv模板匹配算法
+def __pyramid_template_match(screen_image, widget_image, opencv_algorithm):
+    """先在缩小的图像金字塔顶层中寻找候选位置，再在原图中候选位置附近精确匹配
+    
+    Args:
+        screen_image: 屏幕图像
+        widget_image: 控件图像
+        opencv_algorithm: opencv模板匹配算法
+    Returns:
+        与__opencv_template_match相同的TemplateMatchResult
+    """
+    screen_image_path = image_name(screen_image)
+    widget_image_path = image_name(widget_image)
+    screen_image = read_image(screen_image)
+    widget_image = read_image(widget_image)
+    
+    widget_h, widget_w = widget_image.shape[:2]
+    #控件图像过小时减少金字塔层数
+    level = 0
+    while (level < Config.get_template_match_pyramid_depth()
+           and min(widget_w, widget_h) >> (level + 1) >= PYRAMID_MIN_TEMPLATE_SIZE):
+        level += 1
+    if level == 0:
+        return __opencv_template_match(screen_image, widget_image, opencv_algorithm)
+    
+    #生成金字塔顶层图像
+    screen_top, widget_top = screen_image, widget_image
+    for i in range(level):
+        screen_top = cv2.pyrDown(screen_top)
+        widget_top = cv2.pyrDown(widget_top)
+    top_h, top_w = widget_top.shape[:2]
+    coarse_result = cv2.matchTemplate(screen_top, widget_top, opencv_algorithm)
+    candidates = __find_match_peaks(coarse_result, PYRAMID_CANDIDATE_COUNT,
+                                    top_w, top_h, opencv_algorithm)
+    
+    #在原图的候选位置附近进行精确匹配，误差范围为一个顶层像素
+    scale = 2 ** level
+    margin = scale + 1
+    screen_h, screen_w = screen_image.shape[:2]
+    template_match_result = None
+    for (cx, cy) in candidates:
+        x1 = max(0, cx * scale - margin)
+        y1 = max(0, cy * scale - margin)
+        x2 = min(screen_w, cx * scale + widget_w + margin)
+        y2 = min(screen_h, cy * scale + widget_h + margin)
+        match_result = cv2.matchTemplate(screen_image[y1:y2, x1:x2], widget_image, opencv_algorithm)
+        min_val, max_val, min_loc, max_loc = cv2.minMaxLoc(match_result)
+        if opencv_algorithm in [cv2.TM_SQDIFF, cv2.TM_SQDIFF_NORMED]:
+            # 对于平方差匹配和归一化平方匹配要结果越小表明匹配成果越好
+            if template_match_result is None or min_val < template_match_result.get_similarity():
+                template_match_result = TemplateMatchResult(min_val, x1 + min_loc[0], y1 + min_loc[1],
+                                                            widget_h, widget_w)
+        else:
+            if template_match_result is None or max_val > template_match_result.get_similarity():
+                template_match_result = TemplateMatchResult(max_val, x1 + max_loc[0], y1 + max_loc[1],
+                                                            widget_h, widget_w)
+
+    template_match_result.image = screen_image_path
+    template_match_result.template = widget_image_path
+    return template_match_result
+
+# 基于图像金字塔的归一化相关系数匹配
+def tm_ccoeff_normed_pyramid_match(screen_image, widget_image):
+    return __pyramid_template_match(screen_image, widget_image, cv2.TM_CCOEFF_NORMED)
+
+
+class WidgetFeatures(object):
+    """控件图像的特征点及描述子
+    
+    Attributes:
+        points: float32数组 (N, 2), 特征点坐标
+        descriptors: float32数组 (N, D), 特征点描述子
+        shape: 控件图像的(高, 宽)
+    """
+    
+    def __init__(self, points, descriptors, shape):
+        self.points = points
+        self.descriptors = descriptors
+        self.shape = tuple(shape)
+
+
+# 特征点检测器的创建函数
+FEATURE_DETECTOR_BUILDERS = {
+            'sift': lambda: cv2.xfeatures2d.SIFT_create(),
+            'surf': lambda: cv2.xfeatures2d.SURF_create(400)
+        }
+
+# 特征点检测器和FLANN匹配器在每个线程内只创建一次
+_feature_local = threading.local()
+
+def __get_feature_detector(algorithm):
+    detectors = getattr(_feature_local, 'detectors', None)
+    if detectors is None:
+        detectors = _feature_local.detectors = {}
+    if algorithm not in detectors:
+        detectors[algorithm] = FEATURE_DETECTOR_BUILDERS[algorithm]()
+    return detectors[algorithm]
+
+def __get_flann_matcher():
+    flann = getattr(_feature_local, 'flann', None)
+    if flann is None:
+        FLANN_INDEX_KDTREE = 0
+        index_params = dict(algorithm = FLANN_INDEX_KDTREE, trees = 5)#KTreeIndex配置索引，指定待处理核密度树的数量
+        search_params = dict(checks = 60)#指定递归遍历的次数。值越高结果越准确
+        flann = _feature_local.flann = cv2.FlannBasedMatcher(index_params, search_params)
+    return flann
+
+def compute_widget_features(algorithm, widget_image):
+    """计算控件图像的特征点及描述子
+    
+    Args:
+        algorithm: 特征点算法, 'sift' 或 'surf'
+        widget_image: 控件图像路径或图像数组
+    Returns:
+        WidgetFeatures
+    """
+    widget_image = read_image(widget_image, cv2.IMREAD_GRAYSCALE)
+    detector = __get_feature_detector(algorithm)
+    kp, des = detector.detectAndCompute(widget_image, None)
+    points = np.float32([k.pt for k in kp]).reshape(-1, 2)
+    if des is None:
+        des = np.zeros((0, detector.descriptorSize()), np.float32)
+    return WidgetFeatures(points, des, widget_image.shape[:2])
+
 # FlannBasedMatcher算法实现
-def __flann_based_matcher(screen_image_path, widget_image_path, fbm_algorithm):
-    
-    screen_image = cv2.imread(screen_image_path, 1)#读取模板图片，大图
-    widget_image = cv2.imread(widget_image_path, 0)#目标控件，小图
-    #找出图像中的关键点
-    kp1, des1 = fbm_algorithm.detectAndCompute(widget_image, None)
-    kp2, des2 = fbm_algorithm.detectAndCompute(screen_image, None)
-  
-    FLANN_INDEX_KDTREE = 0
-    index_params = dict(algorithm = FLANN_INDEX_KDTREE, trees = 5)#KTreeIndex配置索引，指定待处理核密度树的数量
-    search_params = dict(checks = 60)#指定递归遍历的次数。值越高结果越准确
-    
-    flann = cv2.FlannBasedMatcher(index_params, search_params)
-    matches = flann.knnMatch(des1, des2, k=2)#进行匹配，
+def __flann_based_matcher(screen_image, widget_image, widget_features, algorithm):
+    
+    screen_image_path = image_name(screen_image)
+    widget_image_path = image_name(widget_image)
+    screen_image = read_image(screen_image, cv2.IMREAD_COLOR)#读取模板图片，大图
+    #控件特征点已预先计算时，只需检测屏幕图像的特征点
+    if widget_features is None:
+        widget_features = compute_widget_features(algorithm, widget_image)
+    des1 = widget_features.descriptors
+    kp2, des2 = __get_feature_detector(algorithm).detectAndCompute(screen_image, None)
+    
     good_dot = []
-    for m,n in matches:
-        if m.distance < 0.6 * n.distance:
-            """
-            ratio=0. 4：对于准确度要求高的匹配； 
-            ratio=0. 6：对于匹配点数目要求比较多的匹配；
-            ratio=0. 5：一般情况下。
-            """
-            good_dot.append(m)
+    if len(des1) >= 2 and des2 is not None and len(des2) >= 2:
+        matches = __get_flann_matcher().knnMatch(des1, des2, k=2)#进行匹配，
+        for m,n in matches:
+            if m.distance < 0.6 * n.distance:
+                """
+                ratio=0. 4：对于准确度要求高的匹配； 
+                ratio=0. 6：对于匹配点数目要求比较多的匹配；
+                ratio=0. 5：一般情况下。
+                """
+                good_dot.append(m)
             
 #    print('good dot count:{}'.format(len(good_dot)))
     
@@ -305,11 +537,11 @@ def __flann_based_matcher(screen_image_path, widget_image_path, fbm_algorithm):
     # trainIdx    是匹配之后所对应关键点的序号，大图片的匹配关键点序号
     screen_pts = np.float32([kp2[m.trainIdx].pt for m in good_dot]).reshape(-1, 1, 2)
     # queryIdx  是匹配之后所对应关键点的序号，控件图片的匹配关键点序号
-    widget_pts = np.float32([kp1[m.queryIdx].pt for m in good_dot]).reshape(-1, 1, 2)
+    widget_pts = widget_features.points[[m.queryIdx for m in good_dot]].reshape(-1, 1, 2)
     #计算变换矩阵和MASK
     M, mask = cv2.findHomography(widget_pts, screen_pts, cv2.RANSAC, 5.0)
     
-    h,w = widget_image.shape
+    h,w = widget_features.shape
     try:     
         pts = np.float32([[0, 0], [0, h-1], [w-1, h-1], [w-1, 0]]).reshape(-1, 1, 2)
         dst = cv2.perspectiveTransform(pts, M)
@@ -331,20 +563,36 @@ def __flann_based_matcher(screen_image_path, widget_image_path, fbm_algorithm):
     
 
 # 基于FlannBasedMatcher的SIFT实现模板匹配
-def sift_match(screen_image_path, widget_image_path):
-    sift = cv2.xfeatures2d.SIFT_create()
-    return __flann_based_matcher(screen_image_path, widget_image_path, sift)
+def sift_match(screen_image, widget_image, widget_features=None):
+    return __flann_based_matcher(screen_image, widget_image, widget_features, 'sift')
 
 # 基于FlannBasedMatcher的SURF实现
-def surf_match(screen_image_path, widget_image_path):
-    surf = cv2.xfeatures2d.SURF_create(400)
-    return __flann_based_matcher(screen_image_path, widget_image_path, surf)
+def surf_match(screen_image, widget_image, widget_features=None):
+    return __flann_based_matcher(screen_image, widget_image, widget_features, 'surf')
+
+
+# 可以返回多个匹配位置的算法及其对应的opencv模板匹配算法
+OPENCV_TEMPLATE_MATCH_METHODS = {
+            'tcf': cv2.TM_CCOEFF,
+            'tcfn': cv2.TM_CCOEFF_NORMED,
+            'tcfn_pyr': cv2.TM_CCOEFF_NORMED,
+            'tcr': cv2.TM_CCORR,
+            'tcrn': cv2.TM_CCORR_NORMED,
+            'ts': cv2.TM_SQDIFF,
+            'tsn': cv2.TM_SQDIFF_NORMED
+        }
+
+# 可以使用预先计算的控件特征点的匹配算法
+FEATURE_TEMPLATE_MATCHERS = {'sift', 'surf'}
 
+# 使用灰度控件图像的匹配算法
+GRAY_TEMPLATE_MATCHERS = {'sift', 'surf'}
 
 TEMPLATE_MATCHERS = {
             'bbs': bbs_tempalte_match,
             'tcf': tm_ccoeff_match,
             'tcfn':tm_ccoeff_normed_match,
+            'tcfn_pyr':tm_ccoeff_normed_pyramid_match,
             'tcr': tm_ccorr_match,
             'tcrn':tm_ccorr_normed_match,
             'ts' : tm_sqdiff_match,
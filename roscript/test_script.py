@@ -81,6 +81,12 @@ class TestScript(object):
         return path.join(TestScript.script_temporary_dir(),
                          TestScript.get_pyname())
     
+    @staticmethod  
+    def get_screenshot_image_path(screen_shot_index):
+        """获取拍摄的屏幕图像的存储路径"""
+        return path.join(TestScript.script_temporary_dir(),
+                         '{}_{}.png'.format(TestScript.get_pyname(), screen_shot_index))
+    
     @staticmethod  
     def get_detour_image_path():
         """获取规避运动中间图片的路径"""
@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+"""
+Loopback tests of the serial channel with the simulated EBB board
+
+    python -m unittest discover -s tests
+"""
+
+import os
+import sys
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from serial_channel import FakeEbbSerial, SerialChannel
+
+
+class SerialChannelTest(unittest.TestCase):
+
+    def setUp(self):
+        self.channel = SerialChannel(FakeEbbSerial())
+
+    def test_query_after_timeout_while_discarding(self):
+        """丢弃之前的返回值时超时，超时查询的返回值不能作为之后查询的返回值"""
+        for i in range(3):
+            self.channel.send('XM,600,10,10\r')
+        # 缓冲区已满，之前的'OK'和QM的返回值都在超时之后才到达
+        self.assertEqual(self.channel.query('QM\r'), [])
+        time.sleep(2)
+        self.assertEqual(self.channel.query('QM\r'), ['QM,0,0,0,0'])
+        self.assertEqual(self.channel.pending_lines, 0)
+
+    def test_query_many(self):
+        replies = self.channel.query_many(['V\r', 'QM\r'])
+        self.assertTrue(replies[0][0].startswith('EBB'))
+        self.assertEqual(replies[1], ['QM,0,0,0,0'])
+
+
+if __name__ == '__main__':
+    unittest.main()
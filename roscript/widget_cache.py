@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+"""
+Process-wide cache of decoded and scaled widget templates
+"""
+
+import os
+import threading
+from collections import OrderedDict
+
+import cv2
+
+from config import Config
+
+
+class WidgetCache(object):
+    """控件模板缓存，按最近最少使用(LRU)策略淘汰
+
+    缓存键为: 模板图像路径、文件修改时间、控件的.snapscreen文件及其修改时间、缩放所依据的设备轮廓、是否灰度,
+    控件图像或.snapscreen文件被替换、设备轮廓重新标定后会自动重新生成模板
+
+    Attributes:
+        capacity: int, 最大缓存模板数量，为空时第一次缓存模板时读取配置
+        templates: OrderedDict, 缓存的模板图像
+        hits: int, 缓存命中次数
+        misses: int, 缓存未命中次数
+    """
+
+    def __init__(self, capacity=None):
+        self.capacity = capacity
+        self.templates = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get_template(self, image_path, contour, build, gray=False, snapscreen_path=None):
+        """获取缓存的模板图像
+
+        Args:
+            image_path: 模板图像路径
+            contour: 模板缩放所依据的设备轮廓或屏幕尺寸
+            build: 缓存未命中时生成模板的函数，参数为原始BGR图像，返回缩放后的图像和缩放比例(未缩放时为None)
+            gray: 是否返回灰度模板
+            snapscreen_path: 记录控件采集时设备轮廓的.snapscreen文件路径，没有时为None
+        Returns:
+            (模板图像数组, 缩放比例)，调用者不能修改返回的数组
+        """
+        mtime = os.path.getmtime(image_path)
+        snapscreen = None if snapscreen_path is None else (snapscreen_path, os.path.getmtime(snapscreen_path))
+        key = (image_path, mtime, snapscreen, tuple(contour), gray)
+        with self.lock:
+            if key in self.templates:
+                self.hits += 1
+                self.templates.move_to_end(key)
+                return self.templates[key]
+
+        template = cv2.imread(image_path)
+        if template is None:
+            raise FileNotFoundError(image_path)
+        template, scaling = build(template)
+        if gray:
+            template = cv2.cvtColor(template, cv2.COLOR_BGR2GRAY)
+        # 缓存的模板为只读，防止被匹配算法修改
+        template.setflags(write=False)
+
+        with self.lock:
+            self.misses += 1
+            # 控件图像或.snapscreen文件被替换后，旧的模板不再有效
+            for stale_key in [k for k in self.templates
+                              if k[0] == image_path and k[1:3] != (mtime, snapscreen)]:
+                del self.templates[stale_key]
+            self.templates[key] = (template, scaling)
+            if self.capacity is None:
+                self.capacity = Config.get_widget_cache_size()
+            while len(self.templates) > self.capacity:
+                self.templates.popitem(last=False)
+        return template, scaling
+
+    def clear(self):
+        """清空缓存"""
+        with self.lock:
+            self.templates.clear()
+            self.hits = 0
+            self.misses = 0
+
+
+WIDGET_CACHE = WidgetCache()
@@ -1,12 +1,10 @@
 import statistics
 
-import cv2
 import os
-from ruamel import yaml
 from .frame import Frame
 from .action import ClickAction, DoubleClickAction, LongPressAction, DragAction, SwipeAction, PressKeyboardAction, UnknownAction
 from .abstract_video import AbstractVideo
-from .keyboard import Keyboard
+from .keyboard import load_keyboard
 from ..processors import group_processor, action_processor
 from ..processors import handcolor
 from ..constants import *
@@ -44,16 +42,10 @@ class DualCamVideo(AbstractVideo):
             return None
         keyboards = {}
         for keyboard_name in os.listdir(self.keyboards_dir):
-            keyboard_dir = os.path.join(self.keyboards_dir, keyboard_name)
-            keyboard_image_path = os.path.join(keyboard_dir, "keyboard.png")
-            keyboard_model_path = os.path.join(keyboard_dir, "keyboard.yaml")
-            if not (os.path.exists(keyboard_image_path) and os.path.exists(keyboard_model_path)):
+            keyboard = load_keyboard(os.path.join(self.keyboards_dir, keyboard_name))
+            if keyboard is None:
                 continue
-            keyboard_image = cv2.imread(keyboard_image_path)
-            with open(keyboard_model_path,'r') as f:
-                keyboard_model = yaml.load(f, Loader=yaml.Loader)
-            key_distribution = Keyboard(keyboard_model).get_key_distribution()
-            keyboards[keyboard_name] = {"image":keyboard_image, "key_distribution":key_distribution}
+            keyboards[keyboard_name] = keyboard
         return keyboards if len(keyboards) > 0 else None
     
     def get_sidelook_touch_threshold(self, action_fingertip_groups):
@@ -1,5 +1,72 @@
+import hashlib
+import os
+import tempfile
+
+import cv2
+import numpy as np
+from ruamel import yaml
+
 from .area import Area
 
+KEYBOARD_CACHE_VERSION = 1
+KEYBOARD_CACHE_NAME = "keyboard.recorder.kbc.npz"
+
+def get_content_hash(*paths):
+    sha1 = hashlib.sha1()
+    for path in paths:
+        with open(path, 'rb') as f:
+            sha1.update(f.read())
+    return sha1.hexdigest()
+
+def load_keyboard(keyboard_dir):
+    """Load the keyboard image and key distribution of a keyboard directory.
+    The parsed keyboard is cached in the directory and keyed by the content hash
+    of keyboard.png and keyboard.yaml, so it is only parsed again after a change.
+    Returns None if the directory is not a keyboard.
+    """
+    image_path = os.path.join(keyboard_dir, "keyboard.png")
+    model_path = os.path.join(keyboard_dir, "keyboard.yaml")
+    if not (os.path.exists(image_path) and os.path.exists(model_path)):
+        return None
+    content_hash = get_content_hash(image_path, model_path)
+    cache_path = os.path.join(keyboard_dir, KEYBOARD_CACHE_NAME)
+    keyboard = _load_keyboard_cache(cache_path, content_hash)
+    if keyboard is None:
+        image = cv2.imread(image_path)
+        with open(model_path, 'r') as f:
+            model = yaml.load(f, Loader=yaml.Loader)
+        keyboard = {"image": image, "key_distribution": Keyboard(model).get_key_distribution()}
+        _save_keyboard_cache(cache_path, content_hash, keyboard)
+    return keyboard
+
+def _load_keyboard_cache(cache_path, content_hash):
+    if not os.path.isfile(cache_path):
+        return None
+    try:
+        with np.load(cache_path) as data:
+            if int(data["version"]) != KEYBOARD_CACHE_VERSION or str(data["hash"]) != content_hash:
+                return None
+            key_distribution = {str(c): PercentArea(*area) for c, area in zip(data["keys"], data["areas"].tolist())}
+            return {"image": data["image"], "key_distribution": key_distribution}
+    except (OSError, ValueError, KeyError):
+        return None
+
+def _save_keyboard_cache(cache_path, content_hash, keyboard):
+    key_distribution = keyboard["key_distribution"]
+    areas = [percent_area.lt + percent_area.rb for percent_area in key_distribution.values()]
+    temp_path = None
+    try:
+        fd, temp_path = tempfile.mkstemp(suffix=".npz", dir=os.path.dirname(cache_path))
+        with os.fdopen(fd, 'wb') as f:
+            np.savez(f, version=KEYBOARD_CACHE_VERSION, hash=content_hash, image=keyboard["image"],
+                     keys=np.array(list(key_distribution), dtype=str),
+                     areas=np.array(areas, dtype=float).reshape(-1, 4))
+        os.replace(temp_path, cache_path)
+    except OSError:
+        # keyboard directory is read-only, keep the parsed keyboard in memory only
+        if temp_path is not None and os.path.exists(temp_path):
+            os.remove(temp_path)
+
 class PercentArea:
     def __init__(self, x1, y1, x2, y2):
         self.lt = (x1, y1)